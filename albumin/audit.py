@@ -0,0 +1,196 @@
+# Albumin Audit
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Checks every file in the index for what the commit-msg hook checks per
+commit: a datetime and a known method for its key, year, month and day
+fields matching the datetime, a valid timezone, and a name made from
+the datetime in UTC, in the repo's layout.
+
+The index is split into shards that worker processes check on their
+own, each reading its symlinks from git and the metadata of its keys
+from the metadata store in bulk. Problems are tab-separated lines of
+problem, path, key and detail, which fix and apply can take back.
+"""
+
+import os
+import sqlite3
+from datetime import datetime
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+
+import pytz
+
+from albumin.lazy import lazy_import
+from albumin.layout import Layout
+from albumin.metastore import field_values
+from albumin import trace
+
+pygit2 = lazy_import('pygit2')
+
+fields = ('datetime', 'datetime-method', 'timezone', 'year', 'month', 'day')
+
+# Problems fix can correct by renaming, and apply by rewriting fields.
+fixable = {'bad-name'}
+appliable = {'bad-fields'}
+
+# Git objects and metadata of a worker process, opened once.
+_handles = {}
+
+
+@lru_cache(maxsize=None)
+def valid_timezone(name):
+    try:
+        pytz.timezone(name)
+    except pytz.UnknownTimeZoneError:
+        return False
+    return True
+
+
+@lru_cache(maxsize=4096)
+def parse_datetime(value):
+    return datetime.strptime(value, '%Y-%m-%d@%H-%M-%S')
+
+
+def matches_name(path, name_fmt):
+    prefix, _, suffix = name_fmt.partition('{:02}')
+    slot = path[len(prefix):len(path) - len(suffix)]
+    return len(path) == len(prefix) + 2 + len(suffix) \
+        and path.startswith(prefix) and path.endswith(suffix) \
+        and slot.isdigit()
+
+
+def check_file(path, values, methods, layout=Layout()):
+    """
+    Returns (problem, detail) pairs for a file at path whose key has
+    the given {field: values} metadata.
+    """
+    problems = []
+
+    method_values = values.get('datetime-method', [])
+    if len(method_values) != 1 or method_values[0] not in methods:
+        problems.append(('bad-method', ' '.join(method_values)))
+
+    for zone in values.get('timezone', []):
+        if not valid_timezone(zone):
+            problems.append(('bad-timezone', zone))
+    if len(values.get('timezone', [])) > 1:
+        problems.append(('bad-timezone', ' '.join(values['timezone'])))
+
+    dt_values = values.get('datetime', [])
+    if not dt_values:
+        problems.append(('no-datetime', ''))
+        return problems
+
+    value = dt_values[0]
+    try:
+        if len(dt_values) != 1:
+            raise ValueError(dt_values)
+        utc = parse_datetime(value)
+    except ValueError:
+        problems.append(('bad-datetime', ' '.join(dt_values)))
+        return problems
+
+    expected = (value[:4], value[5:7], value[8:10])
+    actual = tuple(values.get(f, []) for f in ('year', 'month', 'day'))
+    if actual != tuple([v] for v in expected):
+        problems.append((
+            'bad-fields', 'year={} month={} day={}'.format(*expected),
+        ))
+
+    name_fmt = layout.name(utc, os.path.splitext(path)[1])
+    if not matches_name(path, name_fmt):
+        problems.append(('bad-name', name_fmt))
+
+    return problems
+
+
+def audit_shard(git_dir, db_path, entries, methods, layout=Layout()):
+    """
+    Checks a shard of (path, oid) index entries. Meant to run in a
+    worker process, reading from its own repository and database.
+    """
+    try:
+        repo, db = _handles[git_dir, db_path]
+    except KeyError:
+        repo = pygit2.Repository(git_dir)
+        db = sqlite3.connect(db_path)
+        _handles[git_dir, db_path] = repo, db
+
+    methods = set(methods)
+    keys = [
+        (path, repo[oid].data.decode().split('/')[-1])
+        for path, oid in entries
+    ]
+    values = field_values(db, fields, {key for _, key in keys})
+
+    results = []
+    for path, key in keys:
+        for problem, detail in check_file(
+                path, values.get(key, {}), methods, layout):
+            results.append((problem, path, key, detail))
+    return results
+
+
+@trace.traced()
+def audit(repo, store, methods, jobs=None, shard_size=5000,
+          layout=Layout()):
+    """
+    Checks all symlinks in the repo's index in shards of shard_size
+    files, on jobs worker processes. Yields (problem, path, key,
+    detail) in index order.
+    """
+    repo.index.read()
+    entries = [
+        (entry.path, str(entry.id)) for entry in repo.index
+        if entry.mode == pygit2.GIT_FILEMODE_LINK
+    ]
+    trace.count('audited files', len(entries))
+    shards = [
+        entries[i:i + shard_size]
+        for i in range(0, len(entries), shard_size)
+    ]
+    if not shards:
+        return
+
+    methods = list(methods)
+    with ProcessPoolExecutor(jobs or os.cpu_count()) as pool:
+        results = pool.map(
+            audit_shard,
+            *zip(*(
+                (repo.path, store.path, shard, methods, layout)
+                for shard in shards
+            ))
+        )
+        for problems in results:
+            yield from problems
+
+
+def format_problem(problem, path, key, detail):
+    return '\t'.join((problem, path, key, detail))
+
+
+def parse_problems(lines):
+    """
+    Parses problem lines printed by audit, skipping blank and comment
+    lines. Yields (problem, path, key, detail).
+    """
+    for line in lines:
+        line = line.rstrip('\n')
+        if not line or line.startswith('#'):
+            continue
+        problem, path, key, detail = line.split('\t', 3)
+        yield problem, path, key, detail
@@ -20,23 +20,71 @@
 Albumin. Manages photographs using a git-annex repository.
 
 Usage:
-    albumin init [-r=<repo>]
-    albumin uninit [-r=<repo>]
-    albumin analyze [<path>] [-s] [-m] [-r=<repo>] [-T=<tz>]
-    albumin import <path> [-m] [-r=<repo>] [-T=<tz>] [-t=<tag>:<value>]...
-    albumin fix [<path>] [-r=<repo>]
+    albumin init [-r=<repo>] [--trace=<file>]
+    albumin uninit [-r=<repo>] [--trace=<file>]
+    albumin analyze [<path>] [-s] [-m] [-p] [-r=<repo>] [-T=<tz>]
+                    [--timings] [--trace=<file>]
+    albumin analyze <path> --max-memory=<size> [-s] [-m] [-p] [-r=<repo>]
+                    [-T=<tz>] [--timings] [--trace=<file>]
+    albumin analyze <path> --partial [-m] [-r=<repo>] [-T=<tz>]
+                    [--jobs=<n>] [--trace=<file>]
+    albumin merge-reports <report>... [-s] [-r=<repo>] [--trace=<file>]
+    albumin import <path> [-m] [-p] [--keep] [-r=<repo>] [-T=<tz>]
+                   [-t=<tag>:<value>]... [--trace=<file>]
+    albumin watch <path> [-m] [-r=<repo>] [-T=<tz>] [-t=<tag>:<value>]...
+                  [--quiet=<seconds>] [--batch=<n>] [--trace=<file>]
+    albumin fix [<path>] [-r=<repo>] [--trace=<file>]
+    albumin fix --audit=<file> [-r=<repo>] [--trace=<file>]
+    albumin relayout [<layout>] [-r=<repo>] [--trace=<file>]
     albumin apply [<path>] [-r=<repo>] [-t=<tag>:<value>]...
+                  [--trace=<file>]
+    albumin apply --audit=<file> [-r=<repo>] [--trace=<file>]
+    albumin audit [--jobs=<n>] [-r=<repo>] [--trace=<file>]
+    albumin cache (rebuild|check) [-r=<repo>] [--trace=<file>]
+    albumin queue [--drain|--retry|--drop] [-r=<repo>] [--trace=<file>]
+    albumin sessions [(resume|abort) <id>...] [-r=<repo>] [--trace=<file>]
+    albumin views [<field>...] [-r=<repo>] [--trace=<file>]
+    albumin query [-d=<date>] [--from=<date>] [--to=<date>]
+                  [-t=<tag>:<value>]... [--method=<method>]...
+                  [--below=<method>] [--limit=<n>] [--offset=<n>] [-k]
+                  [-r=<repo>] [--trace=<file>]
+    albumin export (<dest>|-) [-d=<date>] [--from=<date>] [--to=<date>]
+                   [-t=<tag>:<value>]... [--method=<method>]...
+                   [--below=<method>] [--volume-size=<size>]
+                   [--level=<n>] [--jobs=<n>] [-r=<repo>] [--trace=<file>]
+    albumin phash [-r=<repo>] [--trace=<file>]
+    albumin calckey <path> [--check] [-r=<repo>] [--trace=<file>]
+    albumin daemon [--stop] [--idle=<seconds>] [-r=<repo>] [--trace=<file>]
 
 Actions:
     init                    Initialize the repo and set up git hooks
     uninit                  Remove albumin git hooks in the repo
     analyze                 Analyze files in the repo's staging area
     analyze <path>          Analyze the files at <path>
+    merge-reports           Combine partial reports from analyze --partial
     import <path>           Import files from <path>
+    watch <path>            Import files as they appear in <path>
     fix                     Fix the filenames of all images
     fix <path>              Fix the filenames of images in <path>
+    relayout                Move files into albumin.layout's folders
+    relayout <layout>       Set albumin.layout (like YYYY/MM/) and relayout
     apply                   Apply the analysis from stdin to metadata
     apply <path>            Apply the analysis report to metadata
+    audit                   Check all files' names and date metadata
+    cache rebuild           Rebuild the local metadata store from git-annex
+    cache check             Compare the metadata store with git-annex
+    queue                   List commits whose metadata isn't applied yet
+    sessions                List interrupted import sessions
+    sessions resume <id>... Finish and commit interrupted import sessions
+    sessions abort <id>...  Delete interrupted import sessions
+    views                   Update the views/year-month-day branch
+    views <field>...        Update a views/ branch with folders by fields
+    query                   List files matching dates, tags and methods
+    export <dest>           Write files matching a query to a tar.gz
+    export -                Write the tar.gz to stdout
+    phash                   Index perceptual hashes of the repo's images
+    calckey <path>          Print the git-annex keys of files at <path>
+    daemon                  Serve the repo's git hooks from one process
 
 Options:
     -r, --repo=<repo>         Git-annex repository to use. [default: .]
@@ -44,42 +92,113 @@ Options:
     -t, --tag=<tag>:<value>   Tags to add to all imported files.
     -s, --short               Print analysis report in the short format
     -m, --mtime               Use file modify time as a valid image date
+    -p, --phash               Date files like similar images in the repo
+    --timings                 Print the time spent in each date extractor
+    --partial                 Print a partial report with keys and dates
+                              that merge-reports can combine, without
+                              using the repo's metadata
+    --max-memory=<size>       Analyze <path> in partitions that fit in
+                              about this much memory (like 512M), with
+                              intermediate results on disk
+    --trace=<file>            Write a Chrome trace of this run to <file>
+    -d, --date=<date>         Only files from this YYYY[-MM[-DD]] in UTC
+    --from=<date>             Only files from this date or later
+    --to=<date>               Only files from this date or earlier
+    --method=<method>         Only files dated with this method
+    --below=<method>          Only files dated with worse methods than this
+    --limit=<n>               Print at most <n> results
+    --offset=<n>              Skip the first <n> results [default: 0]
+    -k, --keys                Print keys instead of paths
+    --quiet=<seconds>         Wait this long after a file's last change
+                              before importing it [default: 2]
+    --batch=<n>               Import at most <n> files per commit
+                              [default: 100]
+    --volume-size=<size>      Split the export into <dest>.000, <dest>.001
+                              and so on, of this size (like 4G or 700M)
+    --level=<n>               Gzip level, 0 for an uncompressed tar
+                              [default: 1]
+    --jobs=<n>                Threads to hash or compress with, or
+                              processes to audit with [default: 0]
+    --audit=<file>            Fix names or rewrite date fields of the
+                              problems audit printed to <file>
+    --check                   Compare keys with git annex calckey
+    --keep                    Leave the imported files in <path>
+    --drain                   Apply the queued metadata and wait for it
+    --retry                   Queue the failed reports again and apply them
+    --drop                    Delete the failed reports
+    --stop                    Stop the running daemon
+    --idle=<seconds>          Exit after this long without requests
+
+Environment:
+    ALBUMIN_TRACE             Append Chrome traces of git hooks and
+                              commands to this file
 
 """
 
 import os
 import sys
-import pytz
-from docopt import docopt
 
-import albumin.core
-from albumin.repo import AlbuminRepo
+import albumin.trace
+from albumin.lazy import lazy_import
 from albumin.hooks import git_hooks
 
+docopt = lazy_import('docopt')
+pytz = lazy_import('pytz')
+lazy_import('albumin.core')
+lazy_import('albumin.daemon')
+lazy_import('albumin.repo')
+lazy_import('albumin.query')
+lazy_import('albumin.utils')
+
 
 def main():
     name = os.path.basename(sys.argv[0])
     version = '0.1.0'
 
     if name in git_hooks:
+        if os.getenv('ALBUMIN_TRACE'):
+            albumin.trace.enable(
+                os.getenv('ALBUMIN_TRACE'),
+                name='albumin {}'.format(name),
+                append=True,
+            )
+
         hook = git_hooks[name]
-        args = docopt(hook.__doc__, version=version)
-        retval = hook(args)
+        args = docopt.docopt(hook.__doc__, version=version)
+        try:
+            retval = albumin.daemon.run_hook(name, args)
+        except albumin.daemon.NoDaemon:
+            retval = hook(args)
         if retval:
             print('Aborting commit.')
         sys.exit(retval)
 
-    args = docopt(__doc__, version=version)
+    args = docopt.docopt(__doc__, version=version)
+
+    if args.get('--trace') or os.getenv('ALBUMIN_TRACE'):
+        command = next(
+            c for c, v in args.items()
+            if v is True and not c.startswith('-')
+        )
+        albumin.trace.enable(
+            args.get('--trace') or os.getenv('ALBUMIN_TRACE'),
+            name='albumin {}'.format(command),
+            append=not args.get('--trace'),
+        )
 
     if args.get('--repo'):
         try:
-            args['--repo'] = AlbuminRepo(args['--repo'])
+            args['--repo'] = albumin.repo.AlbuminRepo(args['--repo'])
         except ValueError:
-            repo_cmds = ['import', 'fix', 'apply']
+            repo_cmds = [
+                'import', 'watch', 'fix', 'apply', 'cache', 'queue', 'query',
+                'export', 'phash', 'calckey', 'daemon', 'merge-reports',
+                'views', 'audit', 'relayout', 'sessions',
+            ]
             if any(map(args.__getitem__, repo_cmds)):
                 raise
             elif args.get('init'):
-                args['--repo'] = AlbuminRepo(
+                args['--repo'] = albumin.repo.AlbuminRepo(
                     args['--repo'], create=True
                 )
             else:
@@ -90,7 +209,10 @@ def main():
         if args.get('--repo'):
             args['--repo'].timezone = args['--timezone']
 
-    if args.get('--tag'):
+    if args.get('--tag') and (args.get('query') or args.get('export')):
+        args['--tag'] = dict(t.split(':', 1) for t in args['--tag'])
+
+    elif args.get('--tag'):
         args['--tag'] = dict(t.split(':') for t in args['--tag'])
         for tag, value in args['--tag'].items():
             if tag in args['--repo'].annex.internal_tags:
@@ -103,12 +225,24 @@ def main():
     if args.get('<path>'):
         args['<path>'] = os.path.realpath(args['<path>'])
 
-    if args.get('analyze') and args.get('--repo'):
+    if args.get('analyze') and args.get('--partial'):
+        albumin.core.partial_analyze(
+            repo=args['--repo'],
+            path=args['<path>'],
+            timezone=args['--timezone'],
+            mtime=args['--mtime'],
+            threads=int(args['--jobs']) or None,
+        )
+
+    elif args.get('analyze') and args.get('--repo'):
         albumin.core.repo_analyze(
             repo=args['--repo'],
             path=args['<path>'],
             short=args['--short'],
             mtime=args['--mtime'],
+            phash=args['--phash'],
+            max_memory=albumin.utils.parse_size(args['--max-memory'])
+            if args['--max-memory'] else None,
         )
 
     elif args.get('init'):
@@ -123,6 +257,13 @@ def main():
             exec_path=sys.argv[0]
         )
 
+    elif args.get('merge-reports'):
+        albumin.core.merge_reports(
+            repo=args['--repo'],
+            paths=args['<report>'],
+            short=args['--short'],
+        )
+
     elif args.get('analyze'):
         albumin.core.imdate_analyze(
             path=args['<path>'],
@@ -136,6 +277,18 @@ def main():
             repo=args['--repo'],
             path=args['<path>'],
             mtime=args['--mtime'],
+            phash=args['--phash'],
+            keep=args['--keep'],
+            **args['--tag'],
+        )
+
+    elif args.get('watch'):
+        albumin.core.watch(
+            repo=args['--repo'],
+            path=args['<path>'],
+            quiet=float(args['--quiet']),
+            batch_size=int(args['--batch']),
+            mtime=args['--mtime'],
             **args['--tag'],
         )
 
@@ -143,14 +296,103 @@ def main():
         albumin.core.fix(
             repo=args['--repo'],
             path=args['<path>'],
+            audit_path=args['--audit'],
+        )
+
+    elif args.get('relayout'):
+        albumin.core.relayout(
+            repo=args['--repo'],
+            layout=args['<layout>'],
         )
 
     elif args.get('apply'):
         albumin.core.apply(
             repo=args['--repo'],
             path=args['<path>'],
+            audit_path=args['--audit'],
             **args['--tag'],
         )
 
+    elif args.get('audit'):
+        sys.exit(albumin.core.audit(
+            repo=args['--repo'],
+            jobs=int(args['--jobs']) or None,
+        ))
+
+    elif args.get('cache') and args.get('rebuild'):
+        albumin.core.cache_rebuild(repo=args['--repo'])
+
+    elif args.get('cache') and args.get('check'):
+        sys.exit(albumin.core.cache_check(repo=args['--repo']))
+
+    elif args.get('queue'):
+        albumin.core.queue(
+            repo=args['--repo'], drain=args['--drain'],
+            retry=args['--retry'], drop=args['--drop'],
+        )
+
+    elif args.get('sessions'):
+        albumin.core.sessions(
+            repo=args['--repo'], ids=args['<id>'],
+            resume=args['resume'], abort=args['abort'],
+        )
+
+    elif args.get('views'):
+        albumin.core.views(repo=args['--repo'], fields=args['<field>'])
+
+    elif args.get('query'):
+        albumin.core.query(
+            repo=args['--repo'],
+            query=make_query(args),
+            keys=args['--keys'],
+        )
+
+    elif args.get('export'):
+        sys.exit(albumin.core.export(
+            repo=args['--repo'],
+            query=make_query(args),
+            dest=args['<dest>'] or '-',
+            volume_size=albumin.utils.parse_size(args['--volume-size'])
+            if args['--volume-size'] else None,
+            level=int(args['--level']),
+            threads=int(args['--jobs']) or None,
+        ))
+
+    elif args.get('phash'):
+        albumin.core.phash_update(repo=args['--repo'])
+
+    elif args.get('calckey'):
+        sys.exit(albumin.core.calckey(
+            repo=args['--repo'],
+            path=args['<path>'],
+            check=args['--check'],
+        ))
+
+    elif args.get('daemon') and args.get('--stop'):
+        sys.exit(albumin.core.daemon_stop(repo=args['--repo']))
+
+    elif args.get('daemon'):
+        albumin.core.daemon(
+            repo=args['--repo'],
+            idle=float(args['--idle']) if args['--idle'] else None,
+        )
+
+    if args.get('--timings'):
+        albumin.core.print_timings()
+
+
+def make_query(args):
+    return albumin.query.Query(
+        date=args['--date'],
+        since=args['--from'],
+        until=args['--to'],
+        tags=args['--tag'],
+        methods=args['--method'],
+        below=args['--below'],
+        limit=int(args['--limit']) if args.get('--limit') else None,
+        offset=int(args.get('--offset') or 0),
+    )
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,399 @@
+# Albumin Containers
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Reads creation dates from ISO-BMFF (MP4, MOV, 3GP, HEIC) and RIFF
+(AVI, WAV) files by seeking through their boxes and chunks, without
+reading media data. Tags are named and formatted like exiftool's, so
+they can be used in place of its output. Files with anything these
+readers don't fully understand raise Unsupported, and should be sent
+to exiftool instead.
+"""
+
+import os
+import struct
+from datetime import datetime
+from datetime import timedelta
+
+from albumin import trace
+
+extensions = {
+    '.mp4', '.m4v', '.mov', '.qt', '.3gp', '.3g2',
+    '.heic', '.heif', '.avi', '.wav',
+}
+
+video_brands = {
+    b'isom', b'iso2', b'iso4', b'iso5', b'iso6', b'mp41', b'mp42',
+    b'avc1', b'M4V ', b'M4VH', b'M4VP', b'qt  ', b'3gp4', b'3gp5',
+    b'3gp6', b'3g2a', b'MSNV', b'XAVC',
+}
+
+image_brands = {b'heic', b'heix', b'mif1', b'msf1'}
+
+# udta atoms that exiftool reads no dates we use from
+plain_udta = {
+    b'meta', b'XMP_', b'hnti', b'hinf', b'name', b'smta', b'SDLN', b'auth',
+}
+
+# RIFF lists that only hold headers, INFO strings or media data
+plain_lists = {b'hdrl', b'strl', b'INFO', b'odml', b'movi'}
+
+# RIFF chunks whose dates exiftool combines or decodes in other ways
+special_chunks = {b'strd', b'ICRD', b'bext', b'EXIF'}
+
+qt_epoch = datetime(1904, 1, 1)
+
+exif_tags = {
+    (0, 0x0132): 'EXIF:ModifyDate',
+    (0x8769, 0x9003): 'EXIF:DateTimeOriginal',
+    (0x8769, 0x9004): 'EXIF:CreateDate',
+}
+
+month_numbers = {
+    name: num for num, name in enumerate([
+        'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+        'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec',
+    ], start=1)
+}
+
+
+class Unsupported(Exception):
+    pass
+
+
+def boxes(file, start, end):
+    offset = start
+    while offset + 8 <= end:
+        file.seek(offset)
+        size, type_ = struct.unpack('>I4s', file.read(8))
+        header = 8
+        if size == 1:
+            size, = struct.unpack('>Q', file.read(8))
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header or offset + size > end:
+            raise Unsupported('Truncated box', type_)
+        yield type_, offset + header, offset + size
+        offset += size
+
+
+def read_at(file, offset, size):
+    file.seek(offset)
+    data = file.read(size)
+    if len(data) != size:
+        raise Unsupported('Unexpected end of file')
+    return data
+
+
+def child(file, start, end, type_):
+    for type__, start_, end_ in boxes(file, start, end):
+        if type__ == type_:
+            return start_, end_
+    raise Unsupported('Missing box', type_)
+
+
+def qt_time(value):
+    if not value:
+        return None
+    dt = qt_epoch + timedelta(seconds=value)
+    return '{:%Y:%m:%d %H:%M:%S}'.format(dt)
+
+
+def creation_time(file, start):
+    version, = read_at(file, start, 1)
+    if version == 0:
+        created, = struct.unpack('>I', read_at(file, start + 4, 4))
+    elif version == 1:
+        created, = struct.unpack('>Q', read_at(file, start + 4, 8))
+    else:
+        raise Unsupported('Unknown box version', version)
+    return created
+
+
+def video_tags(file, end):
+    moov = None
+    for type_, start, stop in boxes(file, 0, end):
+        if type_ == b'uuid':
+            raise Unsupported('Vendor box')
+        if type_ == b'moov' and moov is None:
+            moov = start, stop
+    if moov is None:
+        raise Unsupported('Missing box', b'moov')
+
+    media_times = set()
+    for type_, start, stop in boxes(file, *moov):
+        if type_ == b'trak':
+            mdia = child(file, start, stop, b'mdia')
+            mdhd, _ = child(file, *mdia, b'mdhd')
+            media_times.add(creation_time(file, mdhd))
+        elif type_ == b'udta':
+            for type__, _, _ in boxes(file, start, stop):
+                if not type__.startswith(b'\xa9') \
+                        and type__ not in plain_udta:
+                    raise Unsupported('Vendor atom', type__)
+
+    if len(media_times) > 1:
+        raise Unsupported('Tracks created at different times')
+
+    tags = {}
+    for value in media_times:
+        if qt_time(value):
+            tags['QuickTime:MediaCreateDate'] = qt_time(value)
+    return tags
+
+
+def exif_item(file, start, end):
+    version, = read_at(file, start, 1)
+    if version != 0:
+        raise Unsupported('Unknown box version', version)
+
+    iinf = child(file, start + 4, end, b'iinf')
+    iloc = child(file, start + 4, end, b'iloc')
+
+    version, = read_at(file, iinf[0], 1)
+    count_size = 2 if version == 0 else 4
+    exif_id = None
+    for type_, start_, _ in boxes(file, iinf[0] + 4 + count_size, iinf[1]):
+        if type_ != b'infe':
+            continue
+        version, = read_at(file, start_, 1)
+        if version == 2:
+            item_id, _, item_type = struct.unpack(
+                '>HH4s', read_at(file, start_ + 4, 8)
+            )
+        elif version == 3:
+            item_id, _, item_type = struct.unpack(
+                '>IH4s', read_at(file, start_ + 4, 10)
+            )
+        else:
+            raise Unsupported('Unknown infe version', version)
+        if item_type == b'Exif':
+            exif_id = item_id
+            break
+    if exif_id is None:
+        raise Unsupported('No Exif item')
+
+    for item_id, extents in item_locations(file, *iloc):
+        if item_id == exif_id:
+            return b''.join(read_at(file, *extent) for extent in extents)
+    raise Unsupported('No location for the Exif item')
+
+
+def item_locations(file, start, end):
+    data = read_at(file, start, end - start)
+    version = data[0]
+    if version > 2:
+        raise Unsupported('Unknown iloc version', version)
+    offset_size, length_size = data[4] >> 4, data[4] & 15
+    base_size, index_size = data[5] >> 4, data[5] & 15
+    if version == 0:
+        index_size = 0
+    pos = 6
+
+    def number(size):
+        nonlocal pos
+        if size not in (0, 4, 8):
+            raise Unsupported('Unknown field size', size)
+        value = int.from_bytes(data[pos:pos + size], 'big')
+        pos += size
+        return value
+
+    id_ = 2 if version < 2 else 4
+    count = int.from_bytes(data[pos:pos + id_], 'big')
+    pos += id_
+
+    for _ in range(count):
+        item_id = int.from_bytes(data[pos:pos + id_], 'big')
+        pos += id_
+        if version in (1, 2):
+            method = int.from_bytes(data[pos:pos + 2], 'big') & 15
+            pos += 2
+            if method != 0:
+                raise Unsupported('Item not stored at a file offset')
+        pos += 2
+        base = number(base_size)
+        extent_count = int.from_bytes(data[pos:pos + 2], 'big')
+        pos += 2
+        extents = []
+        for _ in range(extent_count):
+            number(index_size)
+            extent_offset = number(offset_size)
+            extent_length = number(length_size)
+            if not extent_length:
+                raise Unsupported('Extent runs to the end of the file')
+            extents.append((base + extent_offset, extent_length))
+        yield item_id, extents
+
+
+def exif_dates(exif):
+    header_offset, = struct.unpack('>I', exif[:4])
+    tiff = exif[4 + header_offset:]
+    if tiff[:2] == b'II':
+        order = '<'
+    elif tiff[:2] == b'MM':
+        order = '>'
+    else:
+        raise Unsupported('Not a TIFF header')
+
+    def ifd(offset):
+        entries = {}
+        count, = struct.unpack(order + 'H', tiff[offset:offset + 2])
+        for i in range(count):
+            pos = offset + 2 + 12 * i
+            entry = tiff[pos:pos + 12]
+            if len(entry) != 12:
+                raise Unsupported('Truncated IFD')
+            tag, type_, num, value = struct.unpack(order + 'HHII', entry)
+            if type_ == 2:
+                raw = entry[8:8 + num] if num <= 4 else tiff[value:value + num]
+                entries[tag] = raw.rstrip(b'\0 ').decode('ascii', 'replace')
+            elif type_ == 4:
+                entries[tag] = value
+        return entries
+
+    _, ifd0 = struct.unpack(order + 'HI', tiff[2:8])
+    ifds = {0: ifd(ifd0)}
+    if 0x8769 in ifds[0]:
+        ifds[0x8769] = ifd(ifds[0][0x8769])
+
+    tags = {}
+    for (ifd_tag, tag), name in exif_tags.items():
+        value = ifds.get(ifd_tag, {}).get(tag)
+        if isinstance(value, str) and value:
+            tags[name] = value
+    if 'EXIF:DateTimeOriginal' not in tags:
+        raise Unsupported('No DateTimeOriginal, maybe in maker notes')
+    return tags
+
+
+def image_tags(file, end):
+    meta = None
+    for type_, start, stop in boxes(file, 0, end):
+        if type_ == b'meta' and meta is None:
+            meta = start, stop
+    if meta is None:
+        raise Unsupported('Missing box', b'meta')
+
+    exif = exif_item(file, *meta)
+    if len(exif) < 12:
+        raise Unsupported('Exif item too short')
+    return exif_dates(exif)
+
+
+def isobmff_tags(file, end):
+    ftyp = read_at(file, 8, 4)
+    if ftyp in video_brands:
+        return video_tags(file, end)
+    if ftyp in image_brands:
+        return image_tags(file, end)
+    raise Unsupported('Unknown brand', ftyp)
+
+
+def riff_date(value):
+    parts = value.split()
+    if len(parts) >= 5 and parts[1].capitalize() in month_numbers:
+        try:
+            return '{:04d}:{:02d}:{:02d} {}'.format(
+                int(parts[4]), month_numbers[parts[1].capitalize()],
+                int(parts[2]), parts[3],
+            )
+        except ValueError:
+            pass
+    raise Unsupported('Unknown RIFF date format', value)
+
+
+def chunks(file, start, end):
+    offset = start
+    while offset + 8 <= end:
+        id_, size = struct.unpack('<4sI', read_at(file, offset, 8))
+        if offset + 8 + size > end:
+            raise Unsupported('Truncated chunk', id_)
+        yield id_, offset + 8, offset + 8 + size
+        offset += 8 + size + (size & 1)
+
+
+def riff_tags(file, end):
+    _, size, form = struct.unpack('<4sI4s', read_at(file, 0, 12))
+    if form not in (b'AVI ', b'WAVE'):
+        raise Unsupported('Unknown RIFF form', form)
+
+    tags = {}
+
+    def walk(start, stop):
+        for id_, start_, stop_ in chunks(file, start, stop):
+            if id_ in special_chunks:
+                raise Unsupported('Special chunk', id_)
+            elif id_ == b'LIST':
+                list_type = read_at(file, start_, 4)
+                if list_type not in plain_lists:
+                    raise Unsupported('Unknown list', list_type)
+                if list_type != b'movi':
+                    walk(start_ + 4, stop_)
+            elif id_ == b'IDIT':
+                value = read_at(file, start_, stop_ - start_)
+                value = value.rstrip(b'\0\n ').decode('ascii', 'replace')
+                tags['RIFF:DateTimeOriginal'] = riff_date(value)
+
+    walk(12, min(end, 8 + size))
+    return tags
+
+
+def file_modify_date(path):
+    dt = datetime.fromtimestamp(os.stat(path).st_mtime).astimezone()
+    offset = '{:%z}'.format(dt)
+    return '{:%Y:%m:%d %H:%M:%S}{}:{}'.format(dt, offset[:3], offset[3:])
+
+
+def container_tags(path):
+    """
+    Returns the exiftool-style date tags of a file, or raises
+    Unsupported if the file should be read with exiftool.
+    """
+    if os.path.splitext(path)[1].lower() not in extensions:
+        raise Unsupported('Unknown extension')
+
+    with open(path, 'rb') as file:
+        end = os.fstat(file.fileno()).st_size
+        magic = file.read(12)
+        try:
+            if magic[4:8] == b'ftyp':
+                tags = isobmff_tags(file, end)
+            elif magic[:4] == b'RIFF':
+                tags = riff_tags(file, end)
+            else:
+                raise Unsupported('Unknown container')
+        except struct.error as err:
+            raise Unsupported('Malformed container') from err
+
+    tags['File:FileModifyDate'] = file_modify_date(path)
+    return tags
+
+
+@trace.traced(items=lambda paths: len(paths))
+def read_containers(paths):
+    """
+    Reads what tags it can with the native readers. Returns the tags
+    by file, and the files that need exiftool.
+    """
+    tags_dict, rest = {}, []
+    for path in paths:
+        try:
+            tags_dict[path] = container_tags(path)
+            trace.count('native container reads')
+        except (Unsupported, OSError):
+            rest.append(path)
+    return tags_dict, rest
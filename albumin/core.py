@@ -17,11 +17,30 @@
 import os
 import sys
 import stat
+import signal
 
 from albumin.utils import files_in
+from albumin.utils import VolumeWriter
+from albumin.export import write_tar
+from albumin.hasher import Hasher
+from albumin.partial import read_partial
+from albumin.partial import write_partial
 from albumin.imdate import analyze_date
 from albumin.imdate import Report
+from albumin.imdate import registry
 from albumin.hooks import git_hooks
+from albumin.session import ImportSession
+from albumin.daemon import Daemon
+from albumin.daemon import NoDaemon
+from albumin.daemon import stop
+from albumin.watch import Watcher
+from albumin.views import default_fields
+from albumin.views import view_name
+from albumin.views import view_ref
+from albumin.audit import fixable
+from albumin.audit import format_problem
+from albumin.audit import parse_problems
+from albumin import trace
 
 
 def init(repo, exec_path):
@@ -81,16 +100,17 @@ def uninit(repo, exec_path):
                 )
 
 
-def import_(repo, path, mtime=False, **tags):
+def import_branch(repo):
     branch = repo.branch()
     if not branch.startswith('refs/heads/') \
             or branch[11:] == 'git-annex' \
             or '/' in branch[11:]:
         print("Can't import to ref: {}".format(branch))
-        return
+        return False
+    return True
 
-    report = repo.import_(path, mtime=False, **tags)
 
+def import_commit_msg(path, report, **tags):
     def commit_msg():
         yield 'Import {}'.format(path)
         yield ''
@@ -100,33 +120,331 @@ def import_(repo, path, mtime=False, **tags):
         yield '[report]'
         yield from report.short()
 
-    commit_msg = '\n'.join(commit_msg())
-    repo.commit(commit_msg)
-    print(commit_msg)
+    return '\n'.join(commit_msg())
+
 
+@trace.traced()
+def import_(repo, path, mtime=False, phash=False, keep=False, **tags):
+    if not import_branch(repo):
+        return
 
-def fix(repo, path=None):
-    diff_stats = repo.fix_filenames(
-        files=map(repo.rel_path, files_in(path)) if path else None,
+    def commit_msg(report):
+        return import_commit_msg(path, report, **tags)
+
+    report = repo.import_(
+        path, mtime=False, phash=phash, commit_msg=commit_msg, keep=keep,
+        **tags
     )
+    print(commit_msg(report))
+
+
+def watch(repo, path, quiet=2.0, batch_size=100, mtime=False, **tags):
+    if not import_branch(repo):
+        return
+
+    def commit_msg(report):
+        return import_commit_msg(path, report, **tags)
+
+    watcher = Watcher(
+        repo, path, quiet=quiet, batch_size=batch_size, mtime=mtime,
+        commit_msg=commit_msg, **tags
+    )
+    print('Watching {}'.format(watcher.path))
+    sys.stdout.flush()
+
+    try:
+        for files, report in watcher.run():
+            if report:
+                print(commit_msg(report))
+            for file in sorted(watcher.pending.intersection(files)):
+                print('Pending, no date information: {}'.format(file))
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+
+
+@trace.traced()
+def fix(repo, path=None, audit_path=None):
+    if audit_path:
+        files = [
+            file for problem, file, _, _ in read_problems(audit_path)
+            if problem in fixable
+        ]
+        if not files:
+            print('No filenames to fix.')
+            return
+    else:
+        files = map(repo.rel_path, files_in(path)) if path else None
+    diff_stats = repo.fix_filenames(files=files)
     print(diff_stats)
 
 
-def apply(repo, path=None, **tags):
-    if path:
+@trace.traced()
+def relayout(repo, layout=None):
+    moved, left = repo.relayout(layout)
+    print('Moved {} files to {}.'.format(
+        len(moved), repo.layout().pattern or 'the root folder',
+    ))
+    for path, dest in left:
+        print('Left {} in place, {} is taken.'.format(path, dest))
+
+
+@trace.traced()
+def apply(repo, path=None, audit_path=None, **tags):
+    if audit_path:
+        report = repo.audit_report(read_problems(audit_path))
+    elif path:
         with open(path, 'r') as file:
             report_msg = [line.strip() for line in file]
+        report = Report.parse(report_msg)
     else:
         report_msg = [line.strip() for line in sys.stdin]
-    report = Report.parse(report_msg)
+        report = Report.parse(report_msg)
     repo.apply_report(report, **tags)
 
 
-def repo_analyze(repo, path=None, short=False, mtime=False):
+def read_problems(path):
+    if path == '-':
+        return list(parse_problems(sys.stdin))
+    with open(path, 'r') as file:
+        return list(parse_problems(file))
+
+
+@trace.traced()
+def audit(repo, jobs=None):
+    problems = 0
+    print('# problem\tpath\tkey\tdetail')
+    for problem in repo.audit(jobs=jobs):
+        print(format_problem(*problem))
+        problems += 1
+    print('Found {} problems.'.format(problems), file=sys.stderr)
+    return 1 if problems else 0
+
+
+@trace.traced()
+def cache_rebuild(repo):
+    repo.drain_queue()
+    store = repo.metadata_store()
+    keys = {key for _, key in repo.index_keys()}
+    store.rebuild(repo.annex, keys)
+    print('Cached metadata of {} keys.'.format(len(keys)))
+
+
+@trace.traced()
+def cache_check(repo):
+    repo.drain_queue()
+    store = repo.metadata_store()
+    stale = 0
+    for key, cached, actual in store.check(repo.annex):
+        stale += 1
+        print('[C!] {}'.format(key))
+        for field in sorted({*cached, *actual}):
+            if cached.get(field) != actual.get(field):
+                print('[ c] :: {}: {}'.format(field, cached.get(field)))
+                print('[ a] :: {}: {}'.format(field, actual.get(field)))
+    if stale:
+        print('{} keys differ from the git-annex branch.'.format(stale))
+    return 1 if stale else 0
+
+
+@trace.traced()
+def queue(repo, drain=False, retry=False, drop=False):
+    pending = repo.pending_queue()
+    if retry:
+        print('Moved {} failed reports back.'.format(pending.retry()))
+    if drop:
+        print('Dropped {} failed reports.'.format(pending.drop()))
+    if drain or retry:
+        print('Applied {} pending reports.'.format(repo.drain_queue()))
+    elif not drop:
+        for job_path in pending.jobs():
+            commit, report, _ = pending.load(job_path)
+            print('{} {} files'.format(commit, len(report.files)))
+        for job_path in pending.failed():
+            print('failed {}'.format(job_path))
+        print('{} pending reports, {} failed.'.format(
+            len(pending), len(pending.failed()),
+        ))
+
+
+@trace.traced()
+def sessions(repo, ids=None, resume=False, abort=False):
+    unfinished = ImportSession.unfinished(repo)
+    for id in (ids or unfinished):
+        if id not in unfinished:
+            print('No unfinished session {}.'.format(id))
+            continue
+        session = ImportSession.load(repo, id)
+        if session.running():
+            status = 'running'
+        elif session.report is None:
+            status = 'imported'
+        else:
+            status = 'analyzed'
+
+        if not (resume or abort) or status == 'running':
+            print('{} {} {} files from {}'.format(
+                id, status, len(session.files), session.path or '?',
+            ))
+        elif abort:
+            session.abort()
+            print('Aborted {}.'.format(id))
+        elif import_branch(repo):
+            session.resume(lambda report: import_commit_msg(
+                session.path or session.folder, report, **session.tags
+            ))
+            print('Resumed {}.'.format(id))
+
+
+@trace.traced()
+def views(repo, fields=None):
+    fields = fields or default_fields
+    commit, changed = repo.update_view(fields)
+    print('Updated {} ({} files changed): {}'.format(
+        view_ref(view_name(fields)), changed, commit.id,
+    ))
+
+
+@trace.traced()
+def query(repo, query, keys=False):
+    results = repo.query(query)
+    if keys:
+        print(*(key for key, _ in results), sep='\n')
+    else:
+        paths = repo.locate(results)
+        print(*(paths[key] or key for key, _ in results), sep='\n')
+
+
+@trace.traced()
+def daemon(repo, idle=None):
+    daemon_ = Daemon(repo, idle=idle)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print('Listening on {}'.format(daemon_.path))
+    sys.stdout.flush()
+    daemon_.serve()
+
+
+def daemon_stop(repo):
+    try:
+        print(stop(repo)['output'], end='')
+    except NoDaemon:
+        print('No daemon running.')
+        return 1
+    return 0
+
+
+@trace.traced()
+def export(repo, query, dest, volume_size=None, level=1, threads=None):
+    results = repo.query(query)
+    paths = repo.locate(results)
+    files = [
+        (paths[key], repo.content_path(paths[key]))
+        for key, _ in results if paths[key]
+    ]
+
+    if dest == '-':
+        out = sys.stdout.buffer
+    elif volume_size:
+        out = VolumeWriter(dest, volume_size)
+    else:
+        out = open(dest, 'wb')
+
+    try:
+        written, missing = write_tar(files, out, level=level, threads=threads)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+
+    for name in missing:
+        print('Content not present: {}'.format(name), file=sys.stderr)
+    print('Exported {} files.'.format(len(written)), file=sys.stderr)
+    if isinstance(out, VolumeWriter):
+        print(*out.volumes, sep='\n', file=sys.stderr)
+    return 1 if missing else 0
+
+
+@trace.traced()
+def phash_update(repo):
+    count = repo.update_phash_index()
+    print('Indexed perceptual hashes of {} keys.'.format(count))
+
+
+@trace.traced()
+def calckey(repo, path, check=False):
+    paths = list(files_in(path)) if os.path.isdir(path) else [path]
+    keys = repo.calckeys(paths)
+    annex_keys = dict(repo.calckeys(paths, native=False)) if check else {}
+
+    mismatches = 0
+    for file, key in keys:
+        print(key, os.path.relpath(file))
+        if check and annex_keys[file] != key:
+            mismatches += 1
+            print('[K!] {}'.format(key), file=sys.stderr)
+            print('[ F] :: {}'.format(file), file=sys.stderr)
+            print('[ a] :: {}'.format(annex_keys[file]), file=sys.stderr)
+    if mismatches:
+        msg = '{} keys differ from git annex calckey.'.format(mismatches)
+        print(msg, file=sys.stderr)
+    return 1 if mismatches else 0
+
+
+@trace.traced()
+def repo_analyze(repo, path=None, short=False, mtime=False, phash=False,
+                 max_memory=None):
+    if max_memory:
+        if not path:
+            raise ValueError('Only a path can be analyzed in partitions.')
+        with repo.analyze_spilled(
+            path=path,
+            max_memory=max_memory,
+            mtime=mtime,
+            phash=phash,
+        ) as report:
+            lines = report.short() if short else report.long()
+            for line in lines:
+                print(line)
+        return
+
     report = repo.analyze(
         path=path,
         mtime=mtime,
+        phash=phash,
+    )
+
+    if short:
+        print(*report.short(), sep='\n')
+    else:
+        print(report)
+
+
+@trace.traced()
+def partial_analyze(repo, path, timezone=None, mtime=False, threads=None):
+    if repo:
+        hasher = repo.hasher()
+        if hasher is None:
+            msg = 'Partial reports need a SHA or MD5 annex.backend'
+            raise RuntimeError(msg)
+        if threads:
+            hasher.threads = threads
+        timezone = timezone or repo.timezone
+    else:
+        hasher = Hasher(threads=threads)
+
+    count = write_partial(
+        path, sys.stdout, hasher=hasher, timezone=timezone, mtime=mtime,
     )
+    print('Analyzed {} files.'.format(count), file=sys.stderr)
+
+
+@trace.traced()
+def merge_reports(repo, paths, short=False):
+    partials = []
+    for path in paths:
+        with open(path, 'r') as file:
+            header, entries = read_partial(file)
+            partials.append((header, list(entries)))
+    report = repo.merge_partials(partials)
 
     if short:
         print(*report.short(), sep='\n')
@@ -134,6 +452,7 @@ def repo_analyze(repo, path=None, short=False, mtime=False):
         print(report)
 
 
+@trace.traced()
 def imdate_analyze(path, timezone=None, short=False, mtime=False):
     report = analyze_date(
         *files_in(path),
@@ -145,3 +464,9 @@ def imdate_analyze(path, timezone=None, short=False, mtime=False):
         print(*report.short(), sep='\n')
     else:
         print(report)
+
+
+def print_timings():
+    for name, (files, seconds) in registry.timings.items():
+        print('{}: {} files in {:.3f}s'.format(name, files, seconds),
+              file=sys.stderr)
@@ -0,0 +1,182 @@
+# Albumin Daemon
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import os
+import sys
+from contextlib import contextmanager
+from contextlib import redirect_stdout
+
+from albumin.lazy import lazy_import
+from albumin.hooks import git_hooks
+from albumin.hooks import git_dir
+from albumin import hooks
+from albumin import trace
+
+json = lazy_import('json')
+socket = lazy_import('socket')
+traceback = lazy_import('traceback')
+utils = lazy_import('albumin.utils')
+
+
+class NoDaemon(Exception):
+    pass
+
+
+def socket_path(git_dir_):
+    return os.path.join(git_dir_, 'albumin', 'daemon.sock')
+
+
+def connect(path):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+    except OSError as err:
+        client.close()
+        raise NoDaemon(path) from err
+    return client
+
+
+def send(conn, message):
+    conn.sendall(json.dumps(message).encode() + b'\n')
+
+
+def receive(conn):
+    with conn.makefile('rb') as reader:
+        line = reader.readline()
+    if not line:
+        raise ConnectionError('Connection closed without a message')
+    return json.loads(line.decode())
+
+
+def call(path, message):
+    with connect(path) as client:
+        send(client, message)
+        return receive(client)
+
+
+def run_hook(name, args):
+    if git_dir() is None:
+        raise NoDaemon(name)
+
+    args = dict(args)
+    if args.get('<editmsg>'):
+        args['<editmsg>'] = os.path.abspath(args['<editmsg>'])
+
+    response = call(socket_path(git_dir()), {
+        'hook': name,
+        'args': args,
+        'cwd': os.getcwd(),
+        'env': {k: v for k, v in os.environ.items() if k.startswith('GIT_')},
+    })
+
+    sys.stdout.write(response.get('output', ''))
+    if 'error' in response:
+        print(response['error'], file=sys.stderr, end='')
+        return 1
+    return response.get('retval')
+
+
+def stop(repo):
+    return call(socket_path(repo.path), {'stop': True})
+
+
+class Daemon:
+    """
+    Runs git hooks for one repo on a Unix socket in its git dir, with
+    the repo, its annex, the metadata store and exiftool kept open.
+    Requests are handled one at a time, each with the client's working
+    directory and GIT_* environment.
+    """
+
+    def __init__(self, repo, idle=None):
+        self.repo = repo
+        self.idle = idle
+        self.path = repo.state_path('daemon.sock')
+        self.running = False
+
+    def serve(self):
+        try:
+            connect(self.path).close()
+        except NoDaemon:
+            pass
+        else:
+            msg = 'Daemon already running at {}'.format(self.path)
+            raise RuntimeError(msg)
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+        utils.keep_exiftool()
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        server.listen()
+        server.settimeout(self.idle)
+
+        hooks.warm_repo = self.repo
+        self.running = True
+        try:
+            while self.running:
+                try:
+                    conn, _ = server.accept()
+                except socket.timeout:
+                    break
+                with conn:
+                    self.handle(conn)
+        finally:
+            hooks.warm_repo = None
+            server.close()
+            os.remove(self.path)
+            utils.stop_exiftool()
+
+    def handle(self, conn):
+        conn.settimeout(None)
+        try:
+            response = self.dispatch(receive(conn))
+        except Exception:
+            response = {'error': traceback.format_exc()}
+        send(conn, response)
+
+    @trace.traced()
+    def dispatch(self, message):
+        if message.get('stop'):
+            self.running = False
+            return {'retval': 0, 'output': 'Stopping daemon.\n'}
+
+        hook = git_hooks[message['hook']]
+        output = io.StringIO()
+        with self.environment(message['cwd'], message['env']):
+            self.repo.refresh()
+            with redirect_stdout(output):
+                retval = hook(message['args'])
+        return {'retval': retval, 'output': output.getvalue()}
+
+    @contextmanager
+    def environment(self, cwd, env):
+        old_cwd, old_env = os.getcwd(), dict(os.environ)
+        for name in [n for n in os.environ if n.startswith('GIT_')]:
+            del os.environ[name]
+        os.environ.update(env)
+        os.chdir(cwd)
+        try:
+            yield
+        finally:
+            os.chdir(old_cwd)
+            os.environ.clear()
+            os.environ.update(old_env)
+
+    def __repr__(self):
+        return 'Daemon(path={!r})'.format(self.path)
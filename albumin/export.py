@@ -0,0 +1,148 @@
+# Albumin Export
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import queue
+import tarfile
+import threading
+
+from albumin.utils import ParallelGzipWriter
+from albumin import trace
+
+
+class ReadAhead:
+    """
+    Reads files in order on a separate thread, into a queue holding at
+    most max_chunks chunks, so that reading the next files overlaps
+    with compressing and writing the current one.
+    """
+
+    def __init__(self, files, chunk_size=1 << 20, max_chunks=64):
+        self.files = files
+        self.chunk_size = chunk_size
+        self.queue = queue.Queue(max_chunks)
+        self.thread = threading.Thread(target=self.read, daemon=True)
+
+    def read(self):
+        try:
+            for name, path in self.files:
+                try:
+                    file = open(path, 'rb')
+                except OSError as err:
+                    self.queue.put(('missing', name, err))
+                    continue
+                with file:
+                    stat = os.fstat(file.fileno())
+                    self.queue.put(('file', name, stat))
+                    self.read_chunks(file, path, stat.st_size)
+            self.queue.put(('done',))
+        except Exception as err:
+            self.queue.put(('error', err))
+
+    def read_chunks(self, file, path, size):
+        """
+        Queues exactly size bytes of file, the size its entry in the
+        tar has, and fails if the file doesn't have that many now.
+        """
+        while size:
+            chunk = file.read(min(self.chunk_size, size))
+            if not chunk:
+                raise OSError('{} shrank while exporting'.format(path))
+            self.queue.put(('data', chunk))
+            size -= len(chunk)
+        if file.read(1):
+            raise OSError('{} grew while exporting'.format(path))
+
+    def __iter__(self):
+        self.thread.start()
+        while True:
+            kind, *item = self.queue.get()
+            if kind == 'done':
+                return
+            elif kind == 'error':
+                raise item[0]
+            elif kind == 'missing':
+                name, _ = item
+                yield name, None, None
+            else:
+                name, stat = item
+                reader = ChunkReader(self.queue, stat.st_size)
+                yield name, stat, reader
+                while reader.read(self.chunk_size):
+                    pass
+
+
+class ChunkReader:
+    """
+    Reads one file's chunks from the queue. Reads return as many bytes
+    as asked for up to the file's size, whatever the chunk size, and
+    leave the next file's messages in the queue.
+    """
+
+    def __init__(self, queue_, size):
+        self.queue = queue_
+        self.remaining = size
+        self.buffer = b''
+        self.offset = 0
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        self.remaining -= size
+
+        parts = []
+        while size:
+            if self.offset == len(self.buffer):
+                kind, *item = self.queue.get()
+                if kind == 'error':
+                    raise item[0]
+                elif kind != 'data':
+                    raise RuntimeError('Expected file data, got ' + kind)
+                self.buffer, self.offset = item[0], 0
+            part = self.buffer[self.offset:self.offset + size]
+            self.offset += len(part)
+            size -= len(part)
+            parts.append(part)
+        return b''.join(parts)
+
+
+@trace.traced()
+def write_tar(files, fileobj, level=6, threads=None):
+    """
+    Writes (name, path) pairs to fileobj as a tar stream, gzipped in
+    parallel unless level is 0. Returns the names that were written
+    and the names that couldn't be read.
+    """
+    if level:
+        fileobj = ParallelGzipWriter(fileobj, level=level, threads=threads)
+
+    written, missing = [], []
+    with tarfile.open(fileobj=fileobj, mode='w|') as tar:
+        for name, stat, reader in ReadAhead(files):
+            if stat is None:
+                missing.append(name)
+                continue
+            info = tarfile.TarInfo(name)
+            info.size = stat.st_size
+            info.mtime = stat.st_mtime
+            info.mode = 0o644
+            tar.addfile(info, reader)
+            written.append(name)
+            trace.count('exported bytes', stat.st_size)
+
+    if level:
+        fileobj.close()
+    return written, missing
@@ -0,0 +1,180 @@
+# Albumin Hasher
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from albumin import readorder
+from albumin import trace
+
+backends = {
+    'MD5': 'md5',
+    'SHA1': 'sha1',
+    'SHA224': 'sha224',
+    'SHA256': 'sha256',
+    'SHA384': 'sha384',
+    'SHA512': 'sha512',
+}
+backends.update({name + 'E': algo for name, algo in list(backends.items())})
+
+
+def valid_in_extension(char):
+    return char > 127 or chr(char).isalnum()
+
+
+def key_extension(path, max_length=4):
+    """
+    The extension git-annex puts in *E backend keys: at most the last
+    two extensions of the filename, each alphanumeric (or non-ASCII)
+    and at most max_length bytes long. Like git-annex, a leading dot
+    starts the extensions.
+    """
+    name = os.fsencode(os.path.basename(path))
+    _, dot, extensions = name.partition(b'.')
+    if not dot:
+        return ''
+
+    parts = []
+    for part in reversed(extensions.split(b'.')):
+        if len(part) > max_length:
+            break
+        parts.append(part)
+    parts = [part for part in parts if all(map(valid_in_extension, part))]
+    parts = [part for part in reversed(parts[:2]) if part]
+    if not parts:
+        return ''
+    return os.fsdecode(b'.' + b'.'.join(parts))
+
+
+class Hasher:
+    """
+    Calculates git-annex keys of files on a thread pool. Each thread
+    reads into its own buffer and hashlib releases the GIL, so memory
+    stays at about one buffer per thread no matter the file sizes.
+    """
+
+    def __init__(self, backend='SHA256E', threads=None,
+                 block_size=1 << 20, max_extension_length=4,
+                 read_order=None, large_size=None):
+        if backend not in backends:
+            raise ValueError('Unsupported backend: {}'.format(backend))
+        self.backend = backend
+        self.algorithm = backends[backend]
+        self.threads = threads or min(8, os.cpu_count() or 1)
+        self.block_size = block_size
+        self.max_extension_length = max_extension_length
+        self.read_order = read_order
+        self.large_size = large_size
+        self.local = threading.local()
+
+    def buffer(self):
+        try:
+            return self.local.buffer
+        except AttributeError:
+            self.local.buffer = memoryview(bytearray(self.block_size))
+            return self.local.buffer
+
+    def key(self, path, large=False):
+        hash_ = hashlib.new(self.algorithm)
+        buffer = self.buffer()
+        size = 0
+        with open(path, 'rb', buffering=0) as file:
+            readorder.advise(file.fileno(), 'POSIX_FADV_SEQUENTIAL')
+            while True:
+                read = file.readinto(buffer)
+                if not read:
+                    break
+                hash_.update(buffer[:read])
+                size += read
+            if large:
+                # Don't let one large video push everything else out
+                # of the page cache.
+                readorder.advise(file.fileno(), 'POSIX_FADV_DONTNEED')
+        trace.count('hashed bytes', size)
+        return self.make_key(hash_, size, path)
+
+    def copy(self, path, dest, block_size=8 << 20):
+        """
+        Copies path to dest in large blocks, hashing the bytes as they
+        are copied. Returns the key of what was copied.
+        """
+        try:
+            buffer = self.local.copy_buffer
+        except AttributeError:
+            buffer = self.local.copy_buffer = \
+                memoryview(bytearray(block_size))
+
+        hash_ = hashlib.new(self.algorithm)
+        size = 0
+        with open(path, 'rb', buffering=0) as file, \
+                open(dest, 'wb') as dest_file:
+            readorder.advise(file.fileno(), 'POSIX_FADV_SEQUENTIAL')
+            while True:
+                read = file.readinto(buffer)
+                if not read:
+                    break
+                hash_.update(buffer[:read])
+                dest_file.write(buffer[:read])
+                size += read
+        trace.count('copied bytes', size)
+        return self.make_key(hash_, size, path)
+
+    def make_key(self, hash_, size, path):
+        key = '{}-s{}--{}'.format(self.backend, size, hash_.hexdigest())
+        if self.backend.endswith('E'):
+            key += key_extension(path, self.max_extension_length)
+        return key
+
+    @trace.traced(items=lambda self, paths: len(paths))
+    def keys(self, paths):
+        """
+        Returns (path, key) pairs in the order of the paths. Files are
+        read in their order on disk, with at most twice the thread
+        count of files queued (and prefetched) at once. Large files are
+        hashed one at a time on their own thread alongside the rest.
+        """
+        paths = list(paths)
+        small, large = readorder.schedule(
+            paths, mode=self.read_order, large_size=self.large_size,
+        )
+        keys = {}
+        with ThreadPoolExecutor(self.threads) as pool, \
+                ThreadPoolExecutor(1) as large_pool:
+            large_futures = [
+                (path, large_pool.submit(self.key, path, True))
+                for path in large
+            ]
+            pending = deque()
+            for path in small:
+                readorder.will_need([path])
+                pending.append((path, pool.submit(self.key, path)))
+                if len(pending) >= 2 * self.threads:
+                    path_, future = pending.popleft()
+                    keys[path_] = future.result()
+            while pending:
+                path_, future = pending.popleft()
+                keys[path_] = future.result()
+            for path, future in large_futures:
+                keys[path] = future.result()
+        return [(path, keys[path]) for path in paths]
+
+    def __repr__(self):
+        return 'Hasher(backend={!r}, threads={})'.format(
+            self.backend, self.threads
+        )
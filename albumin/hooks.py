@@ -15,28 +15,33 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import os
-import pytz
 
-from albumin.repo import AlbuminRepo
-from albumin.imdate import Report
+from albumin.lazy import lazy_import
+from albumin import trace
 
+pytz = lazy_import('pytz')
+subprocess = lazy_import('subprocess')
+albumin_repo = lazy_import('albumin.repo')
+albumin_imdate = lazy_import('albumin.imdate')
+albumin_pending = lazy_import('albumin.pending')
 
+warm_repo = None
+
+
+@trace.traced()
 def pre_commit_hook(args):
     """
     Albumin as a pre-commit hook.
     Usage: pre-commit
     """
+    if not plain_branch(head_ref() or current_repo().branch()):
+        subprocess.call(['git', 'annex', 'pre-commit', '.'])
+        return
+
     repo = current_repo()
     msg_path = os.path.join(repo.path, 'albumin.msg')
     new_files = repo.new_files()
 
-    branch = repo.branch()
-    if not branch.startswith('refs/heads/') \
-            or branch[11:] == 'git-annex' \
-            or '/' in branch[11:]:
-        print(repo.annex.pre_commit())
-        return
-
     override = repo.get_config('albumin.override')
     if override:
         print('Overriding analysis with manual report.')
@@ -64,14 +69,16 @@ def pre_commit_hook(args):
     )
 
     if override and report_override:
-        report = Report.parse(list(report.short()) + report_override)
+        report = albumin_imdate.Report.parse(
+            list(report.short()) + report_override
+        )
 
     if report.remaining:
         print('Some files in report have no information:')
         print(report)
         return 3
 
-    report = Report(new_files, report.updates, set())
+    report = albumin_imdate.Report(new_files, report.updates, set())
 
     updates = report.updates
     file_data = {
@@ -87,19 +94,18 @@ def pre_commit_hook(args):
         print(*report.short(), sep='\n', file=msg_file)
 
 
+@trace.traced()
 def prepare_commit_msg_hook(args):
     """
     Albumin as a pre-commit git hook.
     Usage: prepare-commit-msg <editmsg> [[<commit_type>] <commit_sha>]
     """
+    if annex_branch(head_ref()):
+        return
+
     repo = current_repo()
     msg_path = os.path.join(repo.path, 'albumin.msg')
 
-    branch = repo.branch()
-    if branch.startswith('refs/heads/views/') \
-            or branch[11:] == 'git-annex':
-        return
-
     try:
         with open(msg_path, 'r') as msg_file:
             report = [line.strip() for line in msg_file]
@@ -141,18 +147,17 @@ def prepare_commit_msg_hook(args):
         print(*new_message(), sep='\n', file=editmsg)
 
 
+@trace.traced()
 def commit_msg_hook(args):
     """
     Albumin as a pre-commit git hook.
     Usage: commit-msg <editmsg>
     """
-    repo = current_repo()
-
-    branch = repo.branch()
-    if branch.startswith('refs/heads/views/') \
-            or branch[11:] == 'git-annex':
+    if annex_branch(head_ref()):
         return
 
+    repo = current_repo()
+
     with open(args['<editmsg>'], 'r') as editmsg:
         msg = (line.strip() for line in editmsg)
         msg = [line for line in msg if not line.startswith('#')]
@@ -168,13 +173,9 @@ def commit_msg_hook(args):
         print(*report.remaining, sep='\n')
         return 1
 
-    new_files = {
-        os.path.basename(f): k for f, k in repo.new_files().items()
-    }
+    new_files = repo.new_files()
 
     for file, key in report.files.items():
-        name = os.path.basename(file)
-
         if file in report.redundants:
             imdate = repo.annex[key].imdate
         elif file in report.additions:
@@ -188,7 +189,7 @@ def commit_msg_hook(args):
 
         utc = imdate.datetime.astimezone(pytz.utc)
         ext = os.path.splitext(key)[1]
-        dt_name = '{:%Y%m%dT%H%M%SZ}{{:02}}{}'.format(utc, ext)
+        dt_name = repo.datetime_name(utc, ext)
 
         for i in range(100):
             new_name = dt_name.format(i)
@@ -224,20 +225,23 @@ def commit_msg_hook(args):
         print(*new_message(), sep='\n', file=editmsg)
 
 
+@trace.traced()
 def post_commit_hook(args):
     """
     Albumin as a post-commit git hook.
     Usage: post-commit
     """
-    repo = current_repo()
-
-    branch = repo.branch()
-    if branch.startswith('refs/heads/views/') \
-            or branch[11:] == 'git-annex':
+    if annex_branch(head_ref()):
         return
 
+    repo = current_repo()
+
     msg_head, tags, report = parse_commit_msg()
-    repo.apply_report(report, **tags)
+    if repo.get_config('albumin.deferred-apply') == 'false':
+        repo.apply_report(report, **tags)
+    else:
+        repo.enqueue_report(report, commit=str(repo.head.target), **tags)
+        albumin_pending.spawn_worker(repo)
 
     msg_path = os.path.join(repo.path, 'albumin.msg')
     if os.path.exists(msg_path):
@@ -273,13 +277,58 @@ def parse_commit_msg(msg=None):
             return msg[idx:idx+len_]
 
     tags = dict(x.split(': ') for x in section('[tags]'))
-    report = Report.parse(section('[report]'))
+    report = albumin_imdate.Report.parse(section('[report]'))
 
     return msg_head, tags, report
 
 
 def current_repo():
-    return AlbuminRepo(os.getcwd(), create=False)
+    if warm_repo is not None:
+        return warm_repo
+    return albumin_repo.AlbuminRepo(os.getcwd(), create=False)
+
+
+def git_dir(path=None):
+    if os.getenv('GIT_DIR'):
+        return os.path.abspath(os.getenv('GIT_DIR'))
+
+    path = os.path.abspath(path or os.getcwd())
+    while True:
+        dot_git = os.path.join(path, '.git')
+        if os.path.isdir(dot_git):
+            return dot_git
+        elif os.path.isfile(dot_git):
+            with open(dot_git) as file:
+                line = file.readline().strip()
+            if line.startswith('gitdir: '):
+                return os.path.join(path, line[8:])
+
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def head_ref(path=None):
+    try:
+        with open(os.path.join(git_dir(path), 'HEAD')) as file:
+            head = file.read().strip()
+    except (TypeError, OSError):
+        return None
+    return head[5:] if head.startswith('ref: ') else head
+
+
+def plain_branch(ref):
+    return ref.startswith('refs/heads/') \
+        and ref[11:] != 'git-annex' \
+        and '/' not in ref[11:]
+
+
+def annex_branch(ref):
+    return ref is not None and (
+        ref.startswith('refs/heads/views/')
+        or ref == 'refs/heads/git-annex'
+    )
 
 
 git_hooks = {
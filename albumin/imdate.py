@@ -18,35 +18,55 @@ import os
 import re
 import pytz
 import itertools
-from functools import partial
 from datetime import datetime
+from datetime import timedelta
+from datetime import timezone as fixed_offset
+from operator import itemgetter
 from collections import OrderedDict
 
 from albumin.utils import exiftool_tags
+from albumin.containers import read_containers
+from albumin.methods import MethodRegistry
+from albumin.imdate_array import ImageDateArray
+from albumin import imdate_array
+from albumin import readorder
 from albumin.lexical_ordering import lexical_ordering
+from albumin import trace
 
 
-def analyze_date(*paths, timezone=None, mtime=False):
-    methods = [
-        partial(from_exif, mtime=mtime),
-        from_filename,
-    ]
-
+@trace.traced(items=lambda *paths, **_: len(paths))
+def analyze_date(*paths, timezone=None, mtime=False, floors=None):
+    floors = floors or {}
     results = {}
-    remaining = set(paths)
 
-    for method in methods:
-        new_results = method(*remaining)
-        remaining.difference_update(new_results)
-        results.update(new_results)
+    def current(path):
+        found, floor = results.get(path), floors.get(path)
+        return max(found, floor) if found and floor else found or floor
+
+    for extractor in registry.schedule():
+        best = registry.best_method(extractor)
+        applicable = [path for path in paths if extractor.applies_to(path)]
+        todo = [
+            path for path in applicable
+            if ImageDate.outranks(best, current(path))
+        ]
+        trace.count('skipped extractions', len(applicable) - len(todo))
+        if not todo:
+            continue
+
+        new_results = registry.timed(extractor, todo, mtime=mtime)
+        for path, imdate in new_results.items():
+            results[path] = max(imdate, results.get(path))
 
     for imdate in results.values():
         if timezone and not imdate.timezone:
             imdate.timezone = timezone
 
+    remaining = set(paths).difference(results)
     return Report(paths, results, remaining)
 
 
+@trace.traced(items=lambda *paths, **_: len(paths))
 def from_exif(*paths, mtime=False):
     if not paths:
         return {}
@@ -67,7 +87,9 @@ def from_exif(*paths, mtime=False):
     if mtime:
         useful_tags.append('File:FileModifyDate')
 
-    tags_dict = exiftool_tags(*paths)
+    tags_dict, rest = read_containers(readorder.ordered(paths))
+    if rest:
+        tags_dict.update(exiftool_tags(*rest))
 
     imdates = {}
     for file, tags in tags_dict.items():
@@ -95,7 +117,8 @@ def from_exif(*paths, mtime=False):
     return imdates
 
 
-def from_filename(*paths):
+@trace.traced(items=lambda *paths, **_: len(paths))
+def from_filename(*paths, **_):
     filename_formats = {
         'UNIX': re.compile('(\d{9,13})'),
         'I9100/IMG': re.compile('IMG_(\d{8}_\d{6})'),
@@ -116,42 +139,102 @@ def from_filename(*paths):
     return imdates
 
 
+def merge_imdates(file_imdates):
+    best = None
+    for file, imdate in file_imdates:
+        if best and imdate.method == best.method \
+                and imdate.datetime != best.datetime:
+            raise RuntimeError(file, imdate, best)
+        best = max(imdate, best)
+    return best
+
+
+def merge_key_imdates(key_data):
+    """
+    Merges {key: [(file, imdate), ...]} into {key: best imdate} like
+    merge_imdates does for each key, with arrays for large batches.
+    """
+    size = sum(map(len, key_data.values()))
+    if not imdate_array.available(size):
+        return {
+            key: merge_imdates(file_imdates)
+            for key, file_imdates in key_data.items()
+        }
+
+    pairs = list(itertools.chain.from_iterable(key_data.values()))
+    imdates = list(map(itemgetter(1), pairs))
+
+    array = ImageDateArray.from_imdates(
+        imdates, ImageDate.methods, times=False,
+    )
+    best, tied, prev = array.max_by_key(list(map(len, key_data.values())))
+    for i, j in zip(tied.tolist(), prev.tolist()):
+        if imdates[i].datetime != imdates[j].datetime:
+            raise RuntimeError(pairs[i][0], imdates[i], imdates[j])
+    return dict(zip(key_data, map(imdates.__getitem__, best.tolist())))
+
+
+registry = MethodRegistry()
+
+builtin_methods = [
+    'Manual/Trusted',
+    'ExifTool/EXIF/DateTimeOriginal',
+    'ExifTool/MakerNotes/DateTimeOriginal',
+    'ExifTool/RIFF/DateTimeOriginal',
+    'ExifTool/EXIF/CreateDate',
+    'ExifTool/MakerNotes/CreateDate',
+    'ExifTool/QuickTime/MediaCreateDate',
+    'ExifTool/RIFF/DateTimeCreated',
+    'ExifTool/EXIF/ModifyDate',
+    'ExifTool/File/Comment',
+    'Perceptual/Original',
+    'Filename/I9100/IMG',
+    'Filename/I9100/VID',
+    'Filename/Delimited',
+    'Filename/UNIX',
+    'Manual/Facebook',
+    'Manual/Untrusted',
+    'ExifTool/File/FileModifyDate',
+]
+
+builtin_formats = [
+    '%Y:%m:%d %H:%M:%S',
+    '%Y:%m:%d %H:%M:%S.%f',
+    '%Y-%m-%d@%H-%M-%S',
+    '%Y-%m-%d@%H-%M-%S.%f',
+    '\n\n\n%d/%m/%Y\n%H:%M:%S\nMode=',
+    '\n\n\n%d.%m.%Y\n%H.%M.%S\nMode=',
+    '%Y%m%d_%H%M%S',
+    '%Y-%m-%d %H-%M-%S',
+]
+
+for rank, method in enumerate(builtin_methods, start=1):
+    registry.add_method(method, rank * 100)
+
+for datetime_format in builtin_formats:
+    registry.add_format(datetime_format)
+
+registry.add_extractor(
+    'filename', from_filename,
+    [m for m in builtin_methods if m.startswith('Filename/')],
+    cost=1,
+)
+
+registry.add_extractor(
+    'exiftool', from_exif,
+    [m for m in builtin_methods if m.startswith('ExifTool/')],
+    cost=100,
+)
+
+
 @lexical_ordering
 class ImageDate:
-    methods = [
-        'Manual/Trusted',
-        'ExifTool/EXIF/DateTimeOriginal',
-        'ExifTool/MakerNotes/DateTimeOriginal',
-        'ExifTool/RIFF/DateTimeOriginal',
-        'ExifTool/EXIF/CreateDate',
-        'ExifTool/MakerNotes/CreateDate',
-        'ExifTool/QuickTime/MediaCreateDate',
-        'ExifTool/RIFF/DateTimeCreated',
-        'ExifTool/EXIF/ModifyDate',
-        'ExifTool/File/Comment',
-        'Filename/I9100/IMG',
-        'Filename/I9100/VID',
-        'Filename/Delimited',
-        'Filename/UNIX',
-        'Manual/Facebook',
-        'Manual/Untrusted',
-        'ExifTool/File/FileModifyDate',
-    ]
-
-    datetime_formats = [
-        '%Y:%m:%d %H:%M:%S',
-        '%Y:%m:%d %H:%M:%S.%f',
-        '%Y-%m-%d@%H-%M-%S',
-        '%Y-%m-%d@%H-%M-%S.%f',
-        '\n\n\n%d/%m/%Y\n%H:%M:%S\nMode=',
-        '\n\n\n%d.%m.%Y\n%H.%M.%S\nMode=',
-        '%Y%m%d_%H%M%S',
-        '%Y-%m-%d %H-%M-%S',
-    ]
+    methods = registry.methods
+    datetime_formats = registry.datetime_formats
 
     def __init__(self, method, datetime_):
         self.method = method
-        if self.method not in ImageDate.methods:
+        if self.method not in registry:
             raise ValueError(method)
 
         if isinstance(datetime_, datetime):
@@ -184,6 +267,45 @@ class ImageDate:
         datetime_ = pytz.timezone(timezone).localize(datetime_)
         return cls(method, datetime_)
 
+    dump_format = '%Y-%m-%d %H:%M:%S.%f'
+
+    def dump(self):
+        """
+        Returns the date as JSON-able data. Aware datetimes are kept
+        in UTC with their offset and zone name, so that local times
+        that are ambiguous in their zone load back exactly.
+        """
+        data = OrderedDict([('method', self.method)])
+        offset = self.datetime.utcoffset()
+        if offset is None:
+            data['datetime'] = self.datetime.strftime(self.dump_format)
+            return data
+
+        utc = self.datetime.astimezone(pytz.utc)
+        data['utc'] = utc.strftime(self.dump_format)
+        data['offset'] = int(offset.total_seconds())
+        data['timezone'] = getattr(self.datetime.tzinfo, 'zone', None)
+        return data
+
+    @classmethod
+    def load(cls, data):
+        if 'utc' not in data:
+            datetime_ = datetime.strptime(data['datetime'], cls.dump_format)
+            return cls(data['method'], datetime_)
+
+        utc = datetime.strptime(data['utc'], cls.dump_format)
+        offset = timedelta(seconds=data['offset'])
+        if not data.get('timezone'):
+            datetime_ = (utc + offset).replace(tzinfo=fixed_offset(offset))
+            return cls(data['method'], datetime_)
+
+        tz = pytz.timezone(data['timezone'])
+        for is_dst in (False, True):
+            datetime_ = tz.localize(utc + offset, is_dst=is_dst)
+            if datetime_.utcoffset() == offset:
+                return cls(data['method'], datetime_)
+        return cls(data['method'], pytz.utc.localize(utc).astimezone(tz))
+
     @property
     def timezone(self):
         try:
@@ -204,8 +326,14 @@ class ImageDate:
         else:
             self.datetime = tz.localize(self.datetime)
 
+    @staticmethod
+    def outranks(method, imdate):
+        if imdate is None:
+            return True
+        return registry.rank(method) < registry.rank(imdate.method)
+
     def lexical_key(self):
-        return -ImageDate.methods.index(self.method)
+        return -registry.methods.index(self.method)
 
     def __lt__(self, other):
         return False if other is None else NotImplemented
@@ -353,49 +481,49 @@ class Report(object):
             if file not in valid
         )
 
+    @staticmethod
+    def entry(tag, file, key, new=None, old=None, has_keys=True):
+        if has_keys and file != key:
+            yield '[K{}] {}'.format(tag, key)
+            yield '[ F] :: {}'.format(file)
+        else:
+            yield '[F{}] {}'.format(tag, file)
+        if new:
+            yield '[ T] :: {}'.format(new)
+        if old:
+            yield '[ t] :: {}'.format(old)
+
     def short(self):
-        if self.has_keys:
-            for file, key in self.remaining.items():
-                yield '[K?] {}'.format(key)
-                yield '[ F] :: {}'.format(file)
-
-            for file, (key, new, old) in self.overwrites.items():
-                yield '[K!] {}'.format(key)
-                yield '[ F] :: {}'.format(file)
-                yield '[ T] :: {}'.format(new)
-                yield '[ t] :: {}'.format(old)
-
-            for file, (key, new) in self.additions.items():
-                yield '[K+] {}'.format(key)
-                yield '[ F] :: {}'.format(file)
-                yield '[ T] :: {}'.format(new)
-
-            for file, key in self.redundants.items():
-                yield '[K=] {}'.format(key)
-                yield '[ F] :: {}'.format(file)
+        for file, key in self.remaining.items():
+            yield from self.entry('?', file, key, has_keys=self.has_keys)
 
-        else:
-            for file, _ in self.remaining.items():
-                yield '[F?] {}'.format(file)
+        for file, (key, new, old) in self.overwrites.items():
+            yield from self.entry(
+                '!', file, key, new, old, has_keys=self.has_keys
+            )
 
-            for file, (_, new, old) in self.overwrites.items():
-                yield '[F!] {}'.format(file)
-                yield '[ T] :: {}'.format(new)
-                yield '[ t] :: {}'.format(old)
+        for file, (key, new) in self.additions.items():
+            yield from self.entry('+', file, key, new, has_keys=self.has_keys)
 
-            for file, (_, new) in self.additions.items():
-                yield '[F+] {}'.format(file)
-                yield '[ T] :: {}'.format(new)
+        for file, key in self.redundants.items():
+            yield from self.entry('=', file, key, has_keys=self.has_keys)
 
-            for file, _ in self.redundants.items():
-                yield '[F=] {}'.format(file)
+    def counts(self):
+        return OrderedDict([
+            ('files', len(self.files)),
+            ('remaining', len(self.remaining)),
+            ('overwrites', len(self.overwrites)),
+            ('additions', len(self.additions)),
+            ('redundants', len(self.redundants)),
+        ])
 
-    def long(self):
+    @classmethod
+    def long_format(cls, short_lines, counts):
         current = None
 
-        for line in self.short():
+        for line in short_lines:
             prefix = line[:4]
-            section = self.sections.get(prefix, current)
+            section = cls.sections.get(prefix, current)
 
             if current != section:
                 if current:
@@ -405,12 +533,14 @@ class Report(object):
 
             yield '  ' + line[5:]
 
+        counts = OrderedDict(counts)
         yield ''
-        yield '{} files:'.format(len(self.files))
-        yield '  {} remaining'.format(len(self.remaining))
-        yield '  {} overwrites'.format(len(self.overwrites))
-        yield '  {} additions'.format(len(self.additions))
-        yield '  {} redundants'.format(len(self.redundants))
+        yield '{} files:'.format(counts.pop('files'))
+        for name, count in counts.items():
+            yield '  {} {}'.format(count, name)
+
+    def long(self):
+        return self.long_format(self.short(), self.counts())
 
     def __str__(self):
         return "\n".join(self.long())
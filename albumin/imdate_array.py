@@ -0,0 +1,203 @@
+# Albumin Image Date Arrays
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Columnar image dates for large batches. Merging dates by key and
+formatting UTC file names are done on arrays, and give exactly what
+the ImageDate objects give with max(), merge_imdates and strftime.
+"""
+
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from operator import attrgetter
+
+import pytz
+
+from albumin.lazy import lazy_import
+from albumin import trace
+
+try:
+    numpy = lazy_import('numpy')
+except ImportError:
+    numpy = None
+
+# Batches smaller than this are cheaper to do with ImageDate objects.
+threshold = 1000
+
+utc_epoch = datetime(1970, 1, 1, tzinfo=pytz.utc)
+naive_epoch = datetime(1970, 1, 1)
+microsecond = timedelta(microseconds=1)
+
+# strftime doesn't zero-pad years before 1000.
+min_name_epoch = (datetime(1000, 1, 1) - naive_epoch) // microsecond
+
+# Columns of YYYYMMDDTHHMMSS in numpy's YYYY-MM-DDTHH:MM:SS.
+name_columns = [0, 1, 2, 3, 5, 6, 8, 9, 10, 11, 12, 14, 15, 17, 18]
+
+
+def available(size):
+    return numpy is not None and size >= threshold
+
+
+class ImageDateArray:
+    """
+    Image dates as int64 microseconds since the UTC epoch (the wall
+    time for naive datetimes), int16 indexes into ImageDate.methods
+    (lower is better) and int16 timezone ids (-1 for naive datetimes).
+    """
+
+    def __init__(self, epochs, ranks, zones, zone_names=()):
+        self.epochs = epochs
+        self.ranks = ranks
+        self.zones = zones
+        self.zone_names = list(zone_names)
+
+    @classmethod
+    @trace.traced(items=lambda cls, imdates, methods, **_: len(imdates))
+    def from_imdates(cls, imdates, methods, times=True):
+        """
+        Converts ImageDates, leaving out the times and timezones (as
+        None) if times is False, for when only the methods are needed.
+        """
+        size = len(imdates)
+        ranks = {method: i for i, method in enumerate(methods)}
+        method_ranks = numpy.fromiter(
+            map(ranks.__getitem__, map(attrgetter('method'), imdates)),
+            dtype=numpy.int16, count=size,
+        )
+        if not times:
+            return cls(None, method_ranks, None)
+
+        # Everything here maps a C function over the datetimes, except
+        # for one call per distinct tzinfo.
+        dts = list(map(attrgetter('datetime'), imdates))
+        tzinfos = list(map(attrgetter('tzinfo'), dts))
+
+        def field(func):
+            return numpy.fromiter(map(func, dts), numpy.int64, size)
+
+        days = field(datetime.toordinal) - naive_epoch.toordinal()
+        seconds = field(attrgetter('hour')) * 3600 \
+            + field(attrgetter('minute')) * 60 + field(attrgetter('second'))
+        walls = (days * 86400 + seconds) * 10**6 \
+            + field(attrgetter('microsecond'))
+
+        zone_ids, zones, offsets = {}, {}, {}
+        for tz, dt in dict(zip(tzinfos, dts)).items():
+            if tz is None:
+                zones[tz], offsets[tz] = -1, 0
+                continue
+            zone = getattr(tz, 'zone', None) or dt.tzname()
+            zones[tz] = zone_ids.setdefault(zone, len(zone_ids))
+            if isinstance(tz, (pytz.BaseTzInfo, timezone)):
+                offsets[tz] = dt.utcoffset() // microsecond
+
+        if len(offsets) == len(zones):
+            utcoffsets = numpy.fromiter(
+                map(offsets.__getitem__, tzinfos), numpy.int64, size,
+            )
+        else:
+            utcoffsets = numpy.fromiter((
+                dt.utcoffset() // microsecond if dt.tzinfo else 0
+                for dt in dts
+            ), numpy.int64, size)
+
+        epochs = walls - utcoffsets
+        zones = numpy.fromiter(
+            map(zones.__getitem__, tzinfos), numpy.int16, size,
+        )
+        return cls(epochs, method_ranks, zones, zone_ids)
+
+    def __len__(self):
+        return len(self.ranks)
+
+    @trace.traced(items=lambda self, sizes: len(sizes))
+    def max_by_key(self, sizes):
+        """
+        Finds the best date of each key, where the dates are in runs of
+        the given sizes, one run per key. Like max() in merge_imdates,
+        the later of equally good dates wins.
+
+        Returns the index of each key's best date, and the indexes of
+        the dates that tie with the best date so far of their key along
+        with the indexes of those best dates. A tie is a conflict if
+        the two dates have different times, which is left to the
+        callers to check on the few ties, so that from_imdates can
+        skip the times.
+        """
+        size = len(self.ranks)
+        if size == 0:
+            empty = numpy.zeros(0, dtype=numpy.int64)
+            return empty, empty, empty
+
+        sizes = numpy.asarray(sizes, dtype=numpy.int64)
+        ends = numpy.cumsum(sizes) - 1
+        starts = numpy.zeros(size, dtype=bool)
+        starts[ends[:-1] + 1] = True
+        starts[0] = True
+        group = numpy.cumsum(starts) - 1
+        rank = self.ranks.astype(numpy.int64)
+
+        # Later keys are shifted below earlier ones, so the running
+        # minimum never carries over from one key to the next.
+        span = int(rank.max()) + 1
+        shift = group * span
+        running = numpy.minimum.accumulate(rank - shift) + shift
+
+        before = numpy.empty(size, dtype=numpy.int64)
+        before[1:] = running[:-1]
+        before[starts] = span
+        is_best = rank <= before
+
+        last_best = numpy.maximum.accumulate(
+            numpy.where(is_best, numpy.arange(size), 0)
+        )
+        prev_best = numpy.zeros(size, dtype=numpy.int64)
+        prev_best[1:] = last_best[:-1]
+
+        tied = numpy.flatnonzero(rank == before)
+        return last_best[ends], tied, prev_best[tied]
+
+    @trace.traced(items=lambda self, exts: len(exts))
+    def utc_names(self, exts):
+        """
+        Formats '{:%Y%m%dT%H%M%SZ}{{:02}}{}' for the UTC time of each
+        date and the given extensions. Returns None for naive dates.
+        """
+        seconds = self.epochs // 10**6
+        stamps = numpy.datetime_as_string(
+            seconds.astype('datetime64[s]'), unit='s',
+        ).astype('U19')
+        chars = stamps.view('U1').reshape(-1, 19)[:, name_columns]
+        digits = numpy.ascontiguousarray(chars).view('U15').ravel()
+        names = numpy.char.add(
+            numpy.char.add(digits, 'Z{:02}'),
+            numpy.asarray(list(exts), dtype=str).reshape(-1),
+        ).tolist()
+
+        for i in numpy.flatnonzero(self.zones < 0):
+            names[i] = None
+        early = (self.zones >= 0) & (self.epochs < min_name_epoch)
+        for i in numpy.flatnonzero(early):
+            utc = utc_epoch + int(self.epochs[i]) * microsecond
+            names[i] = '{:%Y%m%dT%H%M%SZ}{{:02}}{}'.format(utc, exts[i])
+        return names
+
+    def __repr__(self):
+        return 'ImageDateArray(size={}, zones={})'.format(
+            len(self), len(self.zone_names)
+        )
@@ -0,0 +1,202 @@
+# Albumin Native Import
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Puts files into the annex object store without copying their bytes
+where the filesystem allows it, instead of going through git annex
+import. Each file's content is first put in a temporary object in
+.git/annex/tmp/ in the cheapest way that works:
+
+- a hardlink, when the file is on the repo's filesystem and is deleted
+  after the import anyway, which is a move that keeps the file until
+  it is in the annex,
+- a reflink (FICLONE) on the same filesystem, when the file is kept,
+- otherwise a large-buffer copy on a thread pool, hashed as it is
+  copied.
+
+Linked objects are made read-only and then hashed natively, so every
+key is calculated from the object that is stored under it. The objects
+are then moved into .git/annex/objects/, and git-annex is told that the
+repo has the keys with one batch of setpresentkey.
+"""
+
+import os
+import stat
+import shutil
+import tempfile
+import subprocess
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from albumin import readorder
+from albumin import trace
+
+FICLONE = 0x40049409
+
+
+def reflink(path, dest):
+    if fcntl is None:
+        raise OSError('Reflinks are not supported')
+    with open(path, 'rb') as file, open(dest, 'wb') as dest_file:
+        fcntl.ioctl(dest_file.fileno(), FICLONE, file.fileno())
+
+
+def freeze(path):
+    mode = os.stat(path).st_mode
+    os.chmod(path, stat.S_IMODE(mode) & ~0o222)
+
+
+class Ingester:
+    def __init__(self, repo, hasher, keep=False, threads=None):
+        self.repo = repo
+        self.hasher = hasher
+        self.keep = keep
+        self.threads = threads or hasher.threads
+        self.annex_dir = os.path.join(repo.path, 'annex')
+        self.tmp_dir = os.path.join(self.annex_dir, 'tmp')
+
+    def annex_batch(self, args, lines):
+        """
+        Runs a git annex --batch command with a line per item and
+        returns its output lines.
+        """
+        if not lines:
+            return []
+        result = subprocess.run(
+            ['git', 'annex'] + args + ['--batch'],
+            input='\n'.join(lines) + '\n', stdout=subprocess.PIPE,
+            cwd=self.repo.workdir, universal_newlines=True, check=True,
+        )
+        return result.stdout.splitlines()
+
+    def object_paths(self, keys):
+        keys = list(keys)
+        lines = self.annex_batch(
+            ['examinekey', '--format=${hashdirmixed}${key}/${key}\\n'],
+            keys,
+        )
+        return {
+            key: os.path.join(self.annex_dir, 'objects', line)
+            for key, line in zip(keys, lines)
+        }
+
+    def set_present(self, keys):
+        uuid = self.repo.get_config('annex.uuid')
+        self.annex_batch(
+            ['setpresentkey'], ['{} {} 1'.format(key, uuid) for key in keys],
+        )
+
+    def transfer(self, path, tmp):
+        """
+        Puts path's content at tmp, read-only. Returns how it was done,
+        and the key of the content if it was copied.
+        """
+        os.makedirs(os.path.dirname(tmp))
+        same_fs = os.stat(path).st_dev == os.stat(self.tmp_dir).st_dev
+        method, key = None, None
+        if same_fs and not self.keep:
+            try:
+                os.link(path, tmp)
+                method = 'hardlink'
+            except OSError:
+                pass
+        elif same_fs:
+            try:
+                reflink(path, tmp)
+                method = 'reflink'
+            except OSError:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+
+        if method is None:
+            key = self.hasher.copy(path, tmp)
+            method = 'copy'
+        freeze(tmp)
+        return method, key
+
+    def place(self, tmp, dest):
+        """
+        Moves a temporary object to dest, unless it's already there.
+        """
+        if os.path.exists(dest):
+            os.remove(tmp)
+            return False
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.replace(tmp, dest)
+        freeze(os.path.dirname(dest))
+        return True
+
+    @trace.traced(items=lambda self, paths: len(paths))
+    def ingest(self, paths):
+        """
+        Puts the files' contents in the annex. Returns each file's key
+        and object path. Unless keeping them, the files are deleted
+        once they are all in the annex.
+        """
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        work_dir = tempfile.mkdtemp(prefix='albumin-', dir=self.tmp_dir)
+        try:
+            # Each object keeps its file's name, for its key extension.
+            tmps = OrderedDict(
+                (path, os.path.join(
+                    work_dir, str(num), os.path.basename(path),
+                ))
+                for num, path in enumerate(paths)
+            )
+            keys = {}
+            with ThreadPoolExecutor(self.threads) as pool:
+                futures = [
+                    (path, pool.submit(self.transfer, path, tmps[path]))
+                    for path in readorder.ordered(paths)
+                ]
+                for path, future in futures:
+                    method, key = future.result()
+                    trace.count('import {}'.format(method))
+                    if key is not None:
+                        keys[path] = key
+
+            linked = [path for path in paths if path not in keys]
+            linked_keys = self.hasher.keys([tmps[path] for path in linked])
+            for path, (_, key) in zip(linked, linked_keys):
+                keys[path] = key
+            keys = OrderedDict((path, keys[path]) for path in paths)
+            objects = self.object_paths(set(keys.values()))
+
+            placed = 0
+            for path, key in keys.items():
+                placed += self.place(tmps[path], objects[key])
+            trace.count('import present', len(keys) - placed)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        self.set_present(set(keys.values()))
+        if not self.keep:
+            for path in paths:
+                os.remove(path)
+
+        return OrderedDict(
+            (path, (key, objects[key])) for path, key in keys.items()
+        )
+
+    def __repr__(self):
+        return 'Ingester(path={!r}, keep={})'.format(
+            self.repo.path, self.keep
+        )
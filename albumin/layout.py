@@ -0,0 +1,138 @@
+# Albumin Layouts
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Layouts put the date-named files into folders by their date in UTC,
+like ``YYYY/MM/`` for ``2015/06/20150601T102030Z00.jpg``. The folders
+are made from the name itself, so a file's path only depends on its
+name, and files can be moved between layouts without reading their
+metadata. The default layout is the empty one, with every file at the
+root of the repo.
+"""
+
+import os
+import re
+
+from albumin.lazy import lazy_import
+from albumin.views import link_target
+from albumin.views import update_tree
+from albumin import trace
+
+pygit2 = lazy_import('pygit2')
+
+flat_format = '{:%Y%m%dT%H%M%SZ}{{:02}}{}'
+flat_name_re = re.compile(r'^(\d{8})T\d{6}Z\d\d(\.[^/]*)?$')
+
+tokens = {'YYYY': slice(0, 4), 'MM': slice(4, 6), 'DD': slice(6, 8)}
+token_re = re.compile('(YYYY|MM|DD)')
+
+
+class Layout:
+    def __init__(self, pattern=''):
+        folders = pattern.split('/')[:-1]
+        if (pattern and not pattern.endswith('/')) \
+                or not all(folders) \
+                or any(f in ('.', '..') for f in folders) \
+                or set(pattern) & set('{}%\\'):
+            raise ValueError('Invalid layout: {!r}'.format(pattern))
+        self.pattern = pattern
+        self.parts = [part for part in token_re.split(pattern) if part]
+        self.depth = len(folders)
+
+    def folder(self, name):
+        """
+        Returns the folder of a date name, from its own date.
+        """
+        return ''.join(
+            name[tokens[part]] if part in tokens else part
+            for part in self.parts
+        )
+
+    def place(self, name):
+        return self.folder(name) + name
+
+    def name(self, utc, ext):
+        """
+        Returns the format of the paths of files from utc with ext,
+        with a {:02} for the number that tells them apart.
+        """
+        return self.place(flat_format.format(utc, ext))
+
+    def path(self, path):
+        """
+        Returns where a date-named file at path goes in this layout,
+        or None if it isn't date-named.
+        """
+        name = os.path.basename(path)
+        if not flat_name_re.match(name):
+            return None
+        return self.place(name)
+
+    def __eq__(self, other):
+        return isinstance(other, Layout) and self.pattern == other.pattern
+
+    def __repr__(self):
+        return 'Layout({!r})'.format(self.pattern)
+
+
+@trace.traced()
+def relayout_tree(repo, tree, layout):
+    """
+    Writes a copy of tree with its date-named symlinks moved to where
+    layout puts them, with their targets rewritten for their depth.
+    Files whose new path is taken are left where they are. Returns the
+    new tree id, and the moved and the left (path, new path) pairs.
+    """
+    links, paths = {}, set()
+    stack = [('', tree)]
+    while stack:
+        prefix, subtree = stack.pop()
+        for entry in subtree:
+            path = prefix + entry.name
+            if entry.filemode == pygit2.GIT_FILEMODE_TREE:
+                stack.append((path + '/', repo[entry.id]))
+                continue
+            paths.add(path)
+            if entry.filemode == pygit2.GIT_FILEMODE_LINK:
+                links[path] = entry.id
+
+    moves = {}
+    for path in sorted(links):
+        dest = layout.path(path)
+        if dest is not None and dest != path:
+            moves[path] = dest
+
+    taken = paths.difference(moves)
+    moved, left = [], []
+    for path, dest in sorted(moves.items()):
+        if dest in taken:
+            left.append((path, dest))
+        else:
+            taken.add(dest)
+            moved.append((path, dest))
+
+    # A file can move to where another one moved from.
+    changes = {path: None for path, _ in moved}
+    for path, dest in moved:
+        target = repo[links[path]].data.decode()
+        blob = repo.create_blob(
+            link_target(path, target, dest.count('/')).encode()
+        )
+        changes[dest] = (blob, pygit2.GIT_FILEMODE_LINK)
+
+    trace.count('relayout moves', len(moved))
+    tree_id = update_tree(repo, tree, changes) if changes else tree.id
+    return tree_id or repo.TreeBuilder().write(), moved, left
@@ -0,0 +1,322 @@
+# Albumin Metadata Store
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sqlite3
+import threading
+
+from git_annex_adapter import GitAnnexMetadata
+from albumin import trace
+
+
+class MetadataBackend:
+    def get(self, metadata, field):
+        raise NotImplementedError
+
+    def set(self, metadata, field, values):
+        raise NotImplementedError
+
+    def delete(self, metadata, field):
+        raise NotImplementedError
+
+    def fields(self, metadata):
+        raise NotImplementedError
+
+    def invalidate(self, key=None):
+        pass
+
+    def refresh(self):
+        pass
+
+
+class AnnexBackend(MetadataBackend):
+    def get(self, metadata, field):
+        return GitAnnexMetadata.__getitem__(metadata, field)
+
+    def set(self, metadata, field, values):
+        GitAnnexMetadata.__setitem__(metadata, field, values)
+
+    def delete(self, metadata, field):
+        GitAnnexMetadata.__delitem__(metadata, field)
+
+    def fields(self, metadata):
+        return {
+            field: list(GitAnnexMetadata.__getitem__(metadata, field))
+            for field in GitAnnexMetadata.__iter__(metadata)
+        }
+
+    def __repr__(self):
+        return 'AnnexBackend()'
+
+
+class SQLiteBackend(MetadataBackend):
+    schema = """
+        CREATE TABLE IF NOT EXISTS keys (
+            key TEXT PRIMARY KEY
+        );
+        CREATE TABLE IF NOT EXISTS fields (
+            key TEXT NOT NULL,
+            field TEXT NOT NULL,
+            value TEXT NOT NULL,
+            PRIMARY KEY (key, field, value)
+        );
+        CREATE TABLE IF NOT EXISTS state (
+            name TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS stale (
+            key TEXT PRIMARY KEY
+        );
+        CREATE INDEX IF NOT EXISTS fields_by_value
+            ON fields (field, value, key);
+    """
+
+    def __init__(self, repo, path, source=None, write_through=True):
+        self.repo = repo
+        self.path = path
+        self.source = source or AnnexBackend()
+        self.write_through = write_through
+
+        self.local = threading.local()
+        self.db.executescript(self.schema)
+        self.refresh()
+
+    @property
+    def db(self):
+        """
+        The calling thread's own connection, as the store is read from
+        the hasher's and exporter's thread pools.
+        """
+        try:
+            return self.local.db
+        except AttributeError:
+            db = sqlite3.connect(self.path)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self.local.db = db
+            return db
+
+    def get(self, metadata, field):
+        if not self.cached(metadata.key):
+            self.load(metadata)
+        rows = self.db.execute(
+            'SELECT value FROM fields WHERE key = ? AND field = ?',
+            (metadata.key, field),
+        )
+        return [value for value, in rows]
+
+    def set(self, metadata, field, values):
+        self.source.set(metadata, field, values)
+        if self.write_through and self.cached(metadata.key):
+            with self.db:
+                self.db.execute(
+                    'DELETE FROM fields WHERE key = ? AND field = ?',
+                    (metadata.key, field),
+                )
+                self.db.executemany(
+                    'INSERT OR IGNORE INTO fields VALUES (?, ?, ?)',
+                    ((metadata.key, field, v) for v in values),
+                )
+        else:
+            self.invalidate(metadata.key)
+
+    def delete(self, metadata, field):
+        self.source.delete(metadata, field)
+        self.invalidate(metadata.key)
+
+    def fields(self, metadata):
+        if not self.cached(metadata.key):
+            return self.load(metadata)
+        fields = {}
+        rows = self.db.execute(
+            'SELECT field, value FROM fields WHERE key = ?',
+            (metadata.key,),
+        )
+        for field, value in rows:
+            fields.setdefault(field, []).append(value)
+        return fields
+
+    def field_values(self, fields, keys=None):
+        return field_values(self.db, fields, keys)
+
+    def cached(self, key):
+        row = self.db.execute('SELECT 1 FROM keys WHERE key = ?', (key,))
+        return row.fetchone() is not None
+
+    def load(self, metadata):
+        trace.count('metadata cache misses')
+        fields = self.source.fields(metadata)
+        self.store(metadata.key, fields)
+        return fields
+
+    def store(self, key, fields):
+        with self.db:
+            self.db.execute('DELETE FROM stale WHERE key = ?', (key,))
+            self.db.execute('DELETE FROM fields WHERE key = ?', (key,))
+            self.db.execute('INSERT OR IGNORE INTO keys VALUES (?)', (key,))
+            self.db.executemany(
+                'INSERT OR IGNORE INTO fields VALUES (?, ?, ?)',
+                ((key, field, value)
+                 for field, values in fields.items() for value in values),
+            )
+
+    def invalidate(self, key=None):
+        with self.db:
+            if key is None:
+                self.db.execute('DELETE FROM keys')
+                self.db.execute('DELETE FROM fields')
+                self.db.execute('DELETE FROM stale')
+                self.db.execute("DELETE FROM state WHERE name = 'complete'")
+            else:
+                self.db.execute('DELETE FROM keys WHERE key = ?', (key,))
+                self.db.execute('DELETE FROM fields WHERE key = ?', (key,))
+                self.db.execute(
+                    'INSERT OR IGNORE INTO stale VALUES (?)', (key,)
+                )
+
+    def state(self, name):
+        row = self.db.execute(
+            'SELECT value FROM state WHERE name = ?', (name,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_state(self, name, value):
+        with self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO state VALUES (?, ?)', (name, value)
+            )
+
+    def branch_head(self):
+        try:
+            ref = self.repo.lookup_reference('refs/heads/git-annex')
+        except (KeyError, ValueError):
+            return None
+        return str(ref.target)
+
+    def branch_changes(self, old, new):
+        diff = self.repo.diff(old, new)
+        for patch in diff:
+            for path in (patch.delta.old_file.path,
+                         patch.delta.new_file.path):
+                if path.endswith('.log.met'):
+                    yield branch_file_key(os.path.basename(path))
+
+    def journal_changes(self):
+        journal = os.path.join(self.repo.path, 'annex', 'journal')
+        try:
+            names = os.listdir(journal)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if name.endswith('.log.met'):
+                yield journal_file_key(name)
+
+    @trace.traced()
+    def refresh(self):
+        head = self.branch_head()
+        synced = self.state('git-annex')
+
+        if synced != head:
+            try:
+                if not (synced and head):
+                    raise ValueError(synced, head)
+                changed = set(self.branch_changes(synced, head))
+            except (KeyError, ValueError):
+                self.invalidate()
+            else:
+                for key in changed:
+                    self.invalidate(key)
+
+        for key in self.journal_changes():
+            self.invalidate(key)
+
+        self.set_state('git-annex', head)
+
+    @trace.traced()
+    def rebuild(self, annex, keys):
+        self.invalidate()
+        for key in keys:
+            self.load(annex[key])
+        self.set_state('git-annex', self.branch_head())
+        self.set_state('complete', '1')
+
+    def complete(self):
+        return self.state('complete') == '1'
+
+    @trace.traced()
+    def sync(self, annex):
+        stale = [key for key, in self.db.execute('SELECT key FROM stale')]
+        for key in stale:
+            self.load(annex[key])
+        return len(stale)
+
+    @trace.traced()
+    def check(self, annex):
+        keys = [key for key, in self.db.execute('SELECT key FROM keys')]
+        for key in keys:
+            metadata = annex[key]
+            cached = {
+                field: sorted(values)
+                for field, values in self.fields(metadata).items()
+            }
+            actual = {
+                field: sorted(values)
+                for field, values in self.source.fields(metadata).items()
+            }
+            if cached != actual:
+                yield key, cached, actual
+
+    def __repr__(self):
+        return 'SQLiteBackend(path={!r}, write_through={!r})'.format(
+            self.path, self.write_through
+        )
+
+
+def branch_file_key(name):
+    name = name[:-len('.log.met')]
+    return name.replace('%', '/').replace('&c', ':') \
+        .replace('&s', '%').replace('&a', '&')
+
+
+def journal_file_key(name):
+    parts = name.replace('__', '\0').split('_')
+    return branch_file_key(parts[-1].replace('\0', '_'))
+
+
+def field_values(db, fields, keys=None):
+    """
+    Returns {key: {field: values}} of the given fields from a store's
+    database, for all cached keys or only the given ones.
+    """
+    values = {}
+    fields = list(fields)
+    sql = 'SELECT key, field, value FROM fields WHERE field IN ({})'
+    sql = sql.format(', '.join('?' * len(fields)))
+
+    if keys is None:
+        queries = [(sql, fields)]
+    else:
+        keys = list(keys)
+        sql += ' AND key IN ({})'
+        queries = [
+            (sql.format(', '.join('?' * len(batch))), fields + batch)
+            for batch in (keys[i:i + 500] for i in range(0, len(keys), 500))
+        ]
+
+    for query, params in queries:
+        for key, field, value in db.execute(query, params):
+            values.setdefault(key, {}).setdefault(field, []).append(value)
+    return values
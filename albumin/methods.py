@@ -0,0 +1,157 @@
+# Albumin Methods
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Registry of image date methods and the extractors that find them.
+
+Methods are ranked by a number, lower being more trustworthy. An
+extractor is a function taking paths and returning ImageDates by path,
+declared with the methods it can return, the file extensions it
+applies to (None for all files) and its relative cost per file.
+
+Plugins are functions registered under the ``albumin.imdate_methods``
+entry point group, called with the registry, e.g.::
+
+    def register(registry):
+        registry.add_method('Filename/WhatsApp', rank=1150)
+        registry.add_format('IMG-%Y%m%d-WA')
+        registry.add_extractor(
+            'whatsapp', from_whatsapp_name, ['Filename/WhatsApp'],
+            extensions=['.jpg', '.mp4'], cost=1,
+        )
+
+Plugins are loaded the first time the registry is asked for a method
+it doesn't know, for all its methods, or for its extractors, so that
+dates of plugin methods can be read back in any process.
+"""
+
+import os
+import time
+import bisect
+from collections import OrderedDict
+
+from albumin import trace
+
+entry_point_group = 'albumin.imdate_methods'
+
+
+class Extractor:
+    def __init__(self, name, func, methods, extensions=None, cost=1.0):
+        self.name = name
+        self.func = func
+        self.methods = list(methods)
+        self.extensions = None
+        if extensions is not None:
+            self.extensions = {ext.lower() for ext in extensions}
+        self.cost = cost
+
+    def applies_to(self, path):
+        if self.extensions is None:
+            return True
+        return os.path.splitext(path)[1].lower() in self.extensions
+
+    def __call__(self, paths, **options):
+        return self.func(*paths, **options)
+
+    def __repr__(self):
+        return 'Extractor(name={!r}, methods={}, cost={})'.format(
+            self.name, len(self.methods), self.cost
+        )
+
+
+class MethodRegistry:
+    def __init__(self):
+        self.ranks = {}
+        self.methods = []
+        self.datetime_formats = []
+        self.extractors = OrderedDict()
+        self.timings = OrderedDict()
+        self.plugins_loaded = False
+
+    def add_method(self, name, rank):
+        if name in self.ranks:
+            raise ValueError('Method already registered: {}'.format(name))
+        ranks = [self.ranks[method] for method in self.methods]
+        self.methods.insert(bisect.bisect_right(ranks, rank), name)
+        self.ranks[name] = rank
+
+    def add_format(self, datetime_format):
+        if datetime_format not in self.datetime_formats:
+            self.datetime_formats.append(datetime_format)
+
+    def add_extractor(self, name, func, methods, extensions=None, cost=1.0):
+        unknown = [method for method in methods if method not in self.ranks]
+        if unknown:
+            raise ValueError('Unregistered methods: {}'.format(unknown))
+        extractor = Extractor(name, func, methods, extensions, cost)
+        self.extractors[name] = extractor
+        return extractor
+
+    def __contains__(self, name):
+        if name not in self.ranks:
+            self.load_plugins()
+        return name in self.ranks
+
+    def rank(self, name):
+        if name not in self.ranks:
+            self.load_plugins()
+        return self.ranks[name]
+
+    def all_methods(self):
+        self.load_plugins()
+        return self.methods
+
+    def best_method(self, extractor):
+        return min(extractor.methods, key=self.ranks.get)
+
+    def schedule(self):
+        self.load_plugins()
+        return sorted(self.extractors.values(), key=lambda e: e.cost)
+
+    def load_plugins(self):
+        if self.plugins_loaded:
+            return
+        self.plugins_loaded = True
+        for entry_point in entry_points(entry_point_group):
+            entry_point.load()(self)
+
+    def timed(self, extractor, paths, **options):
+        start = time.perf_counter()
+        with trace.span('extract.{}'.format(extractor.name), items=len(paths)):
+            results = extractor(paths, **options)
+        files, seconds = self.timings.get(extractor.name, (0, 0.0))
+        self.timings[extractor.name] = (
+            files + len(paths), seconds + time.perf_counter() - start
+        )
+        return results
+
+    def __repr__(self):
+        return 'MethodRegistry(methods={}, extractors={})'.format(
+            len(self.methods), list(self.extractors)
+        )
+
+
+def entry_points(group):
+    try:
+        from importlib.metadata import entry_points as metadata_entry_points
+    except ImportError:
+        import pkg_resources
+        return list(pkg_resources.iter_entry_points(group))
+
+    found = metadata_entry_points()
+    if hasattr(found, 'select'):
+        return list(found.select(group=group))
+    return list(found.get(group, []))
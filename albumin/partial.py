@@ -0,0 +1,97 @@
+# Albumin Partial Reports
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Partial reports hold the keys and image dates of one shard of files,
+analyzed on the machine that has them without access to the repo.
+They are JSON lines: a header with the format version, host, root
+folder and key backend, then one line per file.
+"""
+
+import json
+import socket
+import itertools
+from collections import OrderedDict
+
+from albumin.imdate import analyze_date
+from albumin.imdate import ImageDate
+from albumin.hasher import Hasher
+from albumin.utils import files_in
+from albumin import trace
+
+version = 2
+
+
+class PartialReportError(ValueError):
+    pass
+
+
+@trace.traced()
+def write_partial(path, out, hasher=None, timezone=None, mtime=False,
+                  host=None, chunk_size=1000):
+    hasher = hasher or Hasher()
+    header = OrderedDict([
+        ('albumin-partial', version),
+        ('host', host or socket.gethostname()),
+        ('root', path),
+        ('backend', hasher.backend),
+    ])
+    print(json.dumps(header), file=out)
+
+    count, paths = 0, files_in(path)
+    while True:
+        chunk = list(itertools.islice(paths, chunk_size))
+        if not chunk:
+            break
+
+        report = analyze_date(*chunk, timezone=timezone, mtime=mtime)
+        for file, key in hasher.keys(chunk):
+            _, imdate = report.additions.get(file, (None, None))
+            print(json.dumps(OrderedDict([
+                ('file', file),
+                ('key', key),
+                ('imdate', imdate.dump() if imdate else None),
+            ])), file=out)
+        count += len(chunk)
+    return count
+
+
+def read_partial(lines):
+    """
+    Returns the header of a partial report and its entries as
+    (host:file, key, imdate) tuples.
+    """
+    lines = iter(lines)
+    try:
+        header = json.loads(next(lines))
+    except (StopIteration, ValueError) as err:
+        raise PartialReportError('Not a partial report') from err
+    if header.get('albumin-partial') != version:
+        raise PartialReportError('Unknown partial report version', header)
+
+    def entries():
+        for line in lines:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            imdate = entry['imdate']
+            yield (
+                '{}:{}'.format(header['host'], entry['file']),
+                entry['key'],
+                ImageDate.load(imdate) if imdate else None,
+            )
+
+    return header, entries()
@@ -0,0 +1,183 @@
+# Albumin Pending Reports
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+A durable queue of reports whose metadata hasn't been applied yet.
+Each job is a JSON file written atomically into the queue folder, and
+removed once applied. Jobs are applied in order by whoever holds the
+queue's lock: the background worker, or any process that is about to
+read metadata. A job that fails to load or apply is moved to the
+failed/ folder with its error, so that it doesn't block the rest, and
+can be retried or dropped from there.
+
+Usage:
+    python -m albumin.pending <repo>
+"""
+
+import os
+import sys
+import json
+import time
+import traceback
+from collections import OrderedDict
+
+from albumin.imdate import Report
+from albumin.utils import flocked
+from albumin import trace
+
+
+class PendingQueue:
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = os.path.join(path, 'lock')
+        self.failed_path = os.path.join(path, 'failed')
+
+    @staticmethod
+    def list_jobs(path):
+        try:
+            names = os.listdir(path)
+        except FileNotFoundError:
+            return []
+        return sorted(
+            os.path.join(path, name) for name in names
+            if name.endswith('.json') and not name.startswith('.')
+        )
+
+    def jobs(self):
+        return self.list_jobs(self.path)
+
+    def failed(self):
+        return self.list_jobs(self.failed_path)
+
+    def add(self, report, commit=None, **tags):
+        os.makedirs(self.path, exist_ok=True)
+        name = '{:017.6f}-{}.json'.format(time.time(), commit or 'report')
+        job = OrderedDict([
+            ('commit', commit),
+            ('tags', tags),
+            ('report', list(report.short())),
+        ])
+
+        tmp_path = os.path.join(self.path, '.' + name)
+        with open(tmp_path, 'w') as file:
+            json.dump(job, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, os.path.join(self.path, name))
+
+        dir_fd = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        return name
+
+    @staticmethod
+    def load(job_path):
+        with open(job_path) as file:
+            job = json.load(file)
+        return job['commit'], Report.parse(job['report']), job['tags']
+
+    def locked(self, blocking=True):
+        os.makedirs(self.path, exist_ok=True)
+        return flocked(self.lock_path, blocking=blocking)
+
+    @trace.traced()
+    def drain(self, apply, wait=True, batch_size=100):
+        """
+        Applies queued jobs in order, at most batch_size at a time,
+        until the queue is empty. Without waiting, returns early if
+        another process holds the lock, as it will drain the rest.
+        """
+        applied = 0
+        while self.jobs():
+            with self.locked(blocking=wait) as acquired:
+                if not acquired:
+                    break
+                for job_path in self.jobs()[:batch_size]:
+                    try:
+                        _, report, tags = self.load(job_path)
+                        apply(report, **tags)
+                    except Exception:
+                        self.quarantine(job_path, traceback.format_exc())
+                        continue
+                    os.remove(job_path)
+                    applied += 1
+                    trace.count('applied pending reports')
+        return applied
+
+    def quarantine(self, job_path, error):
+        """
+        Moves a failed job to the failed folder, next to its error.
+        """
+        os.makedirs(self.failed_path, exist_ok=True)
+        dest = os.path.join(self.failed_path, os.path.basename(job_path))
+        with open(dest + '.error', 'w') as file:
+            file.write(error)
+        os.replace(job_path, dest)
+        trace.count('failed pending reports')
+        print('Moved failing pending report to {}'.format(dest),
+              file=sys.stderr)
+
+    def retry(self):
+        """
+        Moves the failed jobs back into the queue.
+        """
+        failed = self.failed()
+        for job_path in failed:
+            os.replace(job_path, os.path.join(
+                self.path, os.path.basename(job_path),
+            ))
+            os.remove(job_path + '.error')
+        return len(failed)
+
+    def drop(self):
+        """
+        Deletes the failed jobs.
+        """
+        failed = self.failed()
+        for job_path in failed:
+            os.remove(job_path)
+            os.remove(job_path + '.error')
+        return len(failed)
+
+    def __len__(self):
+        return len(self.jobs())
+
+    def __repr__(self):
+        return 'PendingQueue(path={!r}, jobs={})'.format(self.path, len(self))
+
+
+def spawn_worker(repo):
+    import subprocess
+    env = {k: v for k, v in os.environ.items() if not k.startswith('GIT_')}
+    log_path = repo.state_path('queue', 'worker.log')
+    with open(log_path, 'a') as log:
+        subprocess.Popen(
+            [sys.executable, '-m', 'albumin.pending', repo.workdir],
+            cwd=repo.workdir, env=env, stdin=subprocess.DEVNULL,
+            stdout=log, stderr=log, start_new_session=True,
+        )
+
+
+def main():
+    from albumin.repo import AlbuminRepo
+    repo = AlbuminRepo(sys.argv[1])
+    repo.drain_queue(wait=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+# Albumin Perceptual Hashes
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from albumin.lazy import lazy_import
+from albumin import trace
+
+try:
+    numpy = lazy_import('numpy')
+except ImportError:
+    numpy = None
+
+try:
+    Image = lazy_import('PIL.Image')
+except ImportError:
+    Image = None
+
+
+def require():
+    missing = [
+        name for name, module in [('numpy', numpy), ('Pillow', Image)]
+        if module is None
+    ]
+    if missing:
+        msg = 'Perceptual hashing needs: {}'.format(', '.join(missing))
+        raise RuntimeError(msg)
+
+
+def dhash(path):
+    with Image.open(path) as image:
+        image = image.convert('L').resize((9, 8), Image.LANCZOS)
+        pixels = numpy.asarray(image, dtype=numpy.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int(numpy.packbits(bits).view('>u8')[0])
+
+
+def popcount(values):
+    if hasattr(numpy, 'bitwise_count'):
+        return numpy.bitwise_count(values)
+    table = numpy.array([bin(i).count('1') for i in range(256)], 'uint8')
+    bytes_ = values.view(numpy.uint8).reshape(-1, 8)
+    return table[bytes_].sum(axis=1, dtype=numpy.uint8)
+
+
+class PerceptualIndex:
+    """
+    64-bit perceptual hashes of annex keys. Hashes live in one uint64
+    array and keys in one newline-separated blob with offsets into it.
+    Searches within three bits split the hashes into four 16-bit
+    buckets (the prefix first) and only compare hashes sharing one with
+    the query, which by the pigeonhole principle finds everything in
+    range. Wider searches compare against the whole array.
+    """
+
+    def __init__(self, hashes=None, offsets=None, blob=b''):
+        require()
+        if hashes is None:
+            hashes = numpy.zeros(0, dtype=numpy.uint64)
+        if offsets is None:
+            offsets = numpy.zeros(1, dtype=numpy.int64)
+        self.hashes = hashes
+        self.offsets = offsets
+        self.blob = blob
+        self._pending = []
+        self._segments = {}
+
+    @classmethod
+    def load(cls, path):
+        require()
+        try:
+            with numpy.load(path) as data:
+                return cls(
+                    data['hashes'], data['offsets'], data['keys'].tobytes()
+                )
+        except FileNotFoundError:
+            return cls()
+
+    def save(self, path):
+        self.merge()
+        with open(path + '.tmp', 'wb') as file:
+            numpy.savez(
+                file, hashes=self.hashes, offsets=self.offsets,
+                keys=numpy.frombuffer(self.blob, dtype=numpy.uint8),
+            )
+        os.replace(path + '.tmp', path)
+
+    def add(self, key, hash_):
+        self._pending.append((key, hash_))
+
+    def merge(self):
+        if not self._pending:
+            return
+        keys, hashes = zip(*self._pending)
+        encoded = [key.encode() + b'\n' for key in keys]
+        lengths = numpy.cumsum([len(k) for k in encoded], dtype=numpy.int64)
+
+        self.hashes = numpy.concatenate([
+            self.hashes, numpy.array(hashes, dtype=numpy.uint64)
+        ])
+        self.offsets = numpy.concatenate([
+            self.offsets, self.offsets[-1] + lengths
+        ])
+        self.blob += b''.join(encoded)
+        self._pending = []
+        self._segments = {}
+
+    def key(self, idx):
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return self.blob[start:end - 1].decode()
+
+    def keys(self):
+        self.merge()
+        return set(self.blob.decode().splitlines())
+
+    def segments(self, count):
+        if count not in self._segments:
+            bits = 64 // count
+            mask = numpy.uint64((1 << bits) - 1)
+            buckets = []
+            for num in range(count):
+                shift = numpy.uint64(64 - bits * (num + 1))
+                values = (self.hashes >> shift) & mask
+                order = numpy.argsort(values, kind='stable')
+                starts = numpy.searchsorted(
+                    values[order], numpy.arange((1 << bits) + 1)
+                )
+                buckets.append((shift, mask, order, starts))
+            self._segments[count] = buckets
+        return self._segments[count]
+
+    def candidates(self, hash_, distance):
+        if distance > 3:
+            return numpy.arange(len(self.hashes))
+
+        query = numpy.uint64(hash_)
+        found = []
+        for shift, mask, order, starts in self.segments(4):
+            value = int((query >> shift) & mask)
+            found.append(order[starts[value]:starts[value + 1]])
+        return numpy.unique(numpy.concatenate(found))
+
+    @trace.traced()
+    def search(self, hash_, distance=4):
+        self.merge()
+        if not len(self.hashes):
+            return []
+        idxs = self.candidates(hash_, distance)
+        dists = popcount(self.hashes[idxs] ^ numpy.uint64(hash_))
+        matches = dists <= distance
+        idxs, dists = idxs[matches], dists[matches]
+        return [
+            (self.key(idx), int(dist))
+            for dist, idx in sorted(zip(dists.tolist(), idxs.tolist()))
+        ]
+
+    def __len__(self):
+        return len(self.hashes) + len(self._pending)
+
+    def __repr__(self):
+        return 'PerceptualIndex(hashes={})'.format(len(self))
@@ -0,0 +1,135 @@
+# Albumin Query
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from datetime import datetime
+from datetime import timedelta
+
+from albumin.imdate import registry
+from albumin import trace
+
+annex_format = '%Y-%m-%d@%H-%M-%S'
+
+date_formats = [
+    ('%Y', 'year'),
+    ('%Y-%m', 'month'),
+    ('%Y-%m-%d', 'day'),
+    ('%Y-%m-%dT%H:%M:%S', 'second'),
+    ('%Y-%m-%d %H:%M:%S', 'second'),
+]
+
+
+def date_range(spec):
+    for fmt, unit in date_formats:
+        try:
+            start = datetime.strptime(spec, fmt)
+            break
+        except ValueError:
+            continue
+    else:
+        raise ValueError(spec)
+
+    if unit == 'year':
+        end = start.replace(year=start.year + 1)
+    elif unit == 'month' and start.month == 12:
+        end = start.replace(year=start.year + 1, month=1)
+    elif unit == 'month':
+        end = start.replace(month=start.month + 1)
+    elif unit == 'day':
+        end = start + timedelta(days=1)
+    else:
+        end = start + timedelta(seconds=1)
+
+    return start.strftime(annex_format), end.strftime(annex_format)
+
+
+def methods_below(method):
+    methods = registry.all_methods()
+    if method not in methods:
+        raise ValueError(method)
+    return methods[methods.index(method) + 1:]
+
+
+class Query:
+    def __init__(self, date=None, since=None, until=None, tags=None,
+                 methods=None, below=None, limit=None, offset=0):
+        self.since, self.until = None, None
+        if date:
+            self.since, self.until = date_range(date)
+        if since:
+            self.since = max(filter(None, [self.since, date_range(since)[0]]))
+        if until:
+            self.until = min(filter(None, [self.until, date_range(until)[1]]))
+
+        self.tags = dict(tags or {})
+        self.methods = list(methods) if methods else None
+        if below:
+            below = methods_below(below)
+            self.methods = [m for m in self.methods or below if m in below]
+
+        self.limit = limit
+        self.offset = offset or 0
+
+    def sql(self):
+        joins, where, params = [], ["d.field = 'datetime'"], []
+
+        if self.methods is not None:
+            marks = ', '.join('?' * len(self.methods))
+            joins.append(
+                "JOIN fields AS m ON m.key = d.key "
+                "AND m.field = 'datetime-method' "
+                "AND m.value IN ({})".format(marks)
+            )
+            params.extend(self.methods)
+
+        for num, (tag, value) in enumerate(sorted(self.tags.items())):
+            joins.append(
+                'JOIN fields AS t{0} ON t{0}.key = d.key '
+                'AND t{0}.field = ? AND t{0}.value = ?'.format(num)
+            )
+            params.extend([tag, value])
+
+        if self.since:
+            where.append('d.value >= ?')
+            params.append(self.since)
+        if self.until:
+            where.append('d.value < ?')
+            params.append(self.until)
+
+        sql = 'SELECT d.key, d.value FROM fields AS d {} WHERE {} ' \
+              'ORDER BY d.value, d.key LIMIT ? OFFSET ?'
+        sql = sql.format(' '.join(joins), ' AND '.join(where))
+        params.extend([-1 if self.limit is None else self.limit, self.offset])
+        return sql, params
+
+    @trace.traced()
+    def run(self, store):
+        sql, params = self.sql()
+        return [
+            (key, datetime.strptime(value, annex_format))
+            for key, value in store.db.execute(sql, params)
+        ]
+
+    def __repr__(self):
+        return (
+            'Query('
+            + 'since={!r}, '.format(self.since)
+            + 'until={!r}, '.format(self.until)
+            + 'tags={!r}, '.format(self.tags)
+            + 'methods={!r}, '.format(self.methods)
+            + 'limit={!r}, '.format(self.limit)
+            + 'offset={!r}'.format(self.offset)
+            + ')'
+        )
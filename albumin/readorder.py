@@ -0,0 +1,181 @@
+# Albumin Read Ordering
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Orders file reads by where the files are on disk, so that reading a
+folder on a spinning disk sweeps across it instead of seeking back and
+forth. Files are sorted by the physical offset of their first extent
+(from the FIEMAP ioctl) where the filesystem supports it, or by inode
+number, which most filesystems allocate close to the data.
+
+Files larger than large_size are kept apart, so that the readers can
+give them their own queue and not hold the small files up behind them.
+The page cache hints are no-ops where posix_fadvise isn't available.
+"""
+
+import os
+import struct
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from albumin import trace
+
+modes = ('none', 'inode', 'physical')
+defaults = {'mode': 'physical', 'large_size': 256 << 20}
+
+# Bytes from the start of a file that metadata readers usually need.
+header_size = 256 << 10
+
+FS_IOC_FIEMAP = 0xC020660B
+fiemap_header = struct.Struct('=QQIIII')
+fiemap_extent = struct.Struct('=QQQQQIIII')
+
+
+def configure(mode=None, large_size=None):
+    if mode is not None:
+        if mode not in modes:
+            raise ValueError('Unknown read order: {}'.format(mode))
+        defaults['mode'] = mode
+    if large_size is not None:
+        defaults['large_size'] = large_size
+
+
+def physical_offset(fd):
+    """
+    Returns the physical byte offset of the first extent of an open
+    file, 0 if it has no extents, or None if FIEMAP isn't supported.
+    """
+    if fcntl is None:
+        return None
+    buffer = bytearray(fiemap_header.size + fiemap_extent.size)
+    fiemap_header.pack_into(buffer, 0, 0, 2 ** 64 - 1, 0, 0, 1, 0)
+    try:
+        fcntl.ioctl(fd, FS_IOC_FIEMAP, buffer)
+    except OSError:
+        return None
+    _, _, _, mapped, _, _ = fiemap_header.unpack_from(buffer)
+    if not mapped:
+        return 0
+    _, physical, *_ = fiemap_extent.unpack_from(buffer, fiemap_header.size)
+    return physical
+
+
+@trace.traced(items=lambda paths, **_: len(paths))
+def schedule(paths, mode=None, large_size=None):
+    """
+    Splits paths into small and large files, each in the order to read
+    them in. Files that can't be stat'ed are put last among the small
+    files, in their original order.
+    """
+    mode = mode or defaults['mode']
+    large_size = large_size or defaults['large_size']
+    if mode not in modes:
+        raise ValueError('Unknown read order: {}'.format(mode))
+
+    small, large = [], []
+    fiemap = {}
+    for i, path in enumerate(paths):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            small.append(((1, 0, 0, i), path))
+            continue
+
+        position = stat.st_ino
+        if mode == 'none':
+            position = 0
+        elif mode == 'physical' and fiemap.get(stat.st_dev, True):
+            offset = file_offset(path)
+            # Offsets aren't comparable with inodes, so a device whose
+            # first file has no FIEMAP is sorted by inodes alone.
+            fiemap.setdefault(stat.st_dev, offset is not None)
+            if fiemap[stat.st_dev]:
+                position = offset or 0
+
+        sort_key = (0, stat.st_dev, position, i)
+        if stat.st_size >= large_size:
+            large.append((sort_key, path))
+        else:
+            small.append((sort_key, path))
+
+    trace.count('large files', len(large))
+    return [p for _, p in sorted(small)], [p for _, p in sorted(large)]
+
+
+def file_offset(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        return physical_offset(fd)
+    finally:
+        os.close(fd)
+
+
+def ordered(paths, mode=None, large_size=None):
+    """
+    Returns the paths in read order, small files before large ones.
+    """
+    small, large = schedule(paths, mode=mode, large_size=large_size)
+    return small + large
+
+
+def advise(fd, advice, offset=0, length=0):
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        os.posix_fadvise(fd, offset, length, getattr(os, advice))
+    except OSError:
+        pass
+
+
+def will_need(paths, length=0):
+    """
+    Asks the kernel to start reading the first length bytes (or all)
+    of the files into the page cache, without waiting for it.
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    for path in paths:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            advise(fd, 'POSIX_FADV_WILLNEED', 0, length)
+        finally:
+            os.close(fd)
+
+
+def dont_need(paths):
+    """
+    Drops the files' pages from the page cache.
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    for path in paths:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            advise(fd, 'POSIX_FADV_DONTNEED')
+        finally:
+            os.close(fd)
@@ -15,8 +15,14 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import shutil
+import tempfile
+import itertools
 from datetime import datetime
 from datetime import tzinfo
+from functools import lru_cache
+from collections import Counter
+from collections import OrderedDict
 import pytz
 import pygit2
 
@@ -25,7 +31,31 @@ from git_annex_adapter import GitAnnexMetadata
 from albumin.imdate import analyze_date
 from albumin.imdate import ImageDate
 from albumin.imdate import Report
+from albumin.imdate import merge_imdates
+from albumin.imdate import merge_key_imdates
+from albumin.imdate import registry
+from albumin.imdate_array import ImageDateArray
 from albumin.utils import files_in
+from albumin.utils import key_size
+from albumin.utils import partial_hash
+from albumin.utils import parse_size
+from albumin.metastore import AnnexBackend
+from albumin.metastore import SQLiteBackend
+from albumin.phash import PerceptualIndex
+from albumin.phash import dhash
+from albumin.pending import PendingQueue
+from albumin.views import ViewIndex
+from albumin.session import ImportSession
+from albumin.ingest import Ingester
+from albumin.layout import Layout
+from albumin.layout import relayout_tree
+from albumin import audit
+from albumin import hasher
+from albumin import imdate_array
+from albumin import readorder
+from albumin import spill
+from albumin import views
+from albumin import trace
 
 
 class AlbuminRepo(pygit2.Repository):
@@ -53,10 +83,74 @@ class AlbuminRepo(pygit2.Repository):
         self.annex = AlbuminAnnex(self.workdir, create=create)
 
         self._session_timezone = None
+        self._phash_index = None
+        self.reload_config()
+        self.configure_reads()
+        self.annex.backend = self.metadata_backend()
+        self._draining = False
+        self.annex.before_read = self.drain_queue
+
+    def reload_config(self):
+        self._config = {}
+        self._layout = None
+        self._config_overrides = self.config_overrides()
+
+    def configure_reads(self):
+        large_size = self.get_config('albumin.large-file-size')
+        readorder.configure(
+            mode=self.get_config('albumin.read-order'),
+            large_size=parse_size(large_size) if large_size else None,
+        )
+
+    def refresh(self):
+        self._session_timezone = None
+        self.reload_config()
+        self.configure_reads()
+        self.annex.refresh()
+        self.annex.before_read = self.drain_queue
+
+    def state_path(self, *parts):
+        path = os.path.join(self.path, 'albumin', *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def pending_queue(self):
+        return PendingQueue(os.path.dirname(self.state_path('queue', '')))
+
+    def enqueue_report(self, report, commit=None, **tags):
+        return self.pending_queue().add(report, commit=commit, **tags)
+
+    def drain_queue(self, wait=True):
+        if self._draining:
+            return 0
+        self._draining = True
+        try:
+            return self.pending_queue().drain(self.apply_report, wait=wait)
+        finally:
+            self._draining = False
+
+    def metadata_backend(self):
+        mode = self.get_config('albumin.metadata-cache')
+        if mode not in ('read-through', 'write-through'):
+            return AnnexBackend()
+        return self.metadata_store(write_through=(mode == 'write-through'))
+
+    def metadata_store(self, write_through=True):
+        if isinstance(self.annex.backend, SQLiteBackend):
+            return self.annex.backend
+        return SQLiteBackend(
+            self, self.state_path('metadata.sqlite'),
+            write_through=write_through,
+        )
 
     def get_config(self, key):
+        try:
+            return self._config[key]
+        except KeyError:
+            pass
         value = self.config[key] if key in self.config else None
-        value = self.config_overrides().get(key, value)
+        value = self._config_overrides.get(key, value)
+        self._config[key] = value
         return value
 
     @property
@@ -64,87 +158,546 @@ class AlbuminRepo(pygit2.Repository):
         if self._session_timezone:
             return self._session_timezone
         tz = self.get_config('albumin.timezone')
-        return pytz.timezone(tz) if tz else tz
+        return timezone(tz) if tz else tz
 
     @timezone.setter
     def timezone(self, tz):
         if isinstance(tz, str):
-            tz = pytz.timezone(tz)
+            tz = timezone(tz)
         self._session_timezone = tz
 
-    def import_(self, path, mtime=False, **tags):
-        files = self.annex.import_(path)
-        report = self.imdate_diff(
-            files={self.abs_path(f): k for f, k in files.items()},
-            mtime=mtime,
+    @trace.traced()
+    def import_(self, path, mtime=False, phash=False, commit_msg=None,
+                keep=False, analyzed=None, **tags):
+        session = ImportSession(
+            self, path, mtime=mtime, phash=phash, keep=keep,
+            analyzed=analyzed, **tags
         )
+        report = session.prepare()
+        session.commit(commit_msg(report) if commit_msg else None)
+        return report
 
-        if report.remaining:
-            raise NotImplementedError(report.remaining)
+    @trace.traced()
+    def analyze(self, path=None, mtime=False, phash=False):
+        paths = list(files_in(path))
+        return self.analyze_files(paths, mtime=mtime, phash=phash)
 
-        for _, (key, new_imdate) in report.additions.items():
-            self.annex[key].imdate = new_imdate
-        for _, (key, new_imdate, _) in report.overwrites.items():
-            self.annex[key].imdate = new_imdate
-        for _, key in report.files.items():
-            self.annex[key].update(tags)
+    @trace.traced(items=lambda self, paths, **_: len(paths))
+    def analyze_files(self, paths, mtime=False, phash=False):
+        files, new_keys = self.file_keys(paths)
+        return self.imdate_diff(
+            files, mtime=mtime, new_keys=new_keys, phash=phash,
+        )
 
-        self.arrange_by_imdates(files=files)
-        return report
+    def index_keys(self):
+        self.index.read()
+        for entry in self.index:
+            if entry.mode != pygit2.GIT_FILEMODE_LINK:
+                continue
+            key = self[entry.id].data.decode().split('/')[-1]
+            yield entry.path, key
 
-    def analyze(self, path=None, mtime=False):
-        files = {f: self.annex.calckey(f) for f in files_in(path)}
-        return self.imdate_diff(files, mtime=mtime)
+    @trace.traced(items=lambda self, results: len(results))
+    def locate(self, results):
+        self.index.read()
+        paths, index_map = {}, None
+
+        for key, utc in results:
+            name_fmt = self.datetime_name(utc, os.path.splitext(key)[1])
+            for i in range(100):
+                name = name_fmt.format(i)
+                if name not in self.index:
+                    continue
+                data = self[self.index[name].id].data.decode()
+                if data.split('/')[-1] == key:
+                    paths[key] = name
+                    break
+            else:
+                if index_map is None:
+                    index_map = {k: p for p, k in self.index_keys()}
+                paths[key] = index_map.get(key)
+
+        return paths
+
+    def content_path(self, path):
+        data = self[self.index[path].id].data.decode()
+        link_dir = os.path.dirname(self.abs_path(path))
+        return os.path.normpath(os.path.join(link_dir, data))
+
+    def query(self, query):
+        self.drain_queue()
+        store = self.metadata_store()
+        if not store.complete():
+            msg = 'Metadata store is incomplete, run: albumin cache rebuild'
+            raise RuntimeError(msg)
+        store.sync(self.annex)
+        return query.run(store)
+
+    def update_view(self, fields=views.default_fields):
+        self.drain_queue()
+        store = self.metadata_store()
+        if not store.complete():
+            msg = 'Metadata store is incomplete, run: albumin cache rebuild'
+            raise RuntimeError(msg)
+        store.sync(self.annex)
+        index = ViewIndex(self, store, self.state_path('views.sqlite'))
+        return index.update(fields)
+
+    def audit(self, jobs=None):
+        self.drain_queue()
+        store = self.metadata_store()
+        if not store.complete():
+            msg = 'Metadata store is incomplete, run: albumin cache rebuild'
+            raise RuntimeError(msg)
+        store.sync(self.annex)
+        return audit.audit(
+            self, store, registry.all_methods(), jobs=jobs,
+            layout=self.layout(),
+        )
 
-    def imdate_diff(self, files=None, mtime=False):
+    def audit_report(self, problems):
+        """
+        Returns a report that rewrites the stored dates of the keys
+        with fields that don't match their datetime.
+        """
+        files, updates = {}, {}
+        for problem, path, key, _ in problems:
+            if problem not in audit.appliable:
+                continue
+            imdate = self.annex[key].imdate
+            if imdate:
+                files[path] = key
+                updates[key] = (imdate, imdate)
+        return Report(files, updates, set())
+
+    def index_sizes(self):
+        for path, key in self.index_keys():
+            size = key_size(key)
+            if size is not None:
+                yield size, key, path
+
+    @trace.traced()
+    def size_index(self):
+        sizes = {}
+        for size, key, path in self.index_sizes():
+            sizes.setdefault(size, {})[key] = path
+        return sizes
+
+    @trace.traced(items=lambda self, paths, sizes=None: len(paths))
+    def file_keys(self, paths, sizes=None):
+        """
+        Returns the keys of the files at paths, and the ones of those
+        keys that no file in the index has. Only files that might be a
+        copy of another, in the index or in paths, are hashed: those of
+        the same size whose heads and tails also match. The others are
+        new and their keys are None, see report_keys.
+        """
+        if sizes is None:
+            sizes = self.size_index()
+
+        file_sizes = OrderedDict(
+            (path, os.path.getsize(path)) for path in paths
+        )
+        counts = Counter(file_sizes.values())
+        partials = OrderedDict(
+            ((path, size), partial_hash(path))
+            for path, size in file_sizes.items()
+            if size in sizes or counts[size] > 1
+        )
+        partial_counts = Counter(
+            (size, hash_) for (_, size), hash_ in partials.items()
+        )
+
+        known = set()
+        for size in {size for _, size in partials}:
+            for path in sizes.get(size, {}).values():
+                try:
+                    known.add((size, partial_hash(self.content_path(path))))
+                except OSError:
+                    known.add((size, None))
+        trace.count('partial hashes', len(partials) + len(known))
+
+        candidates = [
+            path for (path, size), hash_ in partials.items()
+            if (size, hash_) in known or (size, None) in known
+            or partial_counts[size, hash_] > 1
+        ]
+        keys = OrderedDict((path, None) for path in file_sizes)
+        keys.update(self.calckeys(candidates))
+        trace.count('unhashed files', len(keys) - len(candidates))
+
+        new_keys = {
+            key for path, key in keys.items()
+            if key and key not in sizes.get(file_sizes[path], ())
+        }
+        return keys, new_keys
+
+    def report_keys(self, files, new_keys, report):
+        """
+        Returns files and new_keys with the keys that file_keys left out
+        filled in: by hashing the files that report dated, and by their
+        paths for the others, which a report only lists.
+        """
+        unhashed = [file for file in report.additions if not files[file]]
+        keys = OrderedDict(self.calckeys(unhashed)) if unhashed else {}
+        files = OrderedDict(
+            (file, key or keys.get(file) or file)
+            for file, key in files.items()
+        )
+        new_keys = set(new_keys).union(
+            key for file, key in files.items()
+            if key == file or file in keys
+        )
+        return files, new_keys
+
+    def hasher(self, backend=None):
+        if self.get_config('albumin.native-hash') == 'false':
+            return None
+        backend = backend or self.get_config('annex.backend') \
+            or (self.get_config('annex.backends') or 'SHA256E').split()[0]
+        if backend not in hasher.backends:
+            return None
+        return hasher.Hasher(
+            backend,
+            threads=int(self.get_config('albumin.hash-jobs') or 0) or None,
+            max_extension_length=int(
+                self.get_config('annex.maxextensionlength') or 4
+            ),
+        )
+
+    def ingester(self, keep=False):
+        if self.get_config('albumin.native-import') != 'true':
+            return None
+        hasher_ = self.hasher()
+        if hasher_ is None:
+            return None
+        return Ingester(self, hasher_, keep=keep)
+
+    def annex_rules(self, paths):
+        """
+        Returns whether git-annex would add any of the repo paths other
+        than by their content with the default backend, because of an
+        annex.backend or annex.largefiles gitattribute, or annex.largefiles
+        in git config.
+        """
+        if self.get_config('annex.largefiles'):
+            return True
+        return any(
+            self.get_attr(path, name) is not None
+            for path in paths
+            for name in ('annex.backend', 'annex.largefiles')
+        )
+
+    def calckeys(self, paths, native=True):
+        """
+        Returns (path, key) pairs like git annex calckey would. Files in
+        the work tree that an annex.backend gitattribute applies to are
+        hashed with that backend, by git annex calckey if albumin can't.
+        """
+        hasher_ = self.hasher() if native else None
+        if hasher_ is None:
+            return self.annex_calckeys(paths)
+
+        groups = OrderedDict()
+        for path in paths:
+            backend = self.path_backend(path) or hasher_.backend
+            groups.setdefault(backend, []).append(path)
+
+        keys = {}
+        for backend, group in groups.items():
+            group_hasher = hasher_ if backend == hasher_.backend \
+                else self.hasher(backend)
+            if group_hasher is None:
+                keys.update(self.annex_calckeys(group))
+            else:
+                keys.update(group_hasher.keys(group))
+        return [(path, keys[path]) for path in paths]
+
+    def annex_calckeys(self, paths):
+        keys = []
+        for path in paths:
+            trace.count('calckey')
+            keys.append((path, self.annex.calckey(path)))
+        return keys
+
+    def path_backend(self, path):
+        """
+        Returns the annex.backend gitattribute of a path in the work
+        tree, or None for paths outside it.
+        """
+        rel_path = self.rel_path(os.path.abspath(path))
+        if rel_path.split(os.sep)[0] in ('..', '.git'):
+            return None
+        return self.get_attr(rel_path.replace(os.sep, '/'), 'annex.backend')
+
+    def use_phash(self, phash=False):
+        return phash or self.get_config('albumin.phash') == 'true'
+
+    @trace.traced()
+    def update_phash_index(self, files=None):
+        if files is None:
+            files = {path: key for path, key in self.index_keys()}
+
+        index = self.phash_index()
+        known = index.keys()
+        for file, key in files.items():
+            if key in known:
+                continue
+            try:
+                index.add(key, dhash(self.abs_path(file)))
+            except (OSError, ValueError):
+                continue
+            known.add(key)
+        path = self.state_path('phash.npz')
+        index.save(path)
+        self._phash_index = (os.stat(path).st_mtime_ns, index)
+        return len(index)
+
+    def phash_index(self):
+        """
+        Returns the perceptual hash index, loading it again only when
+        its file has changed since it was last loaded.
+        """
+        path = self.state_path('phash.npz')
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if self._phash_index is None or self._phash_index[0] != mtime:
+            self._phash_index = (mtime, PerceptualIndex.load(path))
+        return self._phash_index[1]
+
+    @trace.traced(items=lambda self, files: len(files))
+    def perceptual_dates(self, files):
+        index = self.phash_index()
+        distance = int(self.get_config('albumin.phash-distance') or 4)
+
+        imdates = {}
+        for file, own_key in files.items():
+            try:
+                hash_ = dhash(file)
+            except (OSError, ValueError):
+                continue
+            for key, _ in index.search(hash_, distance):
+                meta = self.annex.get(key, None) if key != own_key else None
+                if meta and meta.imdate:
+                    original = meta.imdate.datetime
+                    imdates[file] = ImageDate('Perceptual/Original', original)
+                    break
+        return imdates
+
+    @trace.traced(items=lambda self, files=None, **_: len(files or ()))
+    def imdate_diff(self, files=None, mtime=False, new_keys=(), phash=False,
+                    analyzed=None):
+        """
+        Analyzes the files' dates against their keys' stored ones. The
+        keys in analyzed, an earlier report on the same contents, are
+        not analyzed again and keep their updates from it.
+        """
         if not files:
             files = self.new_files()
             files = {self.abs_path(f): k for f, k in files.items()}
 
-        timezone = self.timezone
-        report = analyze_date(*files, timezone=timezone, mtime=mtime)
+        done = set(analyzed.files.values()) if analyzed else set()
+        todo = {f: k for f, k in files.items() if k not in done}
+        trace.count('reused analyses', len(files) - len(todo))
 
-        for file in report.remaining:
-            key = files[file]
-            meta = self.annex.get(key, None)
-            if meta and meta.imdate:
-                report.redundants[file] = key
+        stored = self.stored_imdates(todo, new_keys)
+        report = analyze_date(
+            *todo, timezone=self.timezone, mtime=mtime, floors=stored,
+        )
 
-        def conflicts(a, b):
-            return a.method == b.method and a.datetime != b.datetime
+        if self.use_phash(phash):
+            self.add_perceptual_dates(report, todo, floors=stored)
+        files, new_keys = self.report_keys(files, new_keys, report)
+
+        for file in report.remaining:
+            if file in stored:
+                report.redundants[file] = files[file]
 
         key_data = {}
         for file, (_, imdate) in report.additions.items():
-            key = files[file]
-            imdate_ = key_data.get(key, imdate)
-            if conflicts(imdate, imdate_):
-                raise RuntimeError(file, imdate, imdate_)
-            key_data[key] = max(imdate, imdate_)
+            key_data.setdefault(files[file], []).append((file, imdate))
 
         updates = {}
-        for key, new in key_data.items():
-            try:
-                old = self.annex.get(key).imdate
-                if not new.timezone:
-                    new.timezone = old.timezone
-            except:
-                old = None
+        for key, new in merge_key_imdates(key_data).items():
+            update = self.key_update(key, new, new_key=(key in new_keys))
+            if update:
+                updates[key] = update
+
+        remaining = set(report.remaining)
+        if analyzed:
+            undated = set(analyzed.remaining.values())
+            for file, key in files.items():
+                if key in analyzed.updates:
+                    updates[key] = analyzed.updates[key]
+                elif key in undated:
+                    remaining.add(file)
+
+        return Report(files, updates, remaining)
+
+    @trace.traced()
+    def merge_partials(self, partials):
+        backends = {header['backend'] for header, _ in partials}
+        if len(backends) > 1:
+            msg = 'Partial reports use different key backends'
+            raise ValueError(msg, backends)
+
+        files, key_data, undated = {}, {}, []
+        for _, entries in partials:
+            for file, key, imdate in entries:
+                files[file] = key
+                if imdate:
+                    key_data.setdefault(key, []).append((file, imdate))
+                else:
+                    undated.append(file)
+
+        updates = {}
+        for key, new in merge_key_imdates(key_data).items():
+            update = self.key_update(key, new)
+            if update:
+                updates[key] = update
+
+        remaining = {f for f in undated if not self.has_imdate(files[f])}
+        return Report(files, updates, remaining)
+
+    def add_perceptual_dates(self, report, files, floors=None):
+        method = 'Perceptual/Original'
+        floors = floors or {}
+        found = {f: imdate for f, (_, imdate) in report.additions.items()}
+        weaker = {
+            file: key for file, key in files.items()
+            if ImageDate.outranks(method, found.get(file))
+            and ImageDate.outranks(method, floors.get(file))
+        }
+        for file, imdate in self.perceptual_dates(weaker).items():
+            report.additions[file] = (file, imdate)
+
+    def stored_imdates(self, files, new_keys=()):
+        stored = {}
+        for file, key in files.items():
+            if not key or key in new_keys:
+                continue
+            meta = self.annex.get(key, None)
+            if meta and meta.imdate:
+                stored[file] = meta.imdate
+        return stored
+
+    def has_imdate(self, key):
+        meta = self.annex.get(key, None)
+        return bool(meta and meta.imdate)
 
-            if (new > old) \
-                    or (new == old and new.datetime != old.datetime) \
-                    or (new.timezone != old.timezone):
-                updates[key] = (max(new, old), old)
+    def key_update(self, key, new, new_key=False):
+        try:
+            if new_key:
+                raise KeyError(key)
+            old = self.annex.get(key).imdate
+            if not new.timezone:
+                new.timezone = old.timezone
+        except:
+            old = None
+
+        if (new > old) \
+                or (new == old and new.datetime != old.datetime) \
+                or (new.timezone != old.timezone):
+            return max(new, old), old
+        return None
+
+    @trace.traced()
+    def analyze_spilled(self, path=None, max_memory=256 << 20,
+                        mtime=False, phash=False):
+        size = spill.run_size(max_memory)
+        directory = tempfile.mkdtemp(
+            prefix='analyze-', dir=os.path.dirname(self.state_path('spill', '')),
+        )
+        try:
+            by_key = self.spill_file_imdates(
+                directory, path, size, mtime=mtime, phash=phash,
+            )
+            entries, counts = self.spill_entries(directory, by_key, size)
+        except:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+        return spill.SpilledReport(directory, entries, counts)
 
-        return Report(files, updates, report.remaining)
+    def spill_file_imdates(self, directory, path, size, mtime, phash):
+        sizes = spill.SizeIndex(
+            os.path.join(directory, 'sizes.sqlite'), self.index_sizes(),
+        )
+        by_key = spill.RunWriter(directory, 'keys', size)
+        paths = files_in(path)
 
+        try:
+            while True:
+                partition = list(itertools.islice(paths, size))
+                if not partition:
+                    break
+                with trace.span('partition', files=len(partition)):
+                    self.spill_partition(
+                        by_key, partition, mtime, phash,
+                        sizes.lookup(map(os.path.getsize, partition)),
+                    )
+                self.annex.forget()
+        finally:
+            sizes.close()
+        return by_key
+
+    def spill_partition(self, by_key, partition, mtime, phash, sizes):
+        files, new_keys = self.file_keys(partition, sizes=sizes)
+        stored = self.stored_imdates(files, new_keys=new_keys)
+        report = analyze_date(
+            *partition, timezone=self.timezone, mtime=mtime, floors=stored,
+        )
+        if self.use_phash(phash):
+            self.add_perceptual_dates(report, files, floors=stored)
+        files, new_keys = self.report_keys(files, new_keys, report)
+
+        for file, key in files.items():
+            _, imdate = report.additions.get(file, (None, None))
+            by_key.add((key, file), (key in new_keys, imdate))
+
+    def spill_entries(self, directory, by_key, size):
+        entries = spill.RunWriter(directory, 'entries', size)
+        counts = OrderedDict((name, 0) for name in (
+            'files', 'remaining', 'overwrites', 'additions', 'redundants',
+        ))
+        names = dict(zip(spill.sections, list(counts)[1:]))
+
+        for key, group in itertools.groupby(by_key, lambda r: r[0][0]):
+            group = [(file, info) for (_, file), info in group]
+            new_key = group[0][1][0]
+            dated = [(f, imdate) for f, (_, imdate) in group if imdate]
+            new = merge_imdates(dated) if dated else None
+            update = self.key_update(key, new, new_key) if new else None
+            known = not new_key and (bool(dated) or self.has_imdate(key))
+
+            for file, (_, imdate) in group:
+                if update:
+                    new_, old = update
+                    tag = '!' if old else '+'
+                elif imdate or known:
+                    new_, old, tag = None, None, '='
+                else:
+                    new_, old, tag = None, None, '?'
+                lines = list(Report.entry(tag, file, key, new_, old))
+                entries.add(spill.entry_key(tag, file), lines)
+                counts['files'] += 1
+                counts[names[tag]] += 1
+            self.annex.forget(key)
+
+        return entries, counts
+
+    @trace.traced(items=lambda self, report, **_: len(report.files))
     def apply_report(self, report, **tags):
         for _, (key, new_imdate) in report.additions.items():
             self.annex[key].imdate = new_imdate
         for _, (key, new_imdate, _) in report.overwrites.items():
             self.annex[key].imdate = new_imdate
-        for _, key in report.files.items():
-            self.annex[key].update(tags)
+        for file, key in report.files.items():
+            if key != file:
+                self.annex[key].update(tags)
 
+    @trace.traced()
     def new_files(self, keys=True):
         self.index.read()
         try:
@@ -168,17 +721,43 @@ class AlbuminRepo(pygit2.Repository):
         idx.path = dst
         self.index.add(idx)
 
-    def arrange_by_imdates(self, files=None, imdates=None):
-        if not imdates:
-            imdates = {}
+    def layout(self):
+        pattern = self.get_config('albumin.layout') or ''
+        if self._layout is None or self._layout.pattern != pattern:
+            self._layout = Layout(pattern)
+        return self._layout
 
-        def datetime_name(file, key):
-            imdate = imdates.get(key, self.annex[key].imdate)
-            if not imdate:
-                return None
-            utc = imdate.datetime.astimezone(pytz.utc)
-            ext = os.path.splitext(file)[1]
-            return '{:%Y%m%dT%H%M%SZ}{{:02}}{}'.format(utc, ext)
+    def datetime_name(self, utc, ext):
+        return self.layout().name(utc, ext)
+
+    def datetime_names(self, files, imdates=None):
+        imdates = imdates or {}
+        dated = OrderedDict()
+        for file, key in files.items():
+            imdate = imdates[key] if key in imdates else self.annex[key].imdate
+            if imdate:
+                dated[file] = imdate
+
+        exts = [os.path.splitext(file)[1] for file in dated]
+        names = [None] * len(dated)
+        if imdate_array.available(len(dated)):
+            array = ImageDateArray.from_imdates(
+                list(dated.values()), ImageDate.methods,
+            )
+            layout = self.layout()
+            names = [
+                layout.place(name) if name else name
+                for name in array.utc_names(exts)
+            ]
+
+        for i, (imdate, ext) in enumerate(zip(dated.values(), exts)):
+            if names[i] is None:
+                utc = imdate.datetime.astimezone(pytz.utc)
+                names[i] = self.datetime_name(utc, ext)
+        return dict(zip(dated, names))
+
+    @trace.traced(items=lambda self, files=None, **_: len(files or ()))
+    def arrange_by_imdates(self, files=None, imdates=None):
 
         def move_file(file, key, dest):
             if dest in self.index:
@@ -202,10 +781,11 @@ class AlbuminRepo(pygit2.Repository):
         if not files:
             files = self.new_files()
         moved_files = []
+        name_fmts = self.datetime_names(files, imdates)
 
         self.index.read()
         for file, key in files.items():
-            name_fmt = datetime_name(file, key)
+            name_fmt = name_fmts.get(file)
             if not name_fmt:
                 continue
 
@@ -220,7 +800,9 @@ class AlbuminRepo(pygit2.Repository):
             else:
                 err_msg = 'Ran out of {} files'
                 raise RuntimeError(err_msg.format(name_fmt))
-        self.index.write()
+
+        with trace.span('repo.index.write'):
+            self.index.write()
 
         for file in moved_files:
             os.remove(self.abs_path(file))
@@ -231,10 +813,13 @@ class AlbuminRepo(pygit2.Repository):
             except OSError:
                 pass
 
-        self.checkout_index()
-        self.annex.pre_commit()
+        with trace.span('repo.checkout_index'):
+            self.checkout_index()
+        with trace.span('annex.pre_commit'):
+            self.annex.pre_commit()
         self.index.read()
 
+    @trace.traced()
     def fix_filenames(self, files=None):
         if not files:
             self.index.read()
@@ -247,6 +832,37 @@ class AlbuminRepo(pygit2.Repository):
             self.commit('Fix filenames')
         return diff.stats.format(pygit2.GIT_DIFF_STATS_FULL, 80)
 
+    @trace.traced()
+    def relayout(self, pattern=None):
+        """
+        Moves the date-named files of HEAD to where the layout puts
+        them in one commit, and makes pattern the repo's layout if
+        given. Returns the moved files and the ones left in place
+        because their new path is taken.
+        """
+        layout = Layout(pattern) if pattern is not None else self.layout()
+        self.index.read()
+        if len(self.diff('HEAD', cached=True)) > 0:
+            raise RuntimeError('The index has staged changes.')
+
+        head = self.head.peel(pygit2.Commit)
+        tree_id, moved, left = relayout_tree(self, head.tree, layout)
+        if moved:
+            tree = self[tree_id]
+            with trace.span('repo.checkout_tree'):
+                self.checkout_tree(tree)
+            self.index.read_tree(tree)
+            self.index.write()
+            self.commit('Relayout files to {}'.format(
+                layout.pattern or 'the root folder'
+            ))
+
+        if pattern is not None:
+            self.config['albumin.layout'] = pattern
+            self.reload_config()
+        return moved, left
+
+    @trace.traced()
     def commit(self, message, timestamp=None):
         if not timestamp:
             timestamp = datetime.now(pytz.utc)
@@ -262,7 +878,7 @@ class AlbuminRepo(pygit2.Repository):
         except pygit2.GitError:
             parents = []
         else:
-            parents = [self.head.get_object().hex]
+            parents = [self.head.target]
 
         commit = self.create_commit(
             'HEAD', author, author, message,
@@ -294,25 +910,66 @@ class AlbuminAnnex(GitAnnex):
         'year', 'month', 'day'
     ]
 
+    # Most parsed metadata objects kept, least recently used dropped.
+    cache_size = 4096
+
     def __init__(self, path, create=False):
         super().__init__(path, create=create)
+        self.backend = AnnexBackend()
+        self.before_read = None
+        self._metadata = OrderedDict()
 
     def __getitem__(self, map_key):
+        try:
+            metadata = self._metadata[map_key]
+        except KeyError:
+            pass
+        else:
+            self._metadata.move_to_end(map_key)
+            return metadata
+        if self.before_read is not None:
+            before_read, self.before_read = self.before_read, None
+            before_read()
         metadata = super().__getitem__(map_key)
         AlbuminMetadata.make_parsed(metadata)
+        self._metadata[map_key] = metadata
+        if len(self._metadata) > self.cache_size:
+            self._metadata.popitem(last=False)
         return metadata
 
+    def invalidate(self, map_key=None):
+        self.forget(map_key)
+        self.backend.invalidate(map_key)
+
+    def forget(self, map_key=None):
+        """
+        Drops the parsed metadata of a key, or of all keys, without
+        invalidating the backend's copy.
+        """
+        if map_key is None:
+            self._metadata.clear()
+        else:
+            self._metadata.pop(map_key, None)
+
+    def refresh(self):
+        self.forget()
+        self.backend.refresh()
+
     def __repr__(self):
         return 'AlbuminAnnex(path={!r})'.format(self.path)
 
 
 class AlbuminMetadata(GitAnnexMetadata):
+    _missing = object()
+
     def __init__(self, annex, key, file=None):
         super().__init__(annex, key, file=file)
+        self._values = {}
 
     @classmethod
     def make_parsed(cls, metadata):
         metadata.__class__ = cls
+        metadata._values = {}
 
     @property
     def imdate(self):
@@ -336,26 +993,38 @@ class AlbuminMetadata(GitAnnexMetadata):
 
     def __getitem__(self, meta_key):
         try:
-            value = super().__getitem__(meta_key)[0]
-        except IndexError:
+            value = self._values[meta_key]
+        except KeyError:
+            value = self._values[meta_key] = self._decode(meta_key)
+
+        if value is self._missing:
             raise KeyError(meta_key)
+        return value
+
+    def _decode(self, meta_key):
+        trace.count('metadata reads')
+        try:
+            value = self.annex.backend.get(self, meta_key)[0]
+        except (KeyError, IndexError):
+            return self._missing
 
         if meta_key == 'datetime':
-            dt_naive = datetime.strptime(value, '%Y-%m-%d@%H-%M-%S')
-            dt_utc = pytz.utc.localize(dt_naive)
-            timezone = self.get('timezone', pytz.utc)
-            value = dt_utc.astimezone(timezone)
+            dt_utc = utc_datetime(value)
+            tz = self.get('timezone', pytz.utc)
+            value = dt_utc.astimezone(tz)
 
         elif meta_key.endswith('lastchanged'):
-            dt_naive = datetime.strptime(value, '%Y-%m-%d@%H-%M-%S')
-            value = pytz.utc.localize(dt_naive)
+            value = utc_datetime(value)
 
         elif meta_key == 'timezone':
-            value = pytz.timezone(value)
+            value = timezone(value)
 
         return value
 
     def __setitem__(self, meta_key, value):
+        trace.count('metadata writes')
+        self._values.clear()
+
         if isinstance(value, datetime):
             value_utc = value.astimezone(pytz.utc)
             value = value_utc.strftime('%Y-%m-%d@%H-%M-%S')
@@ -363,14 +1032,30 @@ class AlbuminMetadata(GitAnnexMetadata):
         elif isinstance(value, tzinfo):
             value = value.tzname(None)
 
+        backend = self.annex.backend
         if meta_key == 'datetime':
             year, month, day = value[:4], value[5:7], value[8:10]
-            super().__setitem__('year', [year])
-            super().__setitem__('month', [month])
-            super().__setitem__('day', [day])
+            backend.set(self, 'year', [year])
+            backend.set(self, 'month', [month])
+            backend.set(self, 'day', [day])
+
+        backend.set(self, meta_key, [value])
 
-        super().__setitem__(meta_key, [value])
+    def __delitem__(self, meta_key):
+        self._values.clear()
+        self.annex.backend.delete(self, meta_key)
 
     def __repr__(self):
         repr_ = 'AlbuminMetadata(key={!r}, file={!r})'
         return repr_.format(self.key, self.file)
+
+
+@lru_cache(maxsize=None)
+def timezone(name):
+    return pytz.timezone(name)
+
+
+@lru_cache(maxsize=4096)
+def utc_datetime(value):
+    dt_naive = datetime.strptime(value, '%Y-%m-%d@%H-%M-%S')
+    return pytz.utc.localize(dt_naive)
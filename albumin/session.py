@@ -0,0 +1,351 @@
+# Albumin Import Sessions
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Import sessions let several imports run into one repo at once. A
+session imports its files into its own folder in the work tree and
+its own git index (through GIT_INDEX_FILE), then analyzes them and
+writes their metadata, without touching the repo's index.
+
+Only placing the files under their date names in the repo's index and
+committing them is serialized, under a lock in the git dir. Name slots
+are picked against the index as it is then, so sessions that want the
+same name get consecutive slots.
+
+A session saves its files, their names and its report once they are
+analyzed. If it is interrupted, it can be loaded back by its id and
+either resumed or aborted; sessions that didn't get that far are
+loaded from the links in their folder.
+"""
+
+import os
+import json
+import shutil
+import subprocess
+from datetime import datetime
+from collections import OrderedDict
+
+from albumin.imdate import Report
+from albumin.lazy import lazy_import
+from albumin.utils import files_in
+from albumin.utils import flocked
+from albumin.utils import key_size
+from albumin.views import link_target
+from albumin import trace
+
+pygit2 = lazy_import('pygit2')
+
+sessions_folder = '.albumin-sessions'
+
+
+class ImportSession:
+    def __init__(self, repo, path, mtime=False, phash=False, keep=False,
+                 analyzed=None, id=None, **tags):
+        self.repo = repo
+        self.path = path
+        self.mtime = mtime
+        self.phash = phash
+        self.keep = keep
+        self.analyzed = analyzed
+        self.tags = tags
+
+        self.id = id or '{:%Y%m%dT%H%M%S%f}-{}'.format(
+            datetime.now(), os.getpid(),
+        )
+        self.state_path = repo.state_path('sessions', self.id, 'session.json')
+        self.index_path = repo.state_path('sessions', self.id, 'index')
+        self.folder = '{}/{}'.format(sessions_folder, self.id)
+
+        self.files = OrderedDict()
+        self.names = {}
+        self.report = None
+
+    @trace.traced()
+    def prepare(self):
+        """
+        Imports, analyzes and tags the files without holding the lock.
+        Returns the report.
+        """
+        with trace.span('annex.import') as span:
+            self.files = self.annex_import()
+            span['items'] = len(self.files)
+        return self.analyze()
+
+    def analyze(self):
+        """
+        Analyzes and tags the imported files, picks their names and
+        saves the session. Returns the report.
+        """
+        sizes = self.repo.size_index()
+        report = self.repo.imdate_diff(
+            files={self.repo.abs_path(f): k for f, k in self.files.items()},
+            mtime=self.mtime,
+            new_keys={
+                k for k in self.files.values() if key_size(k) not in sizes
+            },
+            phash=self.phash, analyzed=self.analyzed,
+        )
+        if report.remaining:
+            raise NotImplementedError(report.remaining)
+
+        self.repo.apply_report(report, **self.tags)
+        self.names = self.repo.datetime_names(self.files)
+        self.report = report
+        self.save()
+        return report
+
+    def annex_import(self):
+        work_folder = self.repo.abs_path(self.folder)
+        os.makedirs(work_folder)
+        ingester = self.repo.ingester(keep=self.keep)
+        if ingester is not None:
+            paths = self.import_paths()
+            if not self.repo.annex_rules(paths.values()):
+                return self.native_import(ingester, paths)
+            trace.count('native import fallbacks')
+
+        env = dict(os.environ, GIT_INDEX_FILE=self.index_path)
+        subprocess.check_call(
+            ['git', 'annex', 'import', self.path]
+            + (['--duplicate'] if self.keep else []),
+            cwd=work_folder, env=env, stdout=subprocess.DEVNULL,
+        )
+
+        files = OrderedDict()
+        for entry in pygit2.Index(self.index_path):
+            if entry.mode != pygit2.GIT_FILEMODE_LINK \
+                    or not entry.path.startswith(self.folder + '/'):
+                continue
+            target = self.repo[entry.id].data.decode()
+            files[entry.path] = target.split('/')[-1]
+        return files
+
+    def import_paths(self):
+        """
+        Returns the files git annex import would import, with the repo
+        paths it would put them at: under a folder named after the
+        imported one, skipping dotfiles.
+        """
+        base = os.path.basename(os.path.normpath(self.path))
+        paths = OrderedDict()
+        for path in files_in(self.path):
+            parts = os.path.relpath(path, self.path).split(os.sep)
+            if any(part.startswith('.') for part in parts):
+                continue
+            paths[path] = '/'.join([self.folder, base] + parts)
+        return paths
+
+    def native_import(self, ingester, paths=None):
+        """
+        Puts the files in the annex with the ingester, and symlinks
+        them in the session's folder and index like git annex import
+        would.
+        """
+        if paths is None:
+            paths = self.import_paths()
+        objects = ingester.ingest(list(paths))
+
+        files = OrderedDict()
+        index = pygit2.Index(self.index_path)
+        for path, (key, object_path) in objects.items():
+            file = paths[path]
+            link = self.repo.abs_path(file)
+            target = os.path.relpath(object_path, os.path.dirname(link))
+            os.makedirs(os.path.dirname(link), exist_ok=True)
+            os.symlink(target, link)
+
+            blob = self.repo.create_blob(target.encode())
+            index.add(pygit2.IndexEntry(file, blob, pygit2.GIT_FILEMODE_LINK))
+            files[file] = key
+        index.write()
+        return files
+
+    def save(self):
+        state = OrderedDict([
+            ('path', self.path),
+            ('mtime', self.mtime),
+            ('phash', self.phash),
+            ('keep', self.keep),
+            ('tags', self.tags),
+            ('files', [
+                [file, key, self.names.get(file)]
+                for file, key in self.files.items()
+            ]),
+            ('report', list(self.report.short())),
+        ])
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(state, file)
+        os.replace(tmp_path, self.state_path)
+
+    @classmethod
+    def load(cls, repo, id):
+        """
+        Loads an unfinished session from its saved state, or from the
+        links in its folder if it was interrupted before saving.
+        """
+        state_path = repo.state_path('sessions', id, 'session.json')
+        try:
+            with open(state_path) as file:
+                state = json.load(file)
+        except FileNotFoundError:
+            state = {}
+
+        session = cls(
+            repo, state.get('path'), mtime=state.get('mtime', False),
+            phash=state.get('phash', False), keep=state.get('keep', False),
+            id=id, **state.get('tags', {})
+        )
+        if 'files' in state:
+            for file, key, name in state['files']:
+                session.files[file] = key
+                if name:
+                    session.names[file] = name
+            session.report = Report.parse(state['report'])
+        else:
+            session.files = session.linked_files()
+        return session
+
+    @staticmethod
+    def unfinished(repo):
+        """
+        Returns the ids of the sessions that have a folder or a saved
+        state left in the repo, including the ones still running.
+        """
+        ids = set()
+        folder = repo.abs_path(sessions_folder)
+        if os.path.isdir(folder):
+            ids.update(os.listdir(folder))
+        states = os.path.dirname(repo.state_path('sessions', ''))
+        ids.update(
+            name for name in os.listdir(states)
+            if os.path.isdir(os.path.join(states, name))
+        )
+        return sorted(ids)
+
+    def running(self):
+        """
+        Whether the process that started the session is still alive.
+        """
+        try:
+            os.kill(int(self.id.rsplit('-', 1)[1]), 0)
+        except (IndexError, ValueError, ProcessLookupError):
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def linked_files(self):
+        files = OrderedDict()
+        folder = self.repo.abs_path(self.folder)
+        for path in files_in(folder):
+            if not os.path.islink(path):
+                continue
+            file = '/'.join(
+                [self.folder] + os.path.relpath(path, folder).split(os.sep)
+            )
+            files[file] = os.readlink(path).split('/')[-1]
+        return files
+
+    @trace.traced()
+    def resume(self, commit_msg=None):
+        """
+        Finishes an interrupted session, analyzing its files again if
+        it didn't get to save their names. Returns the report.
+        """
+        if self.report is None:
+            self.analyze()
+        self.commit(commit_msg(self.report) if commit_msg else None)
+        return self.report
+
+    def abort(self):
+        """
+        Deletes an interrupted session's folder and state. The imported
+        contents stay in the annex, where git annex unused finds them.
+        """
+        self.cleanup()
+
+    @trace.traced()
+    def commit(self, message=None):
+        """
+        Places the session's files in the repo's index under their
+        date names, and commits them with message if one is given.
+        """
+        lock_path = self.repo.state_path('sessions', 'lock')
+        with flocked(lock_path):
+            if self.repo.use_phash(self.phash):
+                self.repo.update_phash_index(self.files)
+
+            index = self.repo.index
+            index.read()
+            for file, key in self.files.items():
+                self.place(index, file, key)
+            with trace.span('repo.index.write'):
+                index.write()
+
+            commit = self.repo.commit(message) if message else None
+
+        self.cleanup()
+        return commit
+
+    def place(self, index, file, key):
+        name_fmt = self.names.get(file)
+        if not name_fmt:
+            raise RuntimeError('No date name for {}'.format(file))
+
+        src = self.repo.abs_path(file)
+        for i in range(0, 100):
+            dest = name_fmt.format(i)
+            abs_dest = self.repo.abs_path(dest)
+            if dest in index:
+                dest_data = self.repo[index[dest].id].data.decode()
+                if dest_data.split('/')[-1] == key:
+                    return None
+            elif os.path.islink(abs_dest) \
+                    and os.readlink(abs_dest).split('/')[-1] == key:
+                # Placed by an interrupted commit, but not indexed
+                target = os.readlink(abs_dest)
+                if os.path.lexists(src):
+                    os.remove(src)
+                break
+            elif os.path.lexists(abs_dest):
+                if self.repo.annex.lookupkey(dest) == key:
+                    return None
+            else:
+                target = link_target(file, os.readlink(src), dest.count('/'))
+                os.makedirs(os.path.dirname(abs_dest), exist_ok=True)
+                os.symlink(target, abs_dest)
+                os.remove(src)
+                break
+        else:
+            raise RuntimeError('Ran out of {} files'.format(name_fmt))
+
+        blob = self.repo.create_blob(target.encode())
+        index.add(pygit2.IndexEntry(dest, blob, pygit2.GIT_FILEMODE_LINK))
+        return dest
+
+    def cleanup(self):
+        shutil.rmtree(self.repo.abs_path(self.folder), ignore_errors=True)
+        shutil.rmtree(os.path.dirname(self.state_path), ignore_errors=True)
+        try:
+            os.rmdir(self.repo.abs_path(sessions_folder))
+        except OSError:
+            pass
+
+    def __repr__(self):
+        return 'ImportSession(id={!r}, path={!r}, files={})'.format(
+            self.id, self.path, len(self.files)
+        )
@@ -0,0 +1,185 @@
+# Albumin Spill
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import heapq
+import pickle
+import shutil
+import sqlite3
+from operator import itemgetter
+
+from albumin.imdate import Report
+from albumin import trace
+
+# Rough peak memory per analyzed file, mostly exiftool output
+# and the partition's report, used to size partitions and runs.
+entry_cost = 8 * 1024
+
+# Most runs to merge at once, to stay well below open file limits.
+fan_in = 256
+
+sections = '?!+='
+
+
+def run_size(max_memory):
+    return max(100, max_memory // entry_cost)
+
+
+def read_run(path):
+    with open(path, 'rb') as file:
+        while True:
+            try:
+                yield pickle.load(file)
+            except EOFError:
+                return
+
+
+def merge_runs(paths):
+    return heapq.merge(*map(read_run, paths), key=itemgetter(0))
+
+
+class RunWriter:
+    """
+    Collects (sort_key, item) records and writes them to disk as
+    sorted run files of at most run_size records. Iterating over it
+    merges the runs back into one sorted stream.
+    """
+
+    def __init__(self, directory, name, run_size):
+        self.directory = directory
+        self.name = name
+        self.run_size = run_size
+        self.buffer = []
+        self.runs = []
+        self.written = 0
+
+    def add(self, sort_key, item):
+        self.buffer.append((sort_key, item))
+        if len(self.buffer) >= self.run_size:
+            self.flush()
+
+    def run_path(self):
+        return os.path.join(
+            self.directory, '{}.{:05d}'.format(self.name, self.written)
+        )
+
+    def write_run(self, records):
+        path = self.run_path()
+        with open(path, 'wb') as file:
+            for record in records:
+                pickle.dump(record, file, pickle.HIGHEST_PROTOCOL)
+        self.runs.append(path)
+        self.written += 1
+        trace.count('spill runs')
+        return path
+
+    def flush(self):
+        if not self.buffer:
+            return
+        self.buffer.sort(key=itemgetter(0))
+        self.write_run(self.buffer)
+        self.buffer = []
+
+    @trace.traced()
+    def compact(self):
+        while len(self.runs) > fan_in:
+            runs, self.runs = self.runs, []
+            for start in range(0, len(runs), fan_in):
+                group = runs[start:start + fan_in]
+                self.write_run(merge_runs(group))
+                for path in group:
+                    os.remove(path)
+
+    def __iter__(self):
+        self.flush()
+        self.compact()
+        return merge_runs(self.runs)
+
+    def __repr__(self):
+        return 'RunWriter(name={!r}, runs={}, buffered={})'.format(
+            self.name, len(self.runs), len(self.buffer)
+        )
+
+
+class SizeIndex:
+    """
+    The (size, key, path) records of a repo's keys in an SQLite
+    database on disk, looked up a partition at a time as the
+    {size: {key: path}} index that AlbuminRepo.file_keys takes.
+    """
+
+    def __init__(self, path, records):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        with self.db:
+            self.db.execute(
+                'CREATE TABLE keys (size INTEGER, key TEXT, path TEXT)'
+            )
+            self.db.executemany('INSERT INTO keys VALUES (?, ?, ?)', records)
+            self.db.execute('CREATE INDEX keys_size ON keys (size)')
+
+    def lookup(self, sizes):
+        index = {}
+        for size in set(sizes):
+            rows = self.db.execute(
+                'SELECT key, path FROM keys WHERE size = ?', (size,)
+            )
+            for key, path in rows:
+                index.setdefault(size, {})[key] = path
+        return index
+
+    def close(self):
+        self.db.close()
+
+    def __repr__(self):
+        return 'SizeIndex(path={!r})'.format(self.path)
+
+
+class SpilledReport:
+    """
+    A report whose entries are in sorted run files on disk, merged
+    into the same short and long formats as Report while printing.
+    """
+
+    def __init__(self, directory, entries, counts):
+        self.directory = directory
+        self.entries = entries
+        self.counts = counts
+
+    def short(self):
+        for _, lines in self.entries:
+            yield from lines
+
+    def long(self):
+        return Report.long_format(self.short(), self.counts)
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __repr__(self):
+        return 'SpilledReport(directory={!r}, counts={})'.format(
+            self.directory, dict(self.counts)
+        )
+
+
+def entry_key(tag, file):
+    return (sections.index(tag), *os.path.split(file))
@@ -0,0 +1,210 @@
+# Albumin Trace
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import atexit
+import resource
+import threading
+import functools
+from contextlib import contextmanager
+
+from albumin.lazy import lazy_import
+
+json = lazy_import('json')
+subprocess = lazy_import('subprocess')
+
+tracer = None
+subprocess_lane = 0
+
+
+class Tracer:
+    """
+    Records nested spans, counters and subprocess lifetimes as Chrome
+    trace events, in the JSON array format that can be appended to.
+    """
+
+    def __init__(self, path, name='albumin', append=False):
+        self.path = path
+        self.pid = os.getpid()
+        self.events = []
+        self.counters = {}
+        self.subprocesses = {}
+        self.running = {}
+        self.lock = threading.Lock()
+        self.append = append
+
+        self.event('M', 'process_name', tid=0, args={'name': name})
+        self.event(
+            'M', 'thread_name', tid=subprocess_lane,
+            args={'name': 'subprocesses'},
+        )
+
+    @staticmethod
+    def now():
+        return time.time() * 1e6
+
+    @staticmethod
+    def peak_rss():
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_maxrss
+
+    def event(self, ph, name, tid=None, **fields):
+        event = {
+            'ph': ph, 'name': name, 'pid': self.pid,
+            'tid': threading.get_ident() if tid is None else tid,
+        }
+        event.setdefault('ts', self.now())
+        event.update(fields)
+        with self.lock:
+            self.events.append(event)
+
+    @contextmanager
+    def span(self, name, **args):
+        start = self.now()
+        try:
+            yield args
+        finally:
+            end = self.now()
+            args.setdefault('peak_rss_kib', self.peak_rss())
+            self.event('X', name, ts=start, dur=end - start, args=args)
+            self.event('C', 'memory', ts=end, args={
+                'peak_rss_kib': args['peak_rss_kib'],
+            })
+            if self.counters:
+                self.event('C', 'counters', ts=end, args=dict(self.counters))
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def process_started(self, process, argv):
+        name = os.path.basename(str(argv[0]))
+        if name == 'git' and argv[1:2] == ['annex']:
+            name = 'git-annex'
+        self.running[id(process)] = (name, argv, self.now())
+
+    def process_ended(self, process):
+        try:
+            name, argv, start = self.running.pop(id(process))
+        except KeyError:
+            return
+        self.record_process(name, argv, start)
+
+    def record_process(self, name, argv, start):
+        end = self.now()
+        with self.lock:
+            count, total = self.subprocesses.get(name, (0, 0))
+            self.subprocesses[name] = (count + 1, total + end - start)
+        self.event(
+            'X', name, tid=subprocess_lane, ts=start, dur=end - start,
+            args={'argv': [str(a) for a in argv[:8]]},
+        )
+
+    def summary(self):
+        return {
+            'peak_rss_kib': self.peak_rss(),
+            'counters': dict(self.counters),
+            'subprocesses': {
+                name: {'count': count, 'total_time_s': total / 1e6}
+                for name, (count, total) in self.subprocesses.items()
+            },
+        }
+
+    def write(self):
+        for name, argv, start in self.running.values():
+            self.record_process(name, argv, start)
+        self.running.clear()
+
+        self.event('i', 'summary', tid=0, s='p', args=self.summary())
+
+        exists = self.append and os.path.exists(self.path) \
+            and os.path.getsize(self.path) > 0
+        with open(self.path, 'a' if self.append else 'w') as file:
+            if not exists:
+                file.write('[\n')
+            for event in self.events:
+                file.write(json.dumps(event) + ',\n')
+        self.events = []
+
+
+class NullSpan(dict):
+    def __setitem__(self, key, value):
+        pass
+
+
+@contextmanager
+def span(name, **args):
+    if tracer is None:
+        yield NullSpan()
+    else:
+        with tracer.span(name, **args) as span_args:
+            yield span_args
+
+
+def count(name, value=1):
+    if tracer is not None:
+        tracer.count(name, value)
+
+
+def traced(name=None, items=None):
+    def decorator(func):
+        span_name = name or '{}.{}'.format(
+            func.__module__.split('.')[-1], func.__qualname__
+        )
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if tracer is None:
+                return func(*args, **kwargs)
+            with tracer.span(span_name) as span_args:
+                if items:
+                    span_args['items'] = items(*args, **kwargs)
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def patch_subprocess():
+    popen_init = subprocess.Popen.__init__
+    popen_wait = subprocess.Popen.wait
+
+    @functools.wraps(popen_init)
+    def __init__(self, args, *posargs, **kwargs):
+        popen_init(self, args, *posargs, **kwargs)
+        if tracer is not None:
+            argv = args.split() if isinstance(args, str) else list(args)
+            tracer.process_started(self, argv)
+
+    @functools.wraps(popen_wait)
+    def wait(self, *args, **kwargs):
+        retval = popen_wait(self, *args, **kwargs)
+        if tracer is not None:
+            tracer.process_ended(self)
+        return retval
+
+    subprocess.Popen.__init__ = __init__
+    subprocess.Popen.wait = wait
+
+
+def enable(path, name='albumin', append=False):
+    global tracer
+    if tracer is not None:
+        return tracer
+    tracer = Tracer(path, name=name, append=append)
+    patch_subprocess()
+    atexit.register(tracer.write)
+    return tracer
@@ -15,13 +15,44 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import os
-import tarfile
-from exiftool import ExifTool
+import gzip
+import fcntl
+import hashlib
+from contextlib import contextmanager
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from albumin.lazy import lazy_import
+from albumin import readorder
+from albumin import trace
 
+exiftool = lazy_import('exiftool')
+tarfile = lazy_import('tarfile')
 
+exiftool_session = None
+
+
+def keep_exiftool():
+    global exiftool_session
+    if exiftool_session is None:
+        exiftool_session = exiftool.ExifTool()
+        exiftool_session.start()
+    return exiftool_session
+
+
+def stop_exiftool():
+    global exiftool_session
+    if exiftool_session is not None:
+        exiftool_session.terminate()
+        exiftool_session = None
+
+
+@trace.traced(items=lambda *paths: len(paths))
 def exiftool_tags(*paths):
-    with ExifTool() as tool:
-        tags_list = tool.get_tags_batch([], paths)
+    if exiftool_session is not None:
+        tags_list = exiftool_batches(exiftool_session, paths)
+    else:
+        with exiftool.ExifTool() as tool:
+            tags_list = exiftool_batches(tool, paths)
 
     tags_dict = {}
     for tags in tags_list:
@@ -30,6 +61,24 @@ def exiftool_tags(*paths):
     return tags_dict
 
 
+def exiftool_batches(tool, paths, batch_size=256):
+    """
+    Reads tags in batches, prefetching the headers of the next batch
+    while exiftool reads the current one.
+    """
+    batches = [
+        paths[i:i + batch_size] for i in range(0, len(paths), batch_size)
+    ]
+    tags_list = []
+    for i, batch in enumerate(batches):
+        if i == 0:
+            readorder.will_need(batch, readorder.header_size)
+        if i + 1 < len(batches):
+            readorder.will_need(batches[i + 1], readorder.header_size)
+        tags_list.extend(tool.get_tags_batch([], batch))
+    return tags_list
+
+
 def files_in(dir_path, relative=False):
     if (dir_path is None) or (not os.path.isdir(dir_path)):
         return
@@ -42,12 +91,160 @@ def files_in(dir_path, relative=False):
             yield os.path.join(root, f)
 
 
-def make_tar(tar_file, dir_path):
+def make_tar(tar_file, dir_path, threads=None):
     if not os.path.isdir(dir_path):
         raise ValueError("Folder {} doesn't exist.".format(dir_path))
     if isinstance(tar_file, str):
-        with tarfile.open(name=tar_file, mode='w:gz') as tar:
-            tar.add(dir_path, arcname='')
-    else:
-        with tarfile.open(fileobj=tar_file, mode='w:gz') as tar:
-            tar.add(dir_path, arcname='')
+        with open(tar_file, 'wb') as file:
+            make_tar(file, dir_path, threads=threads)
+        return
+
+    gzip_file = ParallelGzipWriter(tar_file, threads=threads)
+    with tarfile.open(fileobj=gzip_file, mode='w|') as tar:
+        tar.add(dir_path, arcname='')
+    gzip_file.close()
+
+
+class ParallelGzipWriter:
+    """
+    Compresses what is written to it in fixed-size blocks on a thread
+    pool, and writes each block to the file as its own gzip member, in
+    order. Concatenated members are a valid gzip file. At most twice
+    as many blocks as threads are kept in memory.
+    """
+
+    def __init__(self, fileobj, level=6, block_size=1 << 20, threads=None):
+        self.fileobj = fileobj
+        self.level = level
+        self.block_size = block_size
+        self.threads = threads or os.cpu_count() or 1
+        self.pool = ThreadPoolExecutor(self.threads)
+        self.blocks = deque()
+        self.buffer = bytearray()
+        self.members = 0
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            self.submit(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+        return len(data)
+
+    def submit(self, block):
+        self.blocks.append(
+            self.pool.submit(gzip.compress, block, self.level, mtime=0)
+        )
+        self.members += 1
+        while len(self.blocks) > 2 * self.threads:
+            self.fileobj.write(self.blocks.popleft().result())
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.buffer or not self.members:
+            self.submit(bytes(self.buffer))
+            self.buffer.clear()
+        while self.blocks:
+            self.fileobj.write(self.blocks.popleft().result())
+        self.pool.shutdown()
+        self.fileobj.flush()
+
+    def __repr__(self):
+        return 'ParallelGzipWriter(level={}, threads={})'.format(
+            self.level, self.threads
+        )
+
+
+class VolumeWriter:
+    """
+    Splits what is written to it into files of a fixed size, named
+    with the prefix and a number: prefix.000, prefix.001, ...
+    """
+
+    def __init__(self, prefix, size):
+        self.prefix = prefix
+        self.size = size
+        self.volumes = []
+        self.file = None
+        self.written = 0
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            if self.file is None or self.written >= self.size:
+                self.next_volume()
+            part = view[:self.size - self.written]
+            self.file.write(part)
+            self.written += len(part)
+            view = view[len(part):]
+        return len(data)
+
+    def next_volume(self):
+        if self.file:
+            self.file.close()
+        path = '{}.{:03}'.format(self.prefix, len(self.volumes))
+        self.file = open(path, 'wb')
+        self.volumes.append(path)
+        self.written = 0
+
+    def flush(self):
+        if self.file:
+            self.file.flush()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def __repr__(self):
+        return 'VolumeWriter(prefix={!r}, volumes={})'.format(
+            self.prefix, len(self.volumes)
+        )
+
+
+def parse_size(size):
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+    size = size.strip().upper().rstrip('B')
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def key_size(key):
+    fields, _, _ = key.partition('--')
+    for field in fields.split('-')[1:]:
+        if field.startswith('s') and field[1:].isdigit():
+            return int(field[1:])
+    return None
+
+
+def partial_hash(path, block_size=64 * 1024):
+    hash_ = hashlib.sha256()
+    with open(path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        hash_.update(str(size).encode())
+        hash_.update(file.read(block_size))
+        if size > 2 * block_size:
+            file.seek(-block_size, os.SEEK_END)
+        hash_.update(file.read(block_size))
+    return hash_.hexdigest()
+
+
+@contextmanager
+def flocked(path, blocking=True):
+    """
+    Holds an exclusive flock on path. Yields False instead of waiting
+    if it's held elsewhere and blocking is False.
+    """
+    with open(path, 'w') as lock:
+        flags = fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB)
+        try:
+            fcntl.flock(lock, flags)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
@@ -0,0 +1,309 @@
+# Albumin Views
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Views are branches named ``views/<field>-<field>...`` whose trees put
+the symlinks of the current branch into folders by their metadata,
+like ``2015/06/01/20150601T102030Z00.jpg`` for ``year month day``.
+
+They are written directly as git trees from the metadata store. Each
+view remembers which view paths it made for which files, so a refresh
+only rewrites the folders of files that were moved, added, removed or
+had their metadata changed since the last one.
+"""
+
+import os
+import sqlite3
+import itertools
+from datetime import datetime
+
+from albumin.lazy import lazy_import
+from albumin import trace
+
+pygit2 = lazy_import('pygit2')
+
+default_fields = ('year', 'month', 'day')
+
+
+def view_name(fields):
+    return '-'.join(fields)
+
+
+def view_ref(name):
+    return 'refs/heads/views/{}'.format(name)
+
+
+def flat_name(path):
+    return path.replace('/', '%')
+
+
+def view_paths(fields, values, path):
+    """
+    Returns the paths of a file in a view, one for each combination of
+    its values for the fields, or none if it lacks any of them.
+    """
+    choices = [
+        sorted(flat_name(v) for v in values.get(field, ()) if v)
+        for field in fields
+    ]
+    return [
+        '/'.join(folders + (flat_name(path),))
+        for folders in itertools.product(*choices)
+    ]
+
+
+def link_target(path, target, depth):
+    """
+    Returns the target of a symlink at path, rewritten for a symlink
+    that is depth folders below the root.
+    """
+    target = os.path.normpath(os.path.join(os.path.dirname(path), target))
+    return '../' * depth + target
+
+
+def update_tree(repo, tree, changes):
+    """
+    Writes a copy of tree with changes applied, where changes maps
+    paths to (oid, filemode) or to None for removal. Only subtrees on
+    the changed paths are rebuilt. Returns None for an empty tree.
+    """
+    builder = repo.TreeBuilder(tree) if tree is not None \
+        else repo.TreeBuilder()
+    subtrees = {}
+
+    for path, entry in changes.items():
+        name, _, rest = path.partition('/')
+        if rest:
+            subtrees.setdefault(name, {})[rest] = entry
+        elif entry is None:
+            if builder.get(name) is not None:
+                builder.remove(name)
+        else:
+            builder.insert(name, *entry)
+
+    for name, sub_changes in subtrees.items():
+        old = builder.get(name)
+        subtree = None
+        if old is not None and old.filemode == pygit2.GIT_FILEMODE_TREE:
+            subtree = repo[old.id]
+        oid = update_tree(repo, subtree, sub_changes)
+        if oid is not None:
+            builder.insert(name, oid, pygit2.GIT_FILEMODE_TREE)
+        elif old is not None:
+            builder.remove(name)
+
+    if len(builder) == 0:
+        return None
+    return builder.write()
+
+
+class ViewIndex:
+    schema = """
+        CREATE TABLE IF NOT EXISTS files (
+            view TEXT NOT NULL,
+            path TEXT NOT NULL,
+            key TEXT NOT NULL,
+            PRIMARY KEY (view, path)
+        );
+        CREATE INDEX IF NOT EXISTS files_by_key
+            ON files (view, key);
+        CREATE TABLE IF NOT EXISTS entries (
+            view TEXT NOT NULL,
+            path TEXT NOT NULL,
+            view_path TEXT NOT NULL,
+            PRIMARY KEY (view, path, view_path)
+        );
+        CREATE TABLE IF NOT EXISTS views (
+            view TEXT PRIMARY KEY,
+            commit_id TEXT,
+            head TEXT,
+            annex TEXT
+        );
+    """
+
+    def __init__(self, repo, store, path):
+        self.repo = repo
+        self.store = store
+        self.path = path
+
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(self.schema)
+
+    def state(self, name):
+        row = self.db.execute(
+            'SELECT commit_id, head, annex FROM views WHERE view = ?',
+            (name,),
+        ).fetchone()
+        return row or (None, None, None)
+
+    def view_commit(self, name):
+        try:
+            ref = self.repo.lookup_reference(view_ref(name))
+        except (KeyError, ValueError):
+            return None
+        return self.repo[ref.target]
+
+    def symlinks(self, tree, prefix=''):
+        for entry in tree:
+            path = prefix + entry.name
+            if entry.filemode == pygit2.GIT_FILEMODE_TREE:
+                yield from self.symlinks(self.repo[entry.id], path + '/')
+            elif entry.filemode == pygit2.GIT_FILEMODE_LINK:
+                yield path, entry.id
+
+    def lookup_link(self, tree, path):
+        try:
+            entry = tree[path]
+        except KeyError:
+            return None
+        if entry.filemode != pygit2.GIT_FILEMODE_LINK:
+            return None
+        return entry.id
+
+    def rebuild(self, view, old_commit, old_head, old_annex, annex):
+        """
+        Whether the view has to be rebuilt from HEAD, because it isn't
+        the one the index last wrote or the commits it was made from
+        can't be diffed against.
+        """
+        if view is None or str(view.id) != old_commit:
+            return True
+        if not old_head or old_head not in self.repo:
+            return True
+        if old_annex != annex:
+            return not (old_annex and annex) or old_annex not in self.repo
+        return False
+
+    def changed_paths(self, name, old_head, head, old_annex, annex):
+        paths = set()
+        if old_head != str(head.id):
+            diff = self.repo[old_head].tree.diff_to_tree(head.tree)
+            for delta in diff.deltas:
+                paths.add(delta.old_file.path)
+                paths.add(delta.new_file.path)
+
+        keys = set(self.store.journal_changes())
+        if old_annex != annex:
+            keys.update(self.store.branch_changes(old_annex, annex))
+        keys = list(keys)
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            rows = self.db.execute(
+                'SELECT path FROM files WHERE view = ? AND key IN ({})'
+                .format(', '.join('?' * len(batch))),
+                [name] + batch,
+            )
+            paths.update(path for path, in rows)
+        return paths
+
+    @trace.traced()
+    def update(self, fields=default_fields):
+        """
+        Brings the view branch for fields up to date with HEAD and
+        the metadata store. Returns the view's commit and how many of
+        its files were rewritten.
+        """
+        name = view_name(fields)
+        head = self.repo.head.peel(pygit2.Commit)
+        annex = self.store.branch_head()
+        old_commit, old_head, old_annex = self.state(name)
+        view = self.view_commit(name)
+
+        if self.rebuild(view, old_commit, old_head, old_annex, annex):
+            tree = None
+            paths = [path for path, _ in self.symlinks(head.tree)]
+            with self.db:
+                self.db.execute('DELETE FROM files WHERE view = ?', (name,))
+                self.db.execute('DELETE FROM entries WHERE view = ?', (name,))
+        else:
+            paths = self.changed_paths(name, old_head, head, old_annex, annex)
+            tree = view.tree
+
+        links = {}
+        for path in paths:
+            oid = self.lookup_link(head.tree, path)
+            if oid is not None:
+                links[path] = oid
+        keys = {
+            path: self.repo[oid].data.decode().split('/')[-1]
+            for path, oid in links.items()
+        }
+        values = self.store.field_values(fields, set(keys.values()))
+
+        changes, blobs, depth = {}, {}, len(fields)
+        with self.db:
+            for path in paths:
+                rows = self.db.execute(
+                    'SELECT view_path FROM entries '
+                    'WHERE view = ? AND path = ?', (name, path),
+                )
+                for view_path, in rows:
+                    changes[view_path] = None
+                self.db.execute(
+                    'DELETE FROM entries WHERE view = ? AND path = ?',
+                    (name, path),
+                )
+                self.db.execute(
+                    'DELETE FROM files WHERE view = ? AND path = ?',
+                    (name, path),
+                )
+
+            for path, oid in links.items():
+                key = keys[path]
+                self.db.execute(
+                    'INSERT INTO files VALUES (?, ?, ?)', (name, path, key),
+                )
+                new_paths = view_paths(fields, values.get(key, {}), path)
+                if new_paths and oid not in blobs:
+                    target = link_target(
+                        path, self.repo[oid].data.decode(), depth,
+                    )
+                    blobs[oid] = self.repo.create_blob(target.encode())
+                for view_path in new_paths:
+                    changes[view_path] = (blobs[oid], pygit2.GIT_FILEMODE_LINK)
+                    self.db.execute(
+                        'INSERT INTO entries VALUES (?, ?, ?)',
+                        (name, path, view_path),
+                    )
+
+            with trace.span('views.update_tree', items=len(changes)):
+                tree_id = update_tree(self.repo, tree, changes) \
+                    or self.repo.TreeBuilder().write()
+
+            commit = view
+            if view is None or view.tree.id != tree_id:
+                signature = pygit2.Signature(
+                    self.repo.default_signature.name,
+                    self.repo.default_signature.email,
+                    int(datetime.now().timestamp()),
+                )
+                commit = self.repo[self.repo.create_commit(
+                    view_ref(name), signature, signature,
+                    'Update {} view to {}'.format(name, head.id),
+                    tree_id, [view.id] if view is not None else [],
+                )]
+
+            self.db.execute(
+                'INSERT OR REPLACE INTO views VALUES (?, ?, ?, ?)',
+                (name, str(commit.id), str(head.id), annex),
+            )
+
+        trace.count('view files rewritten', len(paths))
+        return commit, len(paths)
+
+    def __repr__(self):
+        return 'ViewIndex(path={!r})'.format(self.path)
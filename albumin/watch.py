@@ -0,0 +1,262 @@
+# Albumin Watch
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import errno
+import shutil
+import select
+import struct
+import ctypes
+import ctypes.util
+from datetime import datetime
+
+from albumin.utils import files_in
+from albumin import trace
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+event_header = struct.Struct('iIII')
+
+
+class Inotify:
+    """
+    Watches a folder tree for files that were closed after writing or
+    moved into it. Folders created or moved into the tree are watched
+    too, and their files reported as new.
+    """
+
+    mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(
+            ctypes.util.find_library('c') or 'libc.so.6', use_errno=True,
+        )
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.paths = {}
+
+    def add_watch(self, path):
+        wd = self.libc.inotify_add_watch(
+            self.fd, os.fsencode(path), self.mask,
+        )
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        self.paths[wd] = path
+
+    def add_tree(self, path):
+        self.add_watch(path)
+        for root, dirs, _ in os.walk(path):
+            dirs[:] = [d for d in dirs if d != '.git']
+            for dir_ in dirs:
+                self.add_watch(os.path.join(root, dir_))
+
+    def read(self, timeout=None):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+
+        data = os.read(self.fd, 64 * 1024)
+        events, offset = [], 0
+        while offset < len(data):
+            wd, mask, _, length = event_header.unpack_from(data, offset)
+            offset += event_header.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                events.append((None, mask))
+            elif mask & IN_IGNORED:
+                self.paths.pop(wd, None)
+            elif wd in self.paths:
+                path = os.path.join(self.paths[wd], os.fsdecode(name))
+                events.append((path, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+    def __repr__(self):
+        return 'Inotify(fd={}, watches={})'.format(self.fd, len(self.paths))
+
+
+class Watcher:
+    """
+    Imports files that appear under a folder in micro-batches. A file
+    is ready once it has had no events for the quiet period. Ready
+    files that have no date information are kept in a pending list
+    (saved across restarts) until they change again, the rest are
+    moved to a staging folder in the git dir and imported from there
+    with the dates found for them.
+    """
+
+    def __init__(self, repo, path, quiet=2.0, batch_size=100,
+                 mtime=False, commit_msg=None, **tags):
+        self.repo = repo
+        self.path = os.path.realpath(path)
+        self.quiet = quiet
+        self.batch_size = batch_size
+        self.mtime = mtime
+        self.commit_msg = commit_msg
+        self.tags = tags
+
+        self.changed = {}
+        self.pending_path = repo.state_path('watch', 'pending')
+        self.pending = self.load_pending()
+        self.inotify = None
+
+    def touch(self, path):
+        self.changed[path] = time.monotonic()
+        if path in self.pending:
+            self.pending.discard(path)
+            self.save_pending()
+
+    def scan(self, path=None):
+        for file in files_in(path or self.path):
+            if not self.unchanged_pending(file):
+                self.touch(file)
+
+    def unchanged_pending(self, path):
+        """
+        Whether path is pending and wasn't modified since the pending
+        list was last saved, so a rescan or a restart can skip it.
+        """
+        if path not in self.pending:
+            return False
+        try:
+            return os.stat(path).st_mtime_ns \
+                <= os.stat(self.pending_path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+
+    def ready(self):
+        now = time.monotonic()
+        ready = sorted(
+            path for path, changed in self.changed.items()
+            if now - changed >= self.quiet
+        )
+        for path in ready:
+            del self.changed[path]
+        return [path for path in ready if os.path.isfile(path)]
+
+    def timeout(self):
+        if not self.changed:
+            return None
+        oldest = min(self.changed.values())
+        return max(0, oldest + self.quiet - time.monotonic())
+
+    def handle(self, path, mask):
+        if path is None:
+            self.scan()
+        elif mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO) and os.path.isdir(path):
+                self.inotify.add_tree(path)
+                self.scan(path)
+        elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            self.touch(path)
+
+    def load_pending(self):
+        try:
+            with open(self.pending_path) as file:
+                paths = file.read().splitlines()
+        except FileNotFoundError:
+            return set()
+        return {path for path in paths if os.path.isfile(path)}
+
+    def save_pending(self):
+        with open(self.pending_path, 'w') as file:
+            print(*sorted(self.pending), sep='\n', file=file)
+
+    def stage(self, files):
+        name = datetime.now().strftime('%Y%m%dT%H%M%S.%f')
+        staging = os.path.join(os.path.dirname(self.pending_path), name)
+        moves = []
+        for file in files:
+            dest = os.path.join(staging, os.path.relpath(file, self.path))
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.move(file, dest)
+            moves.append((file, dest))
+        return staging, moves
+
+    @staticmethod
+    def unstage(moves):
+        for file, dest in moves:
+            if os.path.exists(dest):
+                os.makedirs(os.path.dirname(file), exist_ok=True)
+                shutil.move(dest, file)
+
+    @trace.traced(items=lambda self, files: len(files))
+    def import_batch(self, files):
+        # Apply what was queued since the last batch before reading
+        # metadata, and don't keep stale metadata between batches.
+        self.repo.refresh()
+        analyzed = self.repo.analyze_files(files, mtime=self.mtime)
+        undated = [file for file in files if file in analyzed.remaining]
+        if undated:
+            self.pending.update(undated)
+            self.save_pending()
+
+        files = [file for file in files if file not in analyzed.remaining]
+        if not files:
+            return None
+
+        staging, moves = self.stage(files)
+        try:
+            report = self.repo.import_(
+                staging, mtime=self.mtime, commit_msg=self.commit_msg,
+                analyzed=analyzed, **self.tags
+            )
+        except:
+            self.unstage(moves)
+            raise
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        return report
+
+    def run(self):
+        self.inotify = Inotify()
+        try:
+            self.inotify.add_tree(self.path)
+            self.scan()
+            while True:
+                for path, mask in self.inotify.read(self.timeout()):
+                    self.handle(path, mask)
+
+                ready = self.ready()
+                for start in range(0, len(ready), self.batch_size):
+                    batch = ready[start:start + self.batch_size]
+                    yield batch, self.import_batch(batch)
+        except OSError as err:
+            if err.errno == errno.ENOSPC:
+                msg = 'Out of inotify watches, raise ' \
+                      'fs.inotify.max_user_watches'
+                raise RuntimeError(msg) from err
+            raise
+        finally:
+            self.inotify.close()
+            self.inotify = None
+
+    def __repr__(self):
+        return 'Watcher(path={!r}, changed={}, pending={})'.format(
+            self.path, len(self.changed), len(self.pending)
+        )
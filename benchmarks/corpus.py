@@ -0,0 +1,193 @@
+# Albumin Benchmark Corpus
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Generate a synthetic photo corpus for benchmarks.
+
+Usage:
+    corpus <dest> [-n=<count>] [--mix=<mix>] [--seed=<seed>] [--size=<size>]
+
+Options:
+    -n, --count=<count>   Number of files to generate. [default: 1000]
+    --mix=<mix>           Relative weights of file kinds.
+                          [default: exif=5,stripped=2,unix=1,collision=1,duplicate=1]
+    --seed=<seed>         Random seed for the generator. [default: 0]
+    --size=<size>         Average bytes of padding per file. [default: 0]
+
+Kinds:
+    exif        JPEGs with an Exif DateTimeOriginal
+    stripped    JPEGs without metadata, named IMG_YYYYMMDD_HHMMSS.jpg
+    unix        JPEGs without metadata, named by UNIX timestamp in ms
+    collision   Exif JPEGs sharing a datetime and a name with earlier ones
+    duplicate   Byte-identical copies of earlier files
+
+"""
+
+import os
+import random
+import struct
+from datetime import datetime
+from datetime import timedelta
+
+template_path = os.path.join(
+    os.path.dirname(__file__), os.pardir, 'tests', 'images', 'A000.jpg'
+)
+
+kinds = ['exif', 'stripped', 'unix', 'collision', 'duplicate']
+files_per_folder = 1000
+
+
+def parse_mix(mix):
+    weights = {}
+    for item in mix.split(','):
+        kind, weight = item.split('=')
+        if kind not in kinds:
+            raise ValueError(kind)
+        weights[kind] = float(weight)
+    return weights
+
+
+def jpeg_body(path=template_path):
+    # Like the images strip-image.sh makes: everything from the
+    # quantization tables on, without APPn or comment segments.
+    with open(path, 'rb') as file:
+        data = file.read()
+
+    idx = 2
+    while idx < len(data):
+        marker = data[idx + 1]
+        if 0xE0 <= marker <= 0xEF or marker == 0xFE:
+            length, = struct.unpack('>H', data[idx + 2:idx + 4])
+            idx += 2 + length
+        else:
+            return data[idx:]
+    raise ValueError(path)
+
+
+def segment(marker, payload):
+    return bytes([0xFF, marker]) + struct.pack('>H', len(payload) + 2) \
+        + payload
+
+
+def exif_segment(dt):
+    value = dt.strftime('%Y:%m:%d %H:%M:%S').encode() + b'\0'
+    exif_ifd = 8 + 18
+    value_offset = exif_ifd + 18
+    tiff = b'II*\0' + struct.pack('<I', 8) \
+        + struct.pack('<HHHII', 1, 0x8769, 4, 1, exif_ifd) \
+        + struct.pack('<I', 0) \
+        + struct.pack('<HHHII', 1, 0x9003, 2, len(value), value_offset) \
+        + struct.pack('<I', 0) \
+        + value
+    return segment(0xE1, b'Exif\0\0' + tiff)
+
+
+def make_jpeg(body, serial, dt=None, padding=b''):
+    jfif = segment(0xE0, b'JFIF\0\x01\x01\0\0\x01\0\x01\0\0')
+    exif = exif_segment(dt) if dt else b''
+    comment = segment(0xFE, 'albumin-bench {}'.format(serial).encode())
+    return b'\xFF\xD8' + jfif + exif + comment + body + padding
+
+
+def generate(dest, count=1000, mix=None, seed=0, size=0):
+    rng = random.Random(seed)
+    weights = mix or parse_mix(
+        'exif=5,stripped=2,unix=1,collision=1,duplicate=1'
+    )
+    choices = [k for k in kinds if weights.get(k)]
+    choice_weights = [weights[k] for k in choices]
+    body = jpeg_body()
+
+    start = datetime(2005, 1, 1)
+    span = int(timedelta(days=15 * 365).total_seconds())
+
+    stats = dict.fromkeys(kinds, 0)
+    exifs, written = [], []
+
+    for serial in range(count):
+        kind = rng.choices(choices, choice_weights)[0]
+        if kind == 'collision' and not exifs:
+            kind = 'exif'
+        if kind == 'duplicate' and not written:
+            kind = 'exif'
+
+        folder = os.path.join(
+            dest, '{:04}'.format(serial // files_per_folder)
+        )
+        os.makedirs(folder, exist_ok=True)
+
+        pad_size = rng.randint(0, 2 * size) if size else 0
+        padding = rng.getrandbits(8 * pad_size).to_bytes(pad_size, 'little') \
+            if pad_size else b''
+        dt = start + timedelta(seconds=rng.randrange(span))
+
+        if kind == 'exif':
+            name = 'DSC{:05}.JPG'.format(serial % 100000)
+            data = make_jpeg(body, serial, dt=dt, padding=padding)
+            exifs.append((name, dt))
+
+        elif kind == 'collision':
+            name, dt = rng.choice(exifs)
+            data = make_jpeg(body, serial, dt=dt, padding=padding)
+
+        elif kind == 'stripped':
+            name = 'IMG_{:%Y%m%d_%H%M%S}.jpg'.format(dt)
+            data = make_jpeg(body, serial, padding=padding)
+
+        elif kind == 'unix':
+            millis = int((dt - datetime(1970, 1, 1)).total_seconds())
+            name = '{}{:03}.jpg'.format(millis, rng.randrange(1000))
+            data = make_jpeg(body, serial, padding=padding)
+
+        elif kind == 'duplicate':
+            source = rng.choice(written)
+            name = os.path.basename(source)
+            with open(source, 'rb') as file:
+                data = file.read()
+            dt = datetime.fromtimestamp(os.path.getmtime(source))
+
+        path = os.path.join(folder, name)
+        if os.path.exists(path):
+            base, ext = os.path.splitext(name)
+            path = os.path.join(folder, '{}_{}{}'.format(base, serial, ext))
+
+        with open(path, 'wb') as file:
+            file.write(data)
+        mtime = dt.timestamp()
+        os.utime(path, (mtime, mtime))
+
+        written.append(path)
+        stats[kind] += 1
+
+    return stats
+
+
+def main():
+    from docopt import docopt
+    args = docopt(__doc__)
+    stats = generate(
+        args['<dest>'],
+        count=int(args['--count']),
+        mix=parse_mix(args['--mix']),
+        seed=int(args['--seed']),
+        size=int(args['--size']),
+    )
+    for kind, count in stats.items():
+        print('{}: {}'.format(kind, count))
+
+
+if __name__ == '__main__':
+    main()
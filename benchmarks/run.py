@@ -0,0 +1,392 @@
+# Albumin Benchmarks
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Run albumin benchmarks on a synthetic corpus.
+
+Usage:
+    run [-n=<count>] [--mix=<mix>] [--seed=<seed>] [--size=<size>]
+        [-s=<stage>]... [-o=<output>] [-w=<workdir>]
+
+Options:
+    -n, --count=<count>     Number of files to generate. [default: 1000]
+    --mix=<mix>             Relative weights of file kinds.
+                            [default: exif=5,stripped=2,unix=1,collision=1,duplicate=1]
+    --seed=<seed>           Random seed for the generator. [default: 0]
+    --size=<size>           Average bytes of padding per file. [default: 0]
+    -s, --stage=<stage>     Only run these stages.
+    -o, --output=<output>   Write JSON results here instead of stdout.
+    -w, --workdir=<workdir> Keep the corpus and repos in this folder.
+
+Stages:
+    files_in, analyze_date, report_short, report_parse, imdate_diff,
+    arrange_by_imdates, fix_filenames, hook_commit, hash_cold,
+    hash_cold_ordered, analyze_date_cold, analyze_date_cold_ordered
+
+The *_cold stages drop the corpus from the page cache first, and read
+it in directory order, or in its order on disk for *_cold_ordered.
+
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+from collections import OrderedDict
+
+from benchmarks.corpus import generate
+from benchmarks.corpus import parse_mix
+
+
+def trace_summary(trace_path):
+    with open(trace_path) as file:
+        events = json.loads(file.read().rstrip().rstrip(',') + ']')
+
+    subprocesses, counters = {}, {}
+    for event in events:
+        if event['name'] != 'summary':
+            continue
+        summary = event['args']
+        for name, stats in summary['subprocesses'].items():
+            total = subprocesses.setdefault(
+                name, {'count': 0, 'total_time_s': 0}
+            )
+            total['count'] += stats['count']
+            total['total_time_s'] += stats['total_time_s']
+        for name, value in summary['counters'].items():
+            counters[name] = counters.get(name, 0) + value
+    return subprocesses, counters
+
+
+def git(repo, *args, env=None):
+    subprocess.run(
+        ['git', '-C', repo] + list(args), env=env, check=True,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+def make_repo(path, corpus, hooks=False):
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    git(path, 'init', '-q')
+    git(path, 'config', 'user.name', 'Albumin Benchmark')
+    git(path, 'config', 'user.email', 'benchmark@albumin')
+    git(path, 'config', 'albumin.timezone', 'UTC')
+    git(path, 'annex', 'init', 'benchmark')
+
+    if hooks:
+        from albumin.repo import AlbuminRepo
+        from albumin.core import init
+        init(AlbuminRepo(path), shutil.which('albumin'))
+
+    shutil.copytree(corpus, os.path.join(path, 'inbox'))
+    git(path, 'annex', 'add', 'inbox')
+    return path
+
+
+def stage_repo(ctx, stage):
+    """
+    Makes a fresh repo with the corpus staged in inbox/ for a stage,
+    so that no stage sees another one's commits or metadata.
+    """
+    from albumin.repo import AlbuminRepo
+    path = os.path.join(ctx['workdir'], '{}-repo'.format(stage))
+    return AlbuminRepo(make_repo(path, ctx['corpus']))
+
+
+def stage_files_in(ctx):
+    from albumin.utils import files_in
+    return lambda: sum(1 for _ in files_in(ctx['corpus']))
+
+
+def stage_analyze_date(ctx):
+    import pytz
+    from albumin.utils import files_in
+    from albumin.imdate import analyze_date
+    paths = list(files_in(ctx['corpus']))
+
+    def run():
+        analyze_date(*paths, timezone=pytz.utc)
+        return len(paths)
+    return run
+
+
+def corpus_report(ctx):
+    import pytz
+    from albumin.utils import files_in
+    from albumin.imdate import analyze_date
+    paths = list(files_in(ctx['corpus']))
+    return analyze_date(*paths, timezone=pytz.utc)
+
+
+def stage_report_short(ctx):
+    report = corpus_report(ctx)
+
+    def run():
+        list(report.short())
+        return len(report.files)
+    return run
+
+
+def stage_report_parse(ctx):
+    from albumin.imdate import Report
+    report = corpus_report(ctx)
+    lines = list(report.short())
+
+    def run():
+        return len(Report.parse(lines).files)
+    return run
+
+
+def stage_imdate_diff(ctx):
+    repo = stage_repo(ctx, 'imdate_diff')
+
+    def run():
+        return len(repo.imdate_diff().files)
+    return run
+
+
+def stage_arrange_by_imdates(ctx):
+    repo = stage_repo(ctx, 'arrange_by_imdates')
+    new_files = repo.new_files()
+    report = repo.imdate_diff(
+        files={repo.abs_path(f): k for f, k in new_files.items()},
+    )
+    updates = report.updates
+    imdates = {
+        key: updates[key][0]
+        for key in new_files.values() if key in updates
+    }
+
+    def run():
+        repo.arrange_by_imdates(files=new_files, imdates=imdates)
+        return len(new_files)
+    return run
+
+
+def stage_fix_filenames(ctx):
+    repo = stage_repo(ctx, 'fix_filenames')
+    new_files = repo.new_files()
+    repo.apply_report(repo.imdate_diff(
+        files={repo.abs_path(f): k for f, k in new_files.items()},
+    ))
+    repo.commit('Benchmark files with their dates stored')
+
+    def run():
+        repo.fix_filenames()
+        return len(repo.index)
+    return run
+
+
+def stage_hook_commit(ctx):
+    if not shutil.which('albumin'):
+        raise RuntimeError('albumin executable not in PATH')
+
+    env = dict(os.environ, ALBUMIN_TRACE=ctx['trace'])
+
+    def run():
+        git(ctx['hook_repo'], 'commit', '-q', '-m', 'Benchmark commit',
+            env=env)
+        return ctx['count']
+    return run
+
+
+def cold_corpus(ctx):
+    from albumin.utils import files_in
+    from albumin.readorder import dont_need
+    paths = list(files_in(ctx['corpus']))
+    os.sync()
+    dont_need(paths)
+    return paths
+
+
+def stage_hash_cold(ctx, read_order='none'):
+    from albumin.hasher import Hasher
+    hasher = Hasher('SHA256E', read_order=read_order)
+    paths = cold_corpus(ctx)
+
+    def run():
+        return len(hasher.keys(paths))
+    return run
+
+
+def stage_hash_cold_ordered(ctx):
+    return stage_hash_cold(ctx, read_order='physical')
+
+
+def stage_analyze_date_cold(ctx, read_order='none'):
+    import pytz
+    from albumin.imdate import analyze_date
+    from albumin import readorder
+    readorder.configure(mode=read_order)
+    paths = cold_corpus(ctx)
+
+    def run():
+        analyze_date(*paths, timezone=pytz.utc)
+        return len(paths)
+    return run
+
+
+def stage_analyze_date_cold_ordered(ctx):
+    return stage_analyze_date_cold(ctx, read_order='physical')
+
+
+stages = OrderedDict([
+    ('files_in', stage_files_in),
+    ('analyze_date', stage_analyze_date),
+    ('report_short', stage_report_short),
+    ('report_parse', stage_report_parse),
+    ('imdate_diff', stage_imdate_diff),
+    ('arrange_by_imdates', stage_arrange_by_imdates),
+    ('fix_filenames', stage_fix_filenames),
+    ('hook_commit', stage_hook_commit),
+    ('hash_cold', stage_hash_cold),
+    ('hash_cold_ordered', stage_hash_cold_ordered),
+    ('analyze_date_cold', stage_analyze_date_cold),
+    ('analyze_date_cold_ordered', stage_analyze_date_cold_ordered),
+])
+
+
+def measure(stage, ctx, conn):
+    try:
+        import albumin.trace
+        ctx = dict(ctx, trace=os.path.join(
+            ctx['workdir'], '{}.trace.json'.format(stage)
+        ))
+        if os.path.exists(ctx['trace']):
+            os.remove(ctx['trace'])
+
+        run = stages[stage](ctx)
+        tracer = albumin.trace.enable(
+            ctx['trace'], name='benchmark {}'.format(stage), append=True,
+        )
+        start = time.perf_counter()
+        with albumin.trace.span('benchmark.{}'.format(stage)) as span:
+            items = span['items'] = run()
+        wall_time = time.perf_counter() - start
+        tracer.write()
+
+        self_usage = resource.getrusage(resource.RUSAGE_SELF)
+        child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        subprocesses, counters = trace_summary(ctx['trace'])
+        conn.send(OrderedDict([
+            ('items', items),
+            ('wall_time', wall_time),
+            ('peak_rss_kib', self_usage.ru_maxrss),
+            ('children_peak_rss_kib', child_usage.ru_maxrss),
+            ('subprocesses', subprocesses),
+            ('counters', counters),
+        ]))
+    except Exception as err:
+        conn.send({'error': repr(err)})
+    finally:
+        conn.close()
+
+
+def run_stage(stage, ctx):
+    mp = multiprocessing.get_context('fork')
+    parent_conn, child_conn = mp.Pipe(duplex=False)
+    process = mp.Process(target=measure, args=(stage, ctx, child_conn))
+    process.start()
+    result = parent_conn.recv()
+    process.join()
+    return result
+
+
+def tool_version(*argv):
+    try:
+        out = subprocess.run(
+            argv, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        ).stdout
+        return out.splitlines()[0] if out else None
+    except OSError:
+        return None
+
+
+def benchmark(workdir, count, mix, seed, size, selected=None):
+    ctx = {
+        'count': count,
+        'workdir': workdir,
+        'corpus': os.path.join(workdir, 'corpus'),
+        'hook_repo': os.path.join(workdir, 'hook-repo'),
+    }
+    kinds = generate(ctx['corpus'], count=count, mix=mix, seed=seed,
+                     size=size)
+
+    selected = selected or list(stages)
+    if 'hook_commit' in selected:
+        make_repo(ctx['hook_repo'], ctx['corpus'], hooks=True)
+
+    results = OrderedDict()
+    for stage in stages:
+        if stage in selected:
+            results[stage] = run_stage(stage, ctx)
+
+    return OrderedDict([
+        ('corpus', OrderedDict([
+            ('count', count), ('mix', mix), ('seed', seed),
+            ('size', size), ('kinds', kinds),
+        ])),
+        ('environment', OrderedDict([
+            ('python', platform.python_version()),
+            ('platform', platform.platform()),
+            ('cpus', os.cpu_count()),
+            ('git-annex', tool_version('git', 'annex', 'version')),
+            ('exiftool', tool_version('exiftool', '-ver')),
+        ])),
+        ('stages', results),
+    ])
+
+
+def main():
+    from docopt import docopt
+    args = docopt(__doc__)
+
+    for stage in args['--stage']:
+        if stage not in stages:
+            raise ValueError(stage)
+
+    options = dict(
+        count=int(args['--count']),
+        mix=parse_mix(args['--mix']),
+        seed=int(args['--seed']),
+        size=int(args['--size']),
+        selected=args['--stage'],
+    )
+
+    if args['--workdir']:
+        results = benchmark(os.path.realpath(args['--workdir']), **options)
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            results = benchmark(workdir, **options)
+
+    if args['--output']:
+        with open(args['--output'], 'w') as file:
+            json.dump(results, file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
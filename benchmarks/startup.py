@@ -0,0 +1,203 @@
+# Albumin Startup Benchmarks
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Check the startup time of albumin's git hooks and commands against
+their budgets. Times are medians over the runs, minus the time of
+the same work without albumin (a bare interpreter, and git-annex for
+the pre-commit hook). Exits with 1 if any case is over its budget.
+
+Usage:
+    startup [-n=<runs>] [-o=<output>]
+
+Options:
+    -n, --runs=<runs>       Runs of each case. [default: 10]
+    -o, --output=<output>   Write JSON results here instead of stdout.
+
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import platform
+import statistics
+import subprocess
+from collections import OrderedDict
+
+import albumin
+
+hook_budgets = OrderedDict([
+    ('pre-commit', 25),
+    ('prepare-commit-msg', 25),
+    ('commit-msg', 25),
+    ('post-commit', 25),
+])
+
+command_budgets = OrderedDict([
+    ('--version', 30),
+    ('--help', 30),
+    ('analyze', 300),
+])
+
+skipped_branches = ['git-annex', 'views/benchmark']
+
+hook_args = {
+    'prepare-commit-msg': ['msg'],
+    'commit-msg': ['msg'],
+}
+
+
+def launcher(bin_dir, name):
+    path = os.path.join(bin_dir, name)
+    with open(path, 'w') as file:
+        print('#!{}'.format(sys.executable), file=file)
+        print('from albumin.cli import main', file=file)
+        print('main()', file=file)
+    os.chmod(path, 0o755)
+    return path
+
+
+def median_time(argv, cwd, runs, env):
+    times, returncode = [], None
+    for _ in range(runs):
+        start = time.perf_counter()
+        returncode = subprocess.run(
+            argv, cwd=cwd, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        ).returncode
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), returncode
+
+
+def make_repo(path, annex):
+    os.makedirs(path)
+    for args in (['init', '-q'], ['commit', '-q', '--allow-empty', '-m', '.']):
+        subprocess.run(
+            ['git', '-C', path, '-c', 'user.name=Albumin Benchmark',
+             '-c', 'user.email=benchmark@albumin'] + args,
+            check=True, stdout=subprocess.DEVNULL,
+        )
+    if annex:
+        subprocess.run(
+            ['git', '-C', path, 'annex', 'init', 'benchmark'],
+            check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+    with open(os.path.join(path, 'msg'), 'w') as file:
+        print('Benchmark commit', file=file)
+    return path
+
+
+def result(elapsed, baseline, budget, returncode):
+    overhead = (elapsed - baseline) * 1000
+    return OrderedDict([
+        ('time_ms', elapsed * 1000),
+        ('overhead_ms', overhead),
+        ('budget_ms', budget),
+        ('returncode', returncode),
+        ('ok', overhead <= budget and returncode == 0),
+    ])
+
+
+def startup(workdir, runs):
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.path.dirname(os.path.dirname(albumin.__file__)),
+    )
+    env.pop('ALBUMIN_TRACE', None)
+
+    bin_dir = os.path.join(workdir, 'bin')
+    os.makedirs(bin_dir)
+    has_annex = shutil.which('git-annex') is not None
+    repo = make_repo(os.path.join(workdir, 'repo'), annex=has_annex)
+    empty = os.path.join(workdir, 'empty')
+    os.makedirs(empty)
+
+    interpreter, _ = median_time(
+        [sys.executable, '-c', 'pass'], repo, runs, env,
+    )
+    annex_pre_commit = None
+
+    cases = OrderedDict()
+    for branch in skipped_branches:
+        subprocess.run(
+            ['git', '-C', repo, 'symbolic-ref', 'HEAD',
+             'refs/heads/{}'.format(branch)], check=True,
+        )
+        for hook, budget in hook_budgets.items():
+            name = '{} on {}'.format(hook, branch)
+            baseline = interpreter
+            if hook == 'pre-commit':
+                if not has_annex:
+                    cases[name] = {'skipped': 'git-annex not in PATH'}
+                    continue
+                if annex_pre_commit is None:
+                    annex_pre_commit, _ = median_time(
+                        ['git', 'annex', 'pre-commit', '.'], repo, runs, env,
+                    )
+                baseline += annex_pre_commit
+
+            argv = [launcher(bin_dir, hook)] + hook_args.get(hook, [])
+            elapsed, returncode = median_time(argv, repo, runs, env)
+            cases[name] = result(elapsed, baseline, budget, returncode)
+
+    albumin_bin = launcher(bin_dir, 'albumin')
+    for command, budget in command_budgets.items():
+        argv = [albumin_bin, command]
+        if command == 'analyze':
+            argv.append(empty)
+        elapsed, returncode = median_time(argv, empty, runs, env)
+        cases['albumin {}'.format(command)] = \
+            result(elapsed, interpreter, budget, returncode)
+
+    return OrderedDict([
+        ('environment', OrderedDict([
+            ('python', platform.python_version()),
+            ('platform', platform.platform()),
+            ('runs', runs),
+            ('interpreter_ms', interpreter * 1000),
+            ('annex_pre_commit_ms',
+             annex_pre_commit * 1000 if annex_pre_commit else None),
+        ])),
+        ('cases', cases),
+    ])
+
+
+def main():
+    from docopt import docopt
+    args = docopt(__doc__)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results = startup(workdir, runs=int(args['--runs']))
+
+    if args['--output']:
+        with open(args['--output'], 'w') as file:
+            json.dump(results, file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    over = [
+        name for name, case in results['cases'].items()
+        if not case.get('ok', True)
+    ]
+    sys.exit(1 if over else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -49,4 +49,7 @@ setuptools.setup(
     keywords=['git', 'annex', 'metadata', 'photo', 'photograph', 'library'],
     py_modules=['albumin'],
     install_requires=['git-annex-adapter==0.1.0', 'pytz', 'pygit2', 'PyExifTool', 'docopt'],
+    extras_require={
+        'phash': ['numpy', 'Pillow'],
+    },
 )
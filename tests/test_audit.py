@@ -0,0 +1,100 @@
+# Albumin Audit Tests
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sqlite3
+import tempfile
+from unittest import TestCase
+
+import pygit2
+
+from albumin.audit import audit_shard
+from albumin.audit import check_file
+from albumin.audit import format_problem
+from albumin.audit import matches_name
+from albumin.audit import parse_problems
+
+methods = {'ExifTool/EXIF/DateTimeOriginal', 'Manual/Trusted'}
+
+good = {
+    'datetime': ['2015-06-01@10-20-30'],
+    'datetime-method': ['Manual/Trusted'],
+    'timezone': ['Europe/Istanbul'],
+    'year': ['2015'], 'month': ['06'], 'day': ['01'],
+}
+
+
+class TestAudit(TestCase):
+    def test_matches_name(self):
+        name_fmt = '20150601T102030Z{:02}.jpg'
+        assert matches_name('20150601T102030Z03.jpg', name_fmt)
+        assert not matches_name('20150601T102030Z3.jpg', name_fmt)
+        assert not matches_name('in/20150601T102030Z03.jpg', name_fmt)
+        assert not matches_name('20150601T102030Zab.jpg', name_fmt)
+
+    def test_check_file(self):
+        assert check_file('20150601T102030Z00.jpg', good, methods) == []
+
+        values = dict(good, day=['02'], timezone=['Mars/Olympus'])
+        assert check_file('IMG_1.JPG', values, methods) == [
+            ('bad-timezone', 'Mars/Olympus'),
+            ('bad-fields', 'year=2015 month=06 day=01'),
+            ('bad-name', '20150601T102030Z{:02}.JPG'),
+        ]
+
+        values = dict(good, datetime=[])
+        del values['datetime-method']
+        assert check_file('x.jpg', values, methods) == [
+            ('bad-method', ''), ('no-datetime', ''),
+        ]
+        values = dict(good, datetime=['2015-06-01'])
+        assert check_file('x.jpg', values, methods) == [
+            ('bad-datetime', '2015-06-01'),
+        ]
+
+    def test_audit_shard(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            repo = pygit2.init_repository(temp_dir, bare=True)
+            db_path = os.path.join(temp_dir, 'metadata.sqlite')
+            db = sqlite3.connect(db_path)
+            db.execute('CREATE TABLE fields (key, field, value)')
+
+            entries = []
+            for path, key, values in [
+                    ('20150601T102030Z00.jpg', 'KEY1.jpg', good),
+                    ('IMG_2.jpg', 'KEY2.jpg', good),
+                    ('IMG_3.jpg', 'KEY3.jpg', {})]:
+                target = '.git/annex/objects/Xx/Yy/{0}/{0}'.format(key)
+                oid = repo.create_blob(target.encode())
+                entries.append((path, str(oid)))
+                db.executemany('INSERT INTO fields VALUES (?, ?, ?)', [
+                    (key, field, value)
+                    for field, field_values in values.items()
+                    for value in field_values
+                ])
+            db.commit()
+
+            problems = audit_shard(repo.path, db_path, entries, methods)
+            assert problems == [
+                ('bad-name', 'IMG_2.jpg', 'KEY2.jpg',
+                 '20150601T102030Z{:02}.jpg'),
+                ('bad-method', 'IMG_3.jpg', 'KEY3.jpg', ''),
+                ('no-datetime', 'IMG_3.jpg', 'KEY3.jpg', ''),
+            ]
+
+            lines = ['# problem\tpath\tkey\tdetail', '']
+            lines += [format_problem(*p) + '\n' for p in problems]
+            assert list(parse_problems(lines)) == problems
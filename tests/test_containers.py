@@ -0,0 +1,147 @@
+# Albumin Container Tests
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import struct
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+
+from albumin.containers import Unsupported
+from albumin.containers import container_tags
+from albumin.containers import read_containers
+
+
+def box(type_, *payload):
+    data = b''.join(payload)
+    return struct.pack('>I4s', 8 + len(data), type_) + data
+
+
+def full_box(type_, version, *payload):
+    return box(type_, bytes([version, 0, 0, 0]), *payload)
+
+
+def qt_seconds(dt):
+    return int((dt - datetime(1904, 1, 1)).total_seconds())
+
+
+def mp4(created, brand=b'isom', extra=b''):
+    mdhd = full_box(b'mdhd', 0, struct.pack('>II', created, created))
+    trak = box(b'trak', box(b'mdia', mdhd))
+    mvhd = full_box(b'mvhd', 0, struct.pack('>II', created, created))
+    return box(b'ftyp', brand, b'\0\0\0\0', brand) \
+        + box(b'mdat', os.urandom(4096)) \
+        + box(b'moov', mvhd, trak, trak) + extra
+
+
+def heic(dto):
+    tiff = b'MM\0\x2a' + struct.pack('>I', 8)
+    exif_ifd = 8 + 2 + 12 + 4
+    tiff += struct.pack('>H', 1) \
+        + struct.pack('>HHII', 0x8769, 4, 1, exif_ifd) + b'\0' * 4
+    value_offset = exif_ifd + 2 + 12 + 4
+    tiff += struct.pack('>H', 1) \
+        + struct.pack('>HHII', 0x9003, 2, 20, value_offset) + b'\0' * 4
+    tiff += dto.encode() + b'\0'
+    exif = struct.pack('>I', 6) + b'Exif\0\0' + tiff
+
+    infe = full_box(b'infe', 2, struct.pack('>HH4s', 2, 0, b'Exif'))
+    iinf = full_box(b'iinf', 0, struct.pack('>H', 1), infe)
+    ftyp = box(b'ftyp', b'heic', b'\0\0\0\0', b'mif1heic')
+
+    def meta(offset):
+        iloc = full_box(
+            b'iloc', 0, bytes([0x44, 0x00]), struct.pack('>H', 1),
+            struct.pack('>HHHII', 2, 0, 1, offset, len(exif)),
+        )
+        return full_box(b'meta', 0, iinf, iloc)
+
+    offset = len(ftyp) + len(meta(0)) + 8
+    return ftyp + meta(offset) + box(b'mdat', exif)
+
+
+def chunk(id_, data):
+    pad = b'\0' if len(data) % 2 else b''
+    return struct.pack('<4sI', id_, len(data)) + data + pad
+
+
+def avi(idit):
+    hdrl = chunk(b'LIST', b'hdrl' + chunk(b'avih', b'\0' * 56)
+                 + chunk(b'IDIT', idit))
+    movi = chunk(b'LIST', b'movi' + chunk(b'00dc', os.urandom(1000)))
+    body = b'AVI ' + hdrl + movi
+    return struct.pack('<4sI', b'RIFF', len(body)) + body
+
+
+class TestContainers(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write(self, name, data):
+        path = os.path.join(self.temp_dir.name, name)
+        with open(path, 'wb') as file:
+            file.write(data)
+        return path
+
+    def tags(self, name, data):
+        tags = container_tags(self.write(name, data))
+        assert len(tags.pop('File:FileModifyDate')) == 25
+        return tags
+
+    def test_mp4(self):
+        created = qt_seconds(datetime(2015, 6, 1, 10, 20, 30))
+        assert self.tags('video.mp4', mp4(created)) == {
+            'QuickTime:MediaCreateDate': '2015:06:01 10:20:30',
+        }
+        assert self.tags('empty.mp4', mp4(0)) == {}
+
+    def test_heic(self):
+        assert self.tags('photo.heic', heic('2016:02:29 23:59:59')) == {
+            'EXIF:DateTimeOriginal': '2016:02:29 23:59:59',
+        }
+
+    def test_avi(self):
+        data = avi(b'Mon Mar 10 15:04:43 2003\n\0')
+        assert self.tags('video.avi', data) == {
+            'RIFF:DateTimeOriginal': '2003:03:10 15:04:43',
+        }
+
+    def test_unusual_files(self):
+        created = qt_seconds(datetime(2015, 6, 1))
+        cases = {
+            'vendor.mp4': mp4(created, extra=box(b'uuid', b'\0' * 16)),
+            'brand.mp4': mp4(created, brand=b'crx '),
+            'truncated.mp4': mp4(created)[:-10],
+            'date.avi': avi(b'10/03/2003'),
+            'photo.jpg': b'\xff\xd8\xff\xe1',
+        }
+        for name, data in cases.items():
+            with self.subTest(name=name):
+                with self.assertRaises(Unsupported):
+                    container_tags(self.write(name, data))
+
+    def test_read_containers(self):
+        created = qt_seconds(datetime(2015, 6, 1))
+        video = self.write('video.mov', mp4(created, brand=b'qt  '))
+        photo = self.write('photo.jpg', b'\xff\xd8\xff\xe1')
+        missing = os.path.join(self.temp_dir.name, 'missing.mp4')
+
+        tags, rest = read_containers([video, photo, missing])
+        assert list(tags) == [video]
+        assert rest == [photo, missing]
@@ -0,0 +1,77 @@
+# Albumin Daemon Tests
+# Copyright (C) 2016 Alper Nebi Yasak
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import tempfile
+import threading
+from types import SimpleNamespace
+from unittest import TestCase
+
+from albumin.daemon import Daemon
+from albumin.daemon import NoDaemon
+from albumin.daemon import call
+
+
+class TestDaemon(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.git_dir = os.path.join(self.temp_dir.name, '.git')
+        os.makedirs(os.path.join(self.git_dir, 'albumin'))
+        with open(os.path.join(self.git_dir, 'HEAD'), 'w') as file:
+            print('ref: refs/heads/git-annex', file=file)
+
+        self.refreshes = []
+        repo = SimpleNamespace(
+            state_path=lambda name: os.path.join(
+                self.git_dir, 'albumin', name
+            ),
+            refresh=lambda: self.refreshes.append(os.getcwd()),
+        )
+        self.daemon = Daemon(repo, idle=10)
+        self.thread = threading.Thread(target=self.daemon.serve)
+        self.thread.start()
+        while self.thread.is_alive() \
+                and not os.path.exists(self.daemon.path):
+            time.sleep(0.01)
+
+    def tearDown(self):
+        if self.thread.is_alive():
+            call(self.daemon.path, {'stop': True})
+        self.thread.join()
+        self.temp_dir.cleanup()
+
+    def test_hook_request(self):
+        response = call(self.daemon.path, {
+            'hook': 'post-commit',
+            'args': {},
+            'cwd': self.temp_dir.name,
+            'env': {'GIT_DIR': self.git_dir},
+        })
+        assert response == {'retval': None, 'output': ''}
+        assert self.refreshes == [os.path.realpath(self.temp_dir.name)]
+        assert 'GIT_DIR' not in os.environ
+
+    def test_errors_and_stop(self):
+        response = call(self.daemon.path, {'hook': 'no-such-hook'})
+        assert 'KeyError' in response['error']
+
+        response = call(self.daemon.path, {'stop': True})
+        assert response['retval'] == 0
+        self.thread.join()
+        assert not os.path.exists(self.daemon.path)
+        with self.assertRaises(NoDaemon):
+            call(self.daemon.path, {'stop': True})
@@ -0,0 +1,107 @@
+# Albumin Export Tests
+# Copyright (C) 2016 Alper Nebi Yasak
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import os
+import tarfile
+import tempfile
+from unittest import TestCase
+from unittest import mock
+
+from albumin.export import ReadAhead
+from albumin.export import write_tar
+from albumin import export
+
+
+class TestExport(TestCase):
+    def export(self, level):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            contents = {
+                'a.jpg': os.urandom(3 << 20),
+                'b.jpg': b'',
+                'c.jpg': b'small',
+            }
+            files = []
+            for name, content in sorted(contents.items()):
+                path = os.path.join(temp_dir, 'object-' + name)
+                with open(path, 'wb') as file:
+                    file.write(content)
+                files.append(('2015/' + name, path))
+            files.insert(1, ('2015/missing.jpg', temp_dir + '/missing'))
+
+            out = io.BytesIO()
+            written, missing = write_tar(files, out, level=level, threads=2)
+
+        assert written == ['2015/a.jpg', '2015/b.jpg', '2015/c.jpg']
+        assert missing == ['2015/missing.jpg']
+
+        out.seek(0)
+        with tarfile.open(fileobj=out) as tar:
+            assert tar.getnames() == written
+            for name in written:
+                content = tar.extractfile(name).read()
+                assert content == contents[os.path.basename(name)]
+
+    def test_gzip(self):
+        self.export(level=1)
+
+    def test_uncompressed(self):
+        self.export(level=0)
+
+    def files(self, temp_dir, contents):
+        files = []
+        for name, content in contents:
+            path = os.path.join(temp_dir, name)
+            with open(path, 'wb') as file:
+                file.write(content)
+            files.append((name, path))
+        return files
+
+    def test_read_sizes(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            files = self.files(temp_dir, [
+                ('a.jpg', b'a' * 1000), ('b.jpg', b'b' * 10),
+                ('c.jpg', b'c' * 100),
+            ])
+            reads = []
+            for name, stat, reader in ReadAhead(files, chunk_size=64):
+                if name == 'b.jpg':
+                    continue
+                reads.append((
+                    name, reader.read(7), reader.read(300), reader.read(),
+                    reader.read(5),
+                ))
+
+        assert reads == [
+            ('a.jpg', b'a' * 7, b'a' * 300, b'a' * 693, b''),
+            ('c.jpg', b'c' * 7, b'c' * 93, b'', b''),
+        ]
+
+    def test_size_changed(self):
+        for delta in [-1, 1]:
+            def fstat(fd, fstat=os.fstat):
+                stat = fstat(fd)
+                return os.stat_result(
+                    stat[:6] + (stat.st_size + delta,) + stat[7:]
+                )
+
+            with tempfile.TemporaryDirectory() as temp_dir:
+                files = self.files(temp_dir, [
+                    ('a.jpg', b'a' * 1000), ('b.jpg', b'b'),
+                ])
+                with mock.patch.object(export.os, 'fstat', fstat):
+                    with self.assertRaisesRegex(OSError, 'while exporting'):
+                        write_tar(files, io.BytesIO(), level=0)
@@ -0,0 +1,73 @@
+# Albumin Hasher Tests
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import hashlib
+import tempfile
+from unittest import TestCase
+
+from albumin.hasher import Hasher
+from albumin.hasher import key_extension
+
+
+class TestHasher(TestCase):
+    def test_key_extension(self):
+        cases = {
+            'IMG_0001.JPG': '.JPG',
+            'backup.tar.gz': '.tar.gz',
+            'a.b.c.jpg': '.c.jpg',
+            'video.mpeg4': '',
+            'clip.final.mp4': '.mp4',
+            'photo.ed.it.jpg': '.it.jpg',
+            'odd.jp g': '',
+            'x.fünf.jpg': '.jpg',
+            'x.ü.jpg': '.ü.jpg',
+            '.hidden': '',
+            '.hidden.jpg': '.jpg',
+            '.jpg': '.jpg',
+            '.a.jpg': '.a.jpg',
+            'noext': '',
+            'dots..jpg': '.jpg',
+        }
+        for name, extension in cases.items():
+            with self.subTest(name=name):
+                assert key_extension('/some.dir/' + name) == extension
+        assert key_extension('clip.mpeg4', max_length=5) == '.mpeg4'
+
+    def test_keys(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            contents = [os.urandom(n) for n in (0, 1, 4095, 3 << 20)]
+            paths = []
+            for num, content in enumerate(contents * 5):
+                path = os.path.join(temp_dir, '{}.jpg'.format(num))
+                with open(path, 'wb') as file:
+                    file.write(content)
+                paths.append(path)
+
+            keys = Hasher(threads=3, block_size=4096).keys(paths)
+            plain = Hasher('SHA256', threads=1).keys(paths[:4])
+
+        assert [path for path, _ in keys] == paths
+        for (path, key), content in zip(keys, contents * 5):
+            digest = hashlib.sha256(content).hexdigest()
+            assert key == 'SHA256E-s{}--{}.jpg'.format(len(content), digest)
+        for (_, key), content in zip(plain, contents):
+            digest = hashlib.sha256(content).hexdigest()
+            assert key == 'SHA256-s{}--{}'.format(len(content), digest)
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            Hasher('WORM')
@@ -0,0 +1,71 @@
+# Albumin Git Hooks Tests
+# Copyright (C) 2016 Alper Nebi Yasak
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+from unittest import TestCase
+from unittest import mock
+
+from albumin.hooks import head_ref
+from albumin.hooks import plain_branch
+from albumin.hooks import annex_branch
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file:
+        file.write(content)
+
+
+class TestHeadRef(TestCase):
+    def setUp(self):
+        self.env = mock.patch.dict(os.environ)
+        self.env.start()
+        os.environ.pop('GIT_DIR', None)
+
+    def tearDown(self):
+        self.env.stop()
+
+    def test_head_ref(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            write(os.path.join(temp_dir, '.git', 'HEAD'),
+                  'ref: refs/heads/views/a\n')
+            sub_dir = os.path.join(temp_dir, 'a', 'b')
+            os.makedirs(sub_dir)
+            assert head_ref(temp_dir) == 'refs/heads/views/a'
+            assert head_ref(sub_dir) == 'refs/heads/views/a'
+
+    def test_detached_and_gitdir_file(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            write(os.path.join(temp_dir, 'real', 'HEAD'), 'abc123\n')
+            write(os.path.join(temp_dir, 'work', '.git'), 'gitdir: ../real\n')
+            assert head_ref(os.path.join(temp_dir, 'work')) == 'abc123'
+
+    def test_git_dir_env(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            write(os.path.join(temp_dir, 'HEAD'), 'ref: refs/heads/git-annex')
+            os.environ['GIT_DIR'] = temp_dir
+            assert head_ref('/') == 'refs/heads/git-annex'
+
+    def test_branches(self):
+        assert plain_branch('refs/heads/master')
+        assert not plain_branch('refs/heads/git-annex')
+        assert not plain_branch('refs/heads/views/a')
+        assert not plain_branch('abc123')
+        assert annex_branch('refs/heads/git-annex')
+        assert annex_branch('refs/heads/views/a')
+        assert not annex_branch('refs/heads/master')
+        assert not annex_branch(None)
@@ -16,11 +16,14 @@
 
 import os
 from unittest import TestCase
+from unittest import mock
 from tests.utils import with_folder
 from datetime import datetime
 
 from albumin.imdate import from_exif
 from albumin.imdate import analyze_date
+from albumin.imdate import ImageDate
+from albumin.imdate import registry
 
 
 class TestImageDates(TestCase):
@@ -42,3 +45,17 @@ class TestImageDates(TestCase):
 
         results, remaining = analyze_date(a, b, c)
         assert remaining
+
+    def test_skip_unbeatable_extractors(self):
+        trusted = ImageDate('Manual/Trusted', datetime(2015, 1, 1))
+        unix = ImageDate('Filename/UNIX', datetime(2015, 1, 1))
+        floors = {'IMG_20150601_102030.jpg': trusted, '1433154030.jpg': unix}
+
+        exiftool = registry.extractors['exiftool']
+        with mock.patch.object(exiftool, 'func', return_value={}) as exif:
+            report = analyze_date(*floors, 'other.jpg', floors=floors)
+
+        (*paths,), _ = exif.call_args
+        assert set(paths) == {'1433154030.jpg', 'other.jpg'}
+        assert set(report.additions) == {'1433154030.jpg'}
+        assert 'IMG_20150601_102030.jpg' in report.remaining
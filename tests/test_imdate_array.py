@@ -0,0 +1,98 @@
+# Albumin Image Date Array Tests
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import random
+from collections import OrderedDict
+from datetime import datetime
+from datetime import timedelta
+from unittest import TestCase
+from unittest import mock
+
+import pytz
+
+from albumin.imdate import ImageDate
+from albumin.imdate import merge_imdates
+from albumin.imdate import merge_key_imdates
+from albumin.imdate_array import ImageDateArray
+from albumin import imdate_array
+
+methods = ['Manual/Trusted', 'ExifTool/EXIF/DateTimeOriginal',
+           'Filename/UNIX', 'ExifTool/File/FileModifyDate']
+zones = [None, 'UTC', 'Europe/Istanbul', 'America/New_York']
+
+
+def random_imdate(rand, times):
+    imdate = ImageDate(rand.choice(methods), rand.choice(times))
+    imdate.timezone = rand.choice(zones)
+    return imdate
+
+
+def merge_objects(key_data):
+    try:
+        return {key: merge_imdates(f) for key, f in key_data.items()}
+    except RuntimeError as err:
+        return err.args
+
+
+class TestImageDateArray(TestCase):
+    @mock.patch.object(imdate_array, 'threshold', 0)
+    def test_merge_matches_objects(self):
+        rand = random.Random(4)
+        base = datetime(2015, 3, 29, 3, 30)
+        for _ in range(200):
+            times = [base + timedelta(microseconds=rand.randrange(3))
+                     for _ in range(2)]
+            key_data = OrderedDict()
+            for i in range(rand.randrange(1, 40)):
+                key = 'k{}'.format(rand.randrange(8))
+                key_data.setdefault(key, []).append(
+                    ('f{}'.format(i), random_imdate(rand, times))
+                )
+
+            expected = merge_objects(key_data)
+            try:
+                merged = merge_key_imdates(key_data)
+            except RuntimeError as err:
+                merged = err.args
+            if isinstance(expected, tuple):
+                assert merged[0] == expected[0]
+                assert merged[1] is expected[1]
+                assert merged[2] is expected[2]
+            else:
+                assert list(merged) == list(key_data)
+                assert all(merged[k] is expected[k] for k in expected)
+
+    def test_utc_names(self):
+        tz = pytz.timezone('Europe/Istanbul')
+        imdates = [
+            ImageDate('Filename/UNIX', tz.localize(datetime(2015, 6, 1, 2))),
+            ImageDate('Filename/UNIX', datetime(999, 1, 2, 3, 4, 5, 6)),
+            ImageDate('Filename/UNIX', datetime(1969, 12, 31, 23, 59, 59, 9)),
+            ImageDate('Filename/UNIX', datetime(2015, 6, 1)),
+        ]
+        imdates[1].timezone = 'UTC'
+        imdates[2].timezone = 'UTC'
+        exts = ['.jpg', '.png', '', '.mp4']
+
+        array = ImageDateArray.from_imdates(imdates, ImageDate.methods)
+        names = array.utc_names(exts)
+        expected = [
+            '{:%Y%m%dT%H%M%SZ}{{:02}}{}'.format(
+                imdate.datetime.astimezone(pytz.utc), ext,
+            )
+            for imdate, ext in zip(imdates[:3], exts)
+        ]
+        assert names == expected + [None]
@@ -0,0 +1,129 @@
+# Albumin Native Import Tests
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+from unittest import TestCase
+from unittest import mock
+
+import pygit2
+
+from albumin.hasher import Hasher
+from albumin.ingest import Ingester
+from albumin.session import ImportSession
+from albumin import ingest
+
+
+class Repo(pygit2.Repository):
+    def abs_path(self, path):
+        return os.path.join(self.workdir, path)
+
+    def state_path(self, *parts):
+        path = os.path.join(self.path, 'albumin', *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def ingester(self, keep=False):
+        return Ingester(self, Hasher('SHA256E', threads=2), keep=keep)
+
+
+def object_paths(self, keys):
+    return {
+        key: os.path.join(self.annex_dir, 'objects', key, key)
+        for key in keys
+    }
+
+
+class TestIngester(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        pygit2.init_repository(os.path.join(self.temp_dir.name, 'repo'))
+        self.repo = Repo(os.path.join(self.temp_dir.name, 'repo'))
+        self.source = os.path.join(self.temp_dir.name, 'card')
+        self.paths = []
+        for name, data in [('a.jpg', b'a'), ('b.jpg', b'b'),
+                           ('sub/c.jpg', b'a')]:
+            path = os.path.join(self.source, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file:
+                file.write(data * 1000)
+            self.paths.append(path)
+
+        patches = [
+            mock.patch.object(Ingester, 'object_paths', object_paths),
+            mock.patch.object(Ingester, 'set_present'),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_move(self):
+        inode = os.stat(self.paths[0]).st_ino
+        objects = self.repo.ingester().ingest(self.paths)
+
+        assert not any(map(os.path.exists, self.paths))
+        key, object_path = objects[self.paths[0]]
+        assert objects[self.paths[2]] == (key, object_path)
+        assert os.stat(object_path).st_ino == inode
+        assert not os.stat(object_path).st_mode & 0o222
+        with open(object_path, 'rb') as file:
+            assert file.read() == b'a' * 1000
+
+    def test_keep(self):
+        inode = os.stat(self.paths[0]).st_ino
+        with mock.patch.object(ingest, 'reflink', side_effect=OSError):
+            objects = self.repo.ingester(keep=True).ingest(self.paths)
+
+        assert all(map(os.path.exists, self.paths))
+        key, object_path = objects[self.paths[0]]
+        assert os.stat(object_path).st_ino != inode
+        assert key == Hasher('SHA256E').key(self.paths[0])
+
+    def test_objects_hashed(self):
+        ingester = self.repo.ingester()
+        with mock.patch.object(ingester.hasher, 'keys',
+                               wraps=ingester.hasher.keys) as keys:
+            objects = ingester.ingest(self.paths)
+
+        (hashed,), _ = keys.call_args
+        assert all(path.startswith(ingester.tmp_dir) for path in hashed)
+        assert [os.path.basename(path) for path in hashed] == \
+            ['a.jpg', 'b.jpg', 'c.jpg']
+        for key, object_path in objects.values():
+            assert os.path.basename(object_path) == key
+        assert os.listdir(ingester.tmp_dir) == []
+
+    def test_session(self):
+        dotfile = os.path.join(self.source, '.thumbs', 'a.jpg')
+        os.makedirs(os.path.dirname(dotfile))
+        with open(dotfile, 'wb') as file:
+            file.write(b'thumbnail')
+
+        session = ImportSession(self.repo, self.source)
+        os.makedirs(self.repo.abs_path(session.folder))
+        files = session.native_import(self.repo.ingester())
+        assert len(files) == 3 and os.path.exists(dotfile)
+
+        index = pygit2.Index(session.index_path)
+        assert sorted(entry.path for entry in index) == sorted(files)
+        for file, key in files.items():
+            assert file.startswith(session.folder + '/card/')
+            assert os.readlink(self.repo.abs_path(file)).endswith(key)
+            with open(self.repo.abs_path(file), 'rb') as link:
+                assert len(link.read()) == 1000
@@ -0,0 +1,90 @@
+# Albumin Layout Tests
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+
+import pygit2
+
+from albumin.layout import Layout
+from albumin.layout import relayout_tree
+from albumin.views import update_tree
+
+
+class TestLayout(TestCase):
+    def test_names(self):
+        utc = datetime(2015, 6, 1, 10, 20, 30)
+        assert Layout().name(utc, '.jpg') == '20150601T102030Z{:02}.jpg'
+        assert Layout('YYYY/MM/').name(utc, '.jpg') == \
+            '2015/06/20150601T102030Z{:02}.jpg'
+        assert Layout('YYYY/YYYY-MM-DD/').depth == 2
+        assert Layout('YYYY/YYYY-MM-DD/').place('20150601T102030Z00') == \
+            '2015/2015-06-01/20150601T102030Z00'
+
+        for pattern in ['YYYY', '/YYYY/', 'YYYY//MM/', '../YYYY/', '{}/']:
+            with self.assertRaises(ValueError):
+                Layout(pattern)
+
+    def test_path(self):
+        layout = Layout('YYYY/MM/')
+        assert layout.path('20150601T102030Z03.jpg') == \
+            '2015/06/20150601T102030Z03.jpg'
+        assert layout.path('2014/12/20150601T102030Z03.jpg') == \
+            '2015/06/20150601T102030Z03.jpg'
+        assert layout.path('IMG_0001.JPG') is None
+        assert Layout().path('2015/06/20150601T102030Z00') == \
+            '20150601T102030Z00'
+
+    def test_relayout_tree(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            repo = pygit2.init_repository(temp_dir, bare=True)
+
+            def link(key, depth=0):
+                target = '../' * depth + '.git/annex/objects/{0}/{0}'
+                blob = repo.create_blob(target.format(key).encode())
+                return blob, pygit2.GIT_FILEMODE_LINK
+
+            tree = repo[update_tree(repo, None, {
+                '20150601T102030Z00.jpg': link('A'),
+                '20150601T102030Z01.jpg': link('B'),
+                'x/20150601T102030Z01.jpg': link('C', 1),
+                'IMG_0001.JPG': link('D'),
+                'notes.txt': (repo.create_blob(b'notes'),
+                              pygit2.GIT_FILEMODE_BLOB),
+            })]
+
+            tree_id, moved, left = relayout_tree(
+                repo, tree, Layout('YYYY/MM/'),
+            )
+            tree = repo[tree_id]
+            assert len(moved) == 2
+            assert left == [(
+                'x/20150601T102030Z01.jpg', '2015/06/20150601T102030Z01.jpg',
+            )]
+            assert repo[tree['2015/06/20150601T102030Z00.jpg'].id].data == \
+                b'../../.git/annex/objects/A/A'
+            assert 'x/20150601T102030Z01.jpg' in tree
+            assert 'IMG_0001.JPG' in tree and 'notes.txt' in tree
+            assert '20150601T102030Z00.jpg' not in tree
+
+            # Back to the root, where the file left in x/ now fits.
+            tree_id, moved, left = relayout_tree(repo, tree, Layout())
+            tree = repo[tree_id]
+            assert len(moved) == 2 and len(left) == 1
+            assert repo[tree['20150601T102030Z01.jpg'].id].data == \
+                b'.git/annex/objects/B/B'
+            assert '2015' not in tree
@@ -0,0 +1,155 @@
+# Albumin Metadata Store Tests
+# Copyright (C) 2016 Alper Nebi Yasak
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest import TestCase
+from unittest import mock
+
+import pygit2
+
+from tests.utils import MemoryBackend
+
+from albumin.metastore import SQLiteBackend
+from albumin.metastore import branch_file_key
+from albumin.metastore import journal_file_key
+
+
+class TestMetadataStore(TestCase):
+    def test_branch_file_key(self):
+        name = 'SHA256E-s0--e3b0c44298fc1c149afbf4c8996fb924.txt.log.met'
+        assert branch_file_key(name) == \
+            'SHA256E-s0--e3b0c44298fc1c149afbf4c8996fb924.txt'
+        assert branch_file_key('URL--http&c%%a&ab&sc.log.met') == \
+            'URL--http://a&b%c'
+
+    def test_journal_file_key(self):
+        name = '1a2_3b4_WORM-s3-m1--my__photo.jpg.log.met'
+        assert journal_file_key(name) == 'WORM-s3-m1--my_photo.jpg'
+
+
+class TestSQLiteBackend(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.repo = pygit2.init_repository(self.temp_dir.name)
+        self.source = MemoryBackend()
+        self.loads = mock.patch.object(
+            self.source, 'fields', wraps=self.source.fields,
+        ).start()
+        self.addCleanup(mock.patch.stopall)
+        self.annex = {}
+        for key in ['SHA256E-s1--a.jpg', 'SHA256E-s1--b.jpg']:
+            self.annex[key] = SimpleNamespace(key=key)
+            self.source.data[key] = {'tag': ['x'], 'year': ['2015']}
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def store(self, write_through=True):
+        return SQLiteBackend(
+            self.repo, os.path.join(self.repo.path, 'metadata.db'),
+            source=self.source, write_through=write_through,
+        )
+
+    def test_get_caches(self):
+        store = self.store()
+        metadata = self.annex['SHA256E-s1--a.jpg']
+        assert store.get(metadata, 'tag') == ['x']
+        assert store.get(metadata, 'year') == ['2015']
+        assert store.fields(metadata) == {'tag': ['x'], 'year': ['2015']}
+        assert self.loads.call_count == 1
+
+    def test_write_through(self):
+        store = self.store(write_through=True)
+        metadata = self.annex['SHA256E-s1--a.jpg']
+        store.get(metadata, 'tag')
+        store.set(metadata, 'tag', ['y', 'z'])
+
+        assert self.source.data[metadata.key]['tag'] == ['y', 'z']
+        assert sorted(store.get(metadata, 'tag')) == ['y', 'z']
+        assert self.loads.call_count == 1
+
+    def test_read_through(self):
+        store = self.store(write_through=False)
+        metadata = self.annex['SHA256E-s1--a.jpg']
+        store.get(metadata, 'tag')
+        store.set(metadata, 'tag', ['y'])
+
+        assert not store.cached(metadata.key)
+        assert store.get(metadata, 'tag') == ['y']
+        assert self.loads.call_count == 2
+
+    def test_invalidate(self):
+        store = self.store()
+        for metadata in self.annex.values():
+            store.get(metadata, 'tag')
+        self.source.data['SHA256E-s1--a.jpg']['tag'] = ['changed']
+
+        store.invalidate('SHA256E-s1--a.jpg')
+        assert not store.cached('SHA256E-s1--a.jpg')
+        assert store.cached('SHA256E-s1--b.jpg')
+        assert store.sync(self.annex) == 1
+        assert store.get(self.annex['SHA256E-s1--a.jpg'], 'tag') == \
+            ['changed']
+
+        store.invalidate()
+        assert not any(map(store.cached, self.annex))
+        assert store.sync(self.annex) == 0
+
+    def test_refresh_journal(self):
+        store = self.store()
+        for metadata in self.annex.values():
+            store.get(metadata, 'tag')
+
+        journal = os.path.join(self.repo.path, 'annex', 'journal')
+        os.makedirs(journal)
+        open(os.path.join(journal, 'SHA256E-s1--b.jpg.log.met'), 'w').close()
+        store.refresh()
+
+        assert store.cached('SHA256E-s1--a.jpg')
+        assert not store.cached('SHA256E-s1--b.jpg')
+
+    def test_refresh_branch(self):
+        store = self.store()
+        for metadata in self.annex.values():
+            store.get(metadata, 'tag')
+        store.set_state('complete', '1')
+
+        tree = self.repo.TreeBuilder().write()
+        signature = pygit2.Signature('Albumin', 'albumin@localhost')
+        self.repo.create_commit(
+            'refs/heads/git-annex', signature, signature, 'branch', tree, [],
+        )
+        store.refresh()
+
+        assert not any(map(store.cached, self.annex))
+        assert not store.complete()
+        assert store.state('git-annex') == store.branch_head()
+
+    def test_threads(self):
+        store = self.store()
+        keys = sorted(self.annex) * 50
+
+        def get(key):
+            return store.get(self.annex[key], 'tag'), id(store.db)
+
+        with ThreadPoolExecutor(4) as pool:
+            results = list(pool.map(get, keys))
+
+        assert all(values == ['x'] for values, _ in results)
+        assert id(store.db) not in {db for _, db in results}
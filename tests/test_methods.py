@@ -0,0 +1,120 @@
+# Albumin Method Registry Tests
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from datetime import datetime
+from types import SimpleNamespace
+from unittest import TestCase
+from unittest import mock
+
+from albumin.imdate import ImageDate
+from albumin.imdate import Report
+from albumin.imdate import analyze_date
+from albumin.imdate import registry
+from albumin.methods import Extractor
+from albumin.methods import MethodRegistry
+from albumin import imdate
+from albumin import methods
+
+
+class TestMethodRegistry(TestCase):
+    def test_ranks(self):
+        registry_ = MethodRegistry()
+        registry_.add_method('B', rank=200)
+        registry_.add_method('A', rank=100)
+        registry_.add_method('AB', rank=150)
+        assert registry_.methods == ['A', 'AB', 'B']
+
+        with self.assertRaises(ValueError):
+            registry_.add_method('A', rank=300)
+        with self.assertRaises(ValueError):
+            registry_.add_extractor('x', print, ['C'])
+
+    def test_plugins(self):
+        def register(registry_):
+            registry_.add_method('Plugin/Date', rank=50)
+            registry_.add_extractor('plugin', dict, ['Plugin/Date'])
+
+        entry_point = SimpleNamespace(load=lambda: register)
+        registry_ = MethodRegistry()
+        with mock.patch.object(methods, 'entry_points',
+                               return_value=[entry_point]):
+            scheduled = registry_.schedule()
+            registry_.schedule()
+
+        assert [e.name for e in scheduled] == ['plugin']
+        assert registry_.methods == ['Plugin/Date']
+
+    def test_plugin_lookup(self):
+        def register(registry_):
+            registry_.add_method('Plugin/Date', rank=50)
+
+        entry_point = SimpleNamespace(load=lambda: register)
+        registry_ = MethodRegistry()
+        registry_.add_method('Manual/Trusted', rank=100)
+        lines = [
+            '[K+] SHA256E-s1--00.jpg',
+            '[ F] :: IMG_1.jpg',
+            '[ T] :: 2015-06-01 10:20:30 @ (UTC) (Plugin/Date)',
+        ]
+        with mock.patch.object(imdate, 'registry', registry_), \
+                mock.patch.object(methods, 'entry_points',
+                                  return_value=[entry_point]):
+            report = Report.parse(lines)
+            _, new = report.additions['IMG_1.jpg']
+            assert new.method == 'Plugin/Date'
+            assert ImageDate.outranks('Plugin/Date', ImageDate(
+                'Manual/Trusted', datetime(2015, 1, 1),
+            ))
+
+    def test_schedule(self):
+        def from_name(*paths, **_):
+            return {
+                path: ImageDate('Filename/I9100/IMG', datetime(2015, 1, 1))
+                for path in paths if path.startswith('IMG')
+            }
+
+        def from_sidecar(*paths, **_):
+            return {
+                path: ImageDate('Manual/Trusted', datetime(2015, 1, 2))
+                for path in paths
+            }
+
+        expensive = mock.Mock(return_value={})
+        extractors = registry.extractors
+        with mock.patch.object(registry, 'extractors', extractors.copy()), \
+                mock.patch.object(registry, 'timings', {}), \
+                mock.patch.object(registry, 'plugins_loaded', True):
+            registry.extractors['exiftool'] = Extractor(
+                'exiftool', expensive, ['ExifTool/EXIF/DateTimeOriginal'],
+                cost=100,
+            )
+            registry.add_extractor(
+                'sidecar', from_sidecar, ['Manual/Trusted'],
+                extensions=['.JPG'], cost=10,
+            )
+            registry.add_extractor(
+                'filename', from_name, ['Filename/I9100/IMG'], cost=1,
+            )
+            report = analyze_date('IMG_1.jpg', 'other.jpg', 'IMG_2.mp4')
+            assert registry.timings['sidecar'][0] >= 2
+
+        (*paths,), _ = expensive.call_args
+        assert paths == ['IMG_2.mp4']
+        assert report.additions['IMG_1.jpg'][1].method == 'Manual/Trusted'
+        assert report.additions['other.jpg'][1].method == 'Manual/Trusted'
+        assert report.additions['IMG_2.mp4'][1].method == \
+            'Filename/I9100/IMG'
+        assert 'sidecar' not in registry.timings
@@ -0,0 +1,99 @@
+# Albumin Partial Report Tests
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import os
+import hashlib
+import tempfile
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from unittest import TestCase
+from unittest import mock
+
+import pytz
+
+from albumin.imdate import ImageDate
+from albumin.imdate import registry
+from albumin.partial import PartialReportError
+from albumin.partial import read_partial
+from albumin.partial import write_partial
+
+
+class TestPartial(TestCase):
+    def test_imdate_dump(self):
+        imdate = ImageDate('Filename/UNIX', datetime(2015, 3, 29, 3, 30))
+        assert ImageDate.load(imdate.dump()).datetime == imdate.datetime
+
+        imdate.timezone = 'Europe/Istanbul'
+        loaded = ImageDate.load(imdate.dump())
+        assert loaded.method == imdate.method
+        assert loaded.datetime == imdate.datetime
+        assert loaded.datetime.utcoffset() == imdate.datetime.utcoffset()
+
+    def test_imdate_dump_fall_back(self):
+        tz = pytz.timezone('Europe/Berlin')
+        wall = datetime(2015, 10, 25, 2, 30, 15, 250000)
+        for is_dst in (True, False):
+            imdate = ImageDate('Filename/UNIX', tz.localize(wall, is_dst))
+            loaded = ImageDate.load(imdate.dump())
+            assert loaded.datetime == imdate.datetime
+            assert loaded.datetime.utcoffset() == \
+                imdate.datetime.utcoffset()
+            assert loaded.timezone == imdate.timezone
+
+        offset = timezone(timedelta(hours=5, minutes=30))
+        imdate = ImageDate('Filename/UNIX', datetime(2015, 1, 1, tzinfo=offset))
+        loaded = ImageDate.load(imdate.dump())
+        assert loaded.datetime == imdate.datetime
+        assert loaded.datetime.utcoffset() == timedelta(hours=5, minutes=30)
+
+    @mock.patch.object(registry.extractors['exiftool'], 'func',
+                       lambda *paths, **_: {})
+    def test_round_trip(self):
+        tz = pytz.timezone('Europe/Istanbul')
+        out = io.StringIO()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for name in ('IMG_20150601_102030.jpg', 'unknown.jpg'):
+                with open(os.path.join(temp_dir, name), 'w') as file:
+                    file.write(name)
+            count = write_partial(
+                temp_dir, out, timezone=tz, host='nas1', chunk_size=1,
+            )
+
+        assert count == 2
+        out.seek(0)
+        header, entries = read_partial(out)
+        assert header['host'] == 'nas1'
+        assert header['backend'] == 'SHA256E'
+
+        entries = {file: (key, imdate) for file, key, imdate in entries}
+        dated = 'nas1:' + os.path.join(temp_dir, 'IMG_20150601_102030.jpg')
+        undated = 'nas1:' + os.path.join(temp_dir, 'unknown.jpg')
+        assert set(entries) == {dated, undated}
+
+        key, imdate = entries[dated]
+        digest = hashlib.sha256(b'IMG_20150601_102030.jpg').hexdigest()
+        assert key == 'SHA256E-s23--{}.jpg'.format(digest)
+        assert imdate.method == 'Filename/I9100/IMG'
+        assert imdate.datetime == tz.localize(datetime(2015, 6, 1, 10, 20, 30))
+        assert entries[undated][1] is None
+
+    def test_not_partial(self):
+        with self.assertRaises(PartialReportError):
+            read_partial(['[K+] SHA256E-s1--a.jpg'])
+        with self.assertRaises(PartialReportError):
+            read_partial([])
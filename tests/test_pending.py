@@ -0,0 +1,104 @@
+# Albumin Pending Report Tests
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import os
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+from unittest import mock
+
+from albumin.imdate import ImageDate
+from albumin.imdate import Report
+from albumin.pending import PendingQueue
+
+
+def make_report(n):
+    key = 'SHA256E-s{0}--{0}.jpg'.format(n)
+    imdate = ImageDate('Filename/UNIX', datetime(2015, 1, n))
+    imdate.timezone = 'UTC'
+    return Report({key: key}, {key: (imdate, None)}, set())
+
+
+class TestPendingQueue(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.queue = PendingQueue(os.path.join(self.temp_dir.name, 'queue'))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_round_trip(self):
+        self.queue.add(make_report(1), commit='abc', source='phone')
+        (job_path,) = self.queue.jobs()
+        commit, report, tags = self.queue.load(job_path)
+
+        assert commit == 'abc'
+        assert tags == {'source': 'phone'}
+        assert list(report.short()) == list(make_report(1).short())
+        assert not [n for n in os.listdir(self.queue.path) if n[0] == '.']
+
+    def test_drain_in_order(self):
+        for n in range(1, 6):
+            self.queue.add(make_report(n), commit=str(n))
+
+        applied = []
+        count = self.queue.drain(
+            lambda report, **_: applied.extend(report.files), batch_size=2,
+        )
+        assert count == 5
+        assert applied == ['SHA256E-s{0}--{0}.jpg'.format(n)
+                           for n in range(1, 6)]
+        assert len(self.queue) == 0
+
+    def test_failed_job_quarantined(self):
+        for n in range(1, 4):
+            self.queue.add(make_report(n), commit=str(n))
+        with open(os.path.join(self.queue.path, '0-bad.json'), 'w') as file:
+            file.write('not json')
+
+        applied = []
+
+        def apply(report, **tags):
+            if 'SHA256E-s2--2.jpg' in report.files:
+                raise RuntimeError('bad report')
+            applied.extend(report.files)
+
+        with mock.patch('sys.stderr', io.StringIO()):
+            assert self.queue.drain(apply) == 2
+        assert applied == ['SHA256E-s1--1.jpg', 'SHA256E-s3--3.jpg']
+        assert len(self.queue) == 0
+        failed = self.queue.failed()
+        assert [os.path.basename(path)[0] for path in failed] == ['0', '1']
+        with open(failed[1] + '.error') as file:
+            assert 'bad report' in file.read()
+
+        assert self.queue.retry() == 2
+        assert len(self.queue) == 2 and not self.queue.failed()
+        with mock.patch('sys.stderr', io.StringIO()):
+            self.queue.drain(apply)
+        assert self.queue.drop() == 2
+        assert not self.queue.failed()
+        assert os.listdir(self.queue.failed_path) == []
+
+    def test_drain_without_waiting(self):
+        self.queue.add(make_report(1))
+        other = PendingQueue(self.queue.path)
+
+        with self.queue.locked() as acquired:
+            assert acquired
+            assert other.drain(lambda report, **_: None, wait=False) == 0
+        assert other.drain(lambda report, **_: None, wait=False) == 1
@@ -0,0 +1,153 @@
+# Albumin Perceptual Hash Tests
+# Copyright (C) 2016 Alper Nebi Yasak
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import random
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+from unittest import mock
+from unittest import skipUnless
+
+from tests.utils import memory_repo
+
+from albumin.imdate import ImageDate
+from albumin.imdate import Report
+from albumin.phash import PerceptualIndex
+from albumin.phash import dhash
+from albumin import phash
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+def make_index(count, seed=0):
+    rng = random.Random(seed)
+    index = PerceptualIndex()
+    hashes = [rng.getrandbits(64) for _ in range(count)]
+    for num, hash_ in enumerate(hashes):
+        index.add('KEY-{}'.format(num), hash_)
+    return index, hashes
+
+
+@skipUnless(phash.numpy, 'needs numpy')
+class TestPerceptualIndex(TestCase):
+    def test_search(self):
+        index, hashes = make_index(2000)
+        query = hashes[42] ^ 0b1011
+        assert index.search(query, distance=3) == [('KEY-42', 3)]
+        assert index.search(query, distance=2) == []
+        assert index.search(hashes[7], distance=6)[0] == ('KEY-7', 0)
+
+    def test_search_matches_scan(self):
+        index, hashes = make_index(500, seed=1)
+        query = hashes[0] ^ (0xFF << 20)
+        for distance in (3, 7, 12):
+            expected = sorted(
+                (bin(h ^ query).count('1'), n)
+                for n, h in enumerate(hashes)
+                if bin(h ^ query).count('1') <= distance
+            )
+            found = index.search(query, distance=distance)
+            assert found == [('KEY-{}'.format(n), d) for d, n in expected]
+
+    def test_save_load(self):
+        index, hashes = make_index(100)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'phash.npz')
+            index.save(path)
+            loaded = PerceptualIndex.load(path)
+        assert len(loaded) == 100
+        assert loaded.keys() == {'KEY-{}'.format(n) for n in range(100)}
+        assert loaded.search(hashes[99], distance=0) == [('KEY-99', 0)]
+
+    def test_load_missing(self):
+        index = PerceptualIndex.load('/nonexistent/phash.npz')
+        assert len(index) == 0
+        assert index.search(0) == []
+
+
+@skipUnless(phash.numpy and Image, 'needs numpy and Pillow')
+class TestDHash(TestCase):
+    def test_reencoded_copy(self):
+        rng = random.Random(0)
+        image = Image.new('RGB', (64, 48))
+        image.putdata([
+            (x * 4, y * 5, rng.randrange(256))
+            for y in range(48) for x in range(64)
+        ])
+        with tempfile.TemporaryDirectory() as temp_dir:
+            original = os.path.join(temp_dir, 'original.png')
+            copy = os.path.join(temp_dir, 'copy.jpg')
+            image.save(original)
+            image.resize((32, 24)).save(copy, quality=40)
+            distance = bin(dhash(original) ^ dhash(copy)).count('1')
+        assert distance <= 8
+
+
+@skipUnless(phash.numpy, 'needs numpy')
+class TestRepoPerceptualDates(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.repo = memory_repo(os.path.join(self.temp_dir.name, 'repo'))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_only_weaker_dates(self):
+        def imdate(method):
+            return ImageDate(method, datetime(2015, 6, 1, 10))
+
+        files = {name: 'KEY-' + name for name in ['exif', 'mtime', 'none']}
+        report = Report(files, {
+            'KEY-exif': imdate('ExifTool/EXIF/DateTimeOriginal'),
+            'KEY-mtime': imdate('ExifTool/File/FileModifyDate'),
+        }, ['none'])
+        found = imdate('Perceptual/Original')
+
+        with mock.patch.object(self.repo, 'perceptual_dates',
+                               return_value={'mtime': found}) as dates:
+            self.repo.add_perceptual_dates(report, files)
+        (weaker,), _ = dates.call_args
+        assert sorted(weaker) == ['mtime', 'none']
+        assert report.additions['mtime'] == ('mtime', found)
+
+        floors = {'none': imdate('Manual/Trusted')}
+        with mock.patch.object(self.repo, 'perceptual_dates',
+                               return_value={}) as dates:
+            self.repo.add_perceptual_dates(report, files, floors=floors)
+        (weaker,), _ = dates.call_args
+        assert weaker == {}
+
+    def test_index_loaded_once(self):
+        with mock.patch.object(phash.PerceptualIndex, 'load',
+                               wraps=phash.PerceptualIndex.load) as load:
+            index = self.repo.phash_index()
+            assert self.repo.phash_index() is index
+            with mock.patch.object(self.repo, 'index_keys',
+                                   return_value=[]):
+                self.repo.update_phash_index()
+            assert self.repo.phash_index() is index
+            assert load.call_count == 1
+
+            other, _ = make_index(10)
+            path = self.repo.state_path('phash.npz')
+            other.save(path)
+            os.utime(path, ns=(0, 0))
+            assert len(self.repo.phash_index()) == 10
+            assert load.call_count == 2
@@ -0,0 +1,61 @@
+# Albumin Query Tests
+# Copyright (C) 2016 Alper Nebi Yasak
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import sqlite3
+from types import SimpleNamespace
+from unittest import TestCase
+
+from albumin.metastore import SQLiteBackend
+from albumin.query import Query
+from albumin.query import date_range
+
+
+def make_store(rows):
+    db = sqlite3.connect(':memory:')
+    db.executescript(SQLiteBackend.schema)
+    db.executemany('INSERT INTO fields VALUES (?, ?, ?)', rows)
+    return SimpleNamespace(db=db)
+
+
+class TestQuery(TestCase):
+    store = make_store([
+        ('A', 'datetime', '2015-05-16@10-22-16'),
+        ('A', 'datetime-method', 'ExifTool/EXIF/DateTimeOriginal'),
+        ('A', 'trip', 'x'),
+        ('B', 'datetime', '2015-05-20@08-00-00'),
+        ('B', 'datetime-method', 'Filename/UNIX'),
+        ('B', 'trip', 'x'),
+        ('C', 'datetime', '2015-06-01@00-00-00'),
+        ('C', 'datetime-method', 'Filename/UNIX'),
+        ('C', 'trip', 'x'),
+    ])
+
+    def keys(self, **kwargs):
+        return [key for key, _ in Query(**kwargs).run(self.store)]
+
+    def test_date_range(self):
+        assert date_range('2015') == \
+            ('2015-01-01@00-00-00', '2016-01-01@00-00-00')
+        assert date_range('2015-12') == \
+            ('2015-12-01@00-00-00', '2016-01-01@00-00-00')
+
+    def test_query(self):
+        assert self.keys(date='2015-05') == ['A', 'B']
+        assert self.keys(date='2015-05', tags={'trip': 'x'}) == ['A', 'B']
+        assert self.keys(tags={'trip': 'x'},
+                         below='ExifTool/EXIF/DateTimeOriginal') == ['B', 'C']
+        assert self.keys(since='2015-05-17', until='2015-06') == ['B', 'C']
+        assert self.keys(limit=1, offset=1) == ['B']
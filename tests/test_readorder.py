@@ -0,0 +1,72 @@
+# Albumin Read Ordering Tests
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+from unittest import TestCase
+from unittest import mock
+
+from albumin.hasher import Hasher
+from albumin import readorder
+
+
+class TestReadOrder(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.paths = []
+        for name, size in [('c', 10), ('a', 5000), ('b', 20), ('d', 6000)]:
+            path = os.path.join(self.temp_dir.name, name)
+            with open(path, 'wb') as file:
+                file.write(name.encode() * size)
+            self.paths.append(path)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_schedule(self):
+        missing = os.path.join(self.temp_dir.name, 'missing')
+        paths = self.paths + [missing]
+
+        small, large = readorder.schedule(paths, 'inode', large_size=4096)
+        assert small == sorted(
+            self.paths[::2], key=lambda p: os.stat(p).st_ino
+        ) + [missing]
+        assert large == sorted(
+            self.paths[1::2], key=lambda p: os.stat(p).st_ino
+        )
+
+        small, large = readorder.schedule(paths, 'none', large_size=4096)
+        assert small == self.paths[::2] + [missing]
+        assert large == self.paths[1::2]
+
+        small, large = readorder.schedule(paths, 'physical')
+        assert sorted(small) == sorted(paths) and not large
+
+        with self.assertRaises(ValueError):
+            readorder.schedule(paths, 'random')
+
+    def test_physical_fallback(self):
+        # Without FIEMAP, files are sorted by inode.
+        with mock.patch.object(readorder, 'physical_offset',
+                               return_value=None):
+            small, _ = readorder.schedule(self.paths, 'physical')
+        assert small == sorted(self.paths, key=lambda p: os.stat(p).st_ino)
+
+    def test_hasher_order(self):
+        hasher = Hasher('SHA256', threads=2, large_size=4096)
+        keys = hasher.keys(self.paths)
+        assert [path for path, _ in keys] == self.paths
+        assert keys == [(path, hasher.key(path)) for path in self.paths]
@@ -0,0 +1,232 @@
+# Albumin Repo Tests
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+from unittest import mock
+
+from tests.utils import add_link
+from tests.utils import memory_repo
+from tests.utils import no_exiftool
+
+from albumin.hasher import Hasher
+from albumin.imdate import ImageDate
+from albumin.imdate import registry
+from albumin.repo import timezone
+from albumin.repo import utc_datetime
+
+
+class TestAlbuminRepo(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.repo = memory_repo(os.path.join(self.temp_dir.name, 'repo'))
+        self.source = os.path.join(self.temp_dir.name, 'source')
+        os.makedirs(self.source)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write(self, name, data):
+        path = os.path.join(self.source, name)
+        with open(path, 'wb') as file:
+            file.write(data)
+        return path
+
+    def test_analyze_keys_new_files(self):
+        known = self.write('known.jpg', b'known')
+        copy = self.write('copy.jpg', b'known')
+        same_size = self.write('dated.jpg', b'other')
+        new = self.write('dated-new.jpg', b'new file')
+        undated = self.write('plain.jpg', b'plain file')
+        paths = [copy, same_size, new, undated]
+        keys = dict(Hasher('SHA256E').keys([known] + paths))
+        add_link(self.repo, 'known.jpg', keys[known], content=b'known')
+
+        with mock.patch.object(Hasher, 'key', autospec=True,
+                               side_effect=Hasher.key) as key:
+            files, new_keys = self.repo.file_keys(paths)
+        assert [path for (_, path), _ in key.call_args_list] == [copy]
+        assert files == {copy: keys[known], same_size: None, new: None,
+                         undated: None}
+        assert new_keys == set()
+
+        with no_exiftool(), \
+                mock.patch.object(Hasher, 'key', autospec=True,
+                                  side_effect=Hasher.key) as key:
+            report = self.repo.analyze_files(paths)
+        hashed = [path for (_, path), _ in key.call_args_list]
+        assert sorted(hashed) == sorted([copy, same_size, new])
+        assert report.has_keys
+        assert dict(report.files) == {
+            copy: keys[known], same_size: keys[same_size], new: keys[new],
+            undated: undated,
+        }
+        assert set(report.additions) == {same_size, new}
+        assert report.updates[keys[new]][0].method == 'Filename/Delimited'
+        assert report.remaining == {copy: keys[known], undated: undated}
+
+    def test_file_keys_same_size_new_files(self):
+        first = self.write('first.jpg', b'first')
+        copy = self.write('copy.jpg', b'first')
+        other = self.write('other.jpg', b'other')
+        missing = self.write('missing.jpg', b'a' * 9)
+        add_link(self.repo, 'absent.jpg', 'SHA256E-s9--absent.jpg')
+
+        files, new_keys = self.repo.file_keys([first, copy, other, missing])
+        keys = dict(Hasher('SHA256E').keys([first, missing]))
+        assert files == {first: keys[first], copy: keys[first],
+                         other: None, missing: keys[missing]}
+        assert new_keys == {keys[first], keys[missing]}
+
+    def test_annex_rules(self):
+        assert self.repo.ingester() is None
+        paths = ['.albumin-sessions/1/card/a.jpg']
+        assert not self.repo.annex_rules(paths)
+
+        with open(self.repo.abs_path('.gitattributes'), 'w') as file:
+            file.write('*.raw annex.backend=MD5E\n')
+        assert not self.repo.annex_rules(paths)
+        assert self.repo.annex_rules(paths + ['.albumin-sessions/1/b.raw'])
+
+        self.repo.config['annex.largefiles'] = 'largerthan=1mb'
+        self.repo.reload_config()
+        assert self.repo.annex_rules(paths)
+
+    def test_calckeys_gitattributes(self):
+        with open(self.repo.abs_path('.gitattributes'), 'w') as file:
+            file.write('*.raw annex.backend=MD5E\n*.bin annex.backend=WORM\n')
+        paths = [self.write('a.raw', b'raw')]
+        for name in ['a.jpg', 'b.raw', 'c.bin']:
+            paths.append(self.repo.abs_path(name))
+            with open(paths[-1], 'wb') as file:
+                file.write(name.encode())
+
+        with mock.patch.object(self.repo.annex, 'calckey', create=True,
+                               return_value='WORM-s5-m1--c.bin') as calckey:
+            keys = self.repo.calckeys(paths)
+
+        calckey.assert_called_once_with(paths[3])
+        assert [path for path, _ in keys] == paths
+        assert [key.split('-')[0] for _, key in keys] == \
+            ['SHA256E', 'SHA256E', 'MD5E', 'WORM']
+        assert keys[2][1] == Hasher('MD5E').key(paths[2])
+
+    def test_imdate_diff_reuses_analysis(self):
+        dated = self.write('dated.jpg', b'dated')
+        undated = self.write('plain.jpg', b'plain')
+        with no_exiftool():
+            analyzed = self.repo.analyze_files([dated, undated])
+            staged = {
+                os.path.join(self.temp_dir.name, 'staged', name): key
+                for name, key in (
+                    ('moved.jpg', analyzed.files[dated]),
+                    ('other.jpg', analyzed.files[undated]),
+                )
+            }
+            with mock.patch.object(registry, 'timed') as timed:
+                report = self.repo.imdate_diff(staged, analyzed=analyzed)
+
+        assert not timed.called
+        assert report.updates == analyzed.updates
+        assert list(report.remaining.values()) == [analyzed.files[undated]]
+
+    def test_config_cached(self):
+        assert self.repo.get_config('albumin.layout') is None
+        self.repo.config['albumin.layout'] = 'YYYY/'
+        assert self.repo.get_config('albumin.layout') is None
+        self.repo.reload_config()
+        assert self.repo.get_config('albumin.layout') == 'YYYY/'
+
+        overrides = "'albumin.layout=YYYY/MM/' 'albumin.timezone=UTC'"
+        with mock.patch.dict(os.environ, GIT_CONFIG_PARAMETERS=overrides):
+            self.repo.refresh()
+        assert self.repo.get_config('albumin.layout') == 'YYYY/MM/'
+        assert self.repo.timezone is timezone('UTC')
+
+        self.repo.timezone = 'Europe/Istanbul'
+        self.repo.config['albumin.timezone'] = 'Asia/Tokyo'
+        self.repo.refresh()
+        assert self.repo.timezone is timezone('Asia/Tokyo')
+
+    def test_metadata_values_cached(self):
+        key = 'SHA256E-s1--a.jpg'
+        backend = self.repo.annex.backend
+        backend.data[key] = {
+            'datetime': ['2015-06-01@07-20-30'],
+            'timezone': ['Europe/Istanbul'],
+            'tag': ['a'],
+        }
+        metadata = self.repo.annex[key]
+        assert self.repo.annex[key] is metadata
+
+        istanbul = timezone('Europe/Istanbul')
+        assert metadata['datetime'] == \
+            istanbul.localize(datetime(2015, 6, 1, 10, 20, 30))
+        assert metadata['tag'] == 'a'
+        reads = backend.reads
+        assert metadata['tag'] == 'a'
+        assert backend.reads == reads
+        assert 'missing' not in metadata
+        assert backend.reads == reads + 1
+        assert 'missing' not in metadata
+        assert backend.reads == reads + 1
+
+        metadata['timezone'] = timezone('UTC')
+        assert metadata['datetime'].tzinfo is timezone('UTC')
+        assert metadata['datetime'].hour == 7
+
+        del metadata['tag']
+        assert 'tag' not in metadata
+        imdate = ImageDate('Manual/Trusted', datetime(2016, 1, 2, 3, 4, 5))
+        imdate.timezone = 'UTC'
+        metadata.imdate = imdate
+        assert metadata.imdate.datetime == utc_datetime('2016-01-02@03-04-05')
+        assert metadata['year'] == '2016'
+
+        assert 'tag' not in metadata
+        backend.data[key]['tag'] = ['b']
+        assert 'tag' not in metadata
+        self.repo.annex.invalidate(key)
+        assert self.repo.annex[key] is not metadata
+        assert self.repo.annex[key]['tag'] == 'b'
+
+        backend.data[key]['tag'] = ['c']
+        metadata = self.repo.annex[key]
+        self.repo.refresh()
+        assert self.repo.annex[key] is not metadata
+        assert self.repo.annex[key]['tag'] == 'c'
+
+    def test_metadata_cache_bounded(self):
+        keys = ['SHA256E-s1--{}.jpg'.format(i) for i in range(4)]
+        with mock.patch.object(self.repo.annex, 'cache_size', 2):
+            first = self.repo.annex[keys[0]]
+            self.repo.annex[keys[1]]
+            assert self.repo.annex[keys[0]] is first
+            self.repo.annex[keys[2]]
+            assert list(self.repo.annex._metadata) == [keys[0], keys[2]]
+            self.repo.annex[keys[3]]
+            assert list(self.repo.annex._metadata) == [keys[2], keys[3]]
+            assert self.repo.annex[keys[0]] is not first
+
+    def test_parse_caches(self):
+        assert timezone('Europe/Istanbul') is timezone('Europe/Istanbul')
+        value = utc_datetime('2015-06-01@07-20-30')
+        assert utc_datetime('2015-06-01@07-20-30') is value
+        assert value == timezone('UTC').localize(
+            datetime(2015, 6, 1, 7, 20, 30)
+        )
@@ -0,0 +1,204 @@
+# Albumin Import Session Tests
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest import TestCase
+from unittest import mock
+
+import pygit2
+
+from tests.utils import memory_repo
+from tests.utils import no_exiftool
+
+from albumin.ingest import Ingester
+from albumin.session import ImportSession
+
+
+class Repo(pygit2.Repository):
+    annex = SimpleNamespace(lookupkey=lambda path: None)
+
+    def abs_path(self, path):
+        return os.path.join(self.workdir, path)
+
+    def state_path(self, *parts):
+        path = os.path.join(self.path, 'albumin', *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def use_phash(self, phash=False):
+        return False
+
+
+def imported(repo, files):
+    session = ImportSession(repo, '/media/card')
+    for name, key in files:
+        file = '{}/card/{}'.format(session.folder, name)
+        os.makedirs(os.path.dirname(repo.abs_path(file)), exist_ok=True)
+        target = '../../../.git/annex/objects/{0}/{0}'.format(key)
+        os.symlink(target, repo.abs_path(file))
+        session.files[file] = key
+        session.names[file] = '20150601T102030Z{:02}.jpg'
+    return session
+
+
+def object_paths(self, keys):
+    return {
+        key: os.path.join(self.annex_dir, 'objects', key, key)
+        for key in keys
+    }
+
+
+class TestImportSession(TestCase):
+    def test_name_slots(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            pygit2.init_repository(temp_dir)
+            repo = Repo(temp_dir)
+            first = imported(repo, [('a.jpg', 'KEY1'), ('b.jpg', 'KEY2')])
+            second = imported(repo, [('a.jpg', 'KEY3'), ('c.jpg', 'KEY1')])
+
+            second.commit()
+            first.commit()
+
+            repo.index.read()
+            links = {
+                entry.path: repo[entry.id].data.decode()
+                for entry in repo.index
+            }
+            assert links == {
+                '20150601T102030Z{:02}.jpg'.format(i):
+                    '.git/annex/objects/{0}/{0}'.format(key)
+                for i, key in enumerate(['KEY3', 'KEY1', 'KEY2'])
+            }
+            for path, target in links.items():
+                assert os.readlink(repo.abs_path(path)) == target
+            assert not os.path.exists(repo.abs_path('.albumin-sessions'))
+            sessions = os.path.join(repo.path, 'albumin', 'sessions')
+            assert os.listdir(sessions) == ['lock']
+
+
+class TestSessionRepo(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.repo = memory_repo(os.path.join(self.temp_dir.name, 'repo'))
+        self.repo.config['albumin.native-import'] = 'true'
+        self.repo.config['albumin.timezone'] = 'Europe/Istanbul'
+        self.repo.config['user.name'] = 'Albumin'
+        self.repo.config['user.email'] = 'albumin@localhost'
+        self.repo.reload_config()
+
+        self.sources = []
+        for card, data in [('card1', b'one'), ('card2', b'two')]:
+            source = os.path.join(self.temp_dir.name, card)
+            os.makedirs(source)
+            for name in ['dated.jpg', 'dated-copy.jpg']:
+                with open(os.path.join(source, name), 'wb') as file:
+                    file.write(data + name.encode())
+            self.sources.append(source)
+
+        patches = [
+            mock.patch.object(Ingester, 'object_paths', object_paths),
+            mock.patch.object(Ingester, 'set_present'),
+            no_exiftool(),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def committed(self):
+        tree = self.repo.head.peel().tree
+        return {
+            entry.name: self.repo[entry.id].data.decode().split('/')[-1]
+            for entry in tree
+        }
+
+    def test_concurrent_prepare(self):
+        first = ImportSession(self.repo, self.sources[0], tag='first')
+        second = ImportSession(self.repo, self.sources[1], tag='second')
+        first_report = first.prepare()
+        second.prepare()
+        assert len(first_report.additions) == 2
+        assert sorted(first.names.values()) == sorted(second.names.values())
+
+        second.commit('second')
+        first.commit('first')
+
+        keys = list(second.files.values()) + list(first.files.values())
+        committed = self.committed()
+        assert sorted(committed.values()) == sorted(keys)
+        assert len(set(committed)) == 4
+        for key in first.files.values():
+            assert self.repo.annex[key]['tag'] == 'first'
+        assert ImportSession.unfinished(self.repo) == []
+        assert not os.path.exists(self.repo.abs_path('.albumin-sessions'))
+
+    def test_resume_saved(self):
+        session = ImportSession(self.repo, self.sources[0])
+        report = session.prepare()
+        with mock.patch.object(self.repo, 'commit',
+                               side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                session.commit('interrupted')
+        assert ImportSession.unfinished(self.repo) == [session.id]
+
+        loaded = ImportSession.load(self.repo, session.id)
+        assert loaded.path == session.path
+        assert loaded.files == session.files
+        assert loaded.names == session.names
+        assert list(loaded.report.short()) == list(report.short())
+
+        with mock.patch.object(self.repo, 'apply_report') as apply_report:
+            loaded.resume(lambda report: 'resumed')
+        assert not apply_report.called
+        assert self.repo.head.peel().message == 'resumed'
+        assert sorted(self.committed().values()) == \
+            sorted(session.files.values())
+        assert ImportSession.unfinished(self.repo) == []
+
+    def test_resume_unsaved(self):
+        session = ImportSession(self.repo, self.sources[0])
+        with mock.patch.object(session, 'analyze', side_effect=KeyError):
+            with self.assertRaises(KeyError):
+                session.prepare()
+
+        loaded = ImportSession.load(self.repo, session.id)
+        assert loaded.report is None
+        assert loaded.files == session.files
+
+        report = loaded.resume()
+        assert len(report.additions) == 2
+        self.repo.index.read()
+        name_fmt, = set(loaded.names.values())
+        assert sorted(e.path for e in self.repo.index) == \
+            [name_fmt.format(0), name_fmt.format(1)]
+        assert ImportSession.unfinished(self.repo) == []
+
+    def test_abort(self):
+        session = ImportSession(self.repo, self.sources[0])
+        session.prepare()
+        objects = [
+            os.path.realpath(self.repo.abs_path(file))
+            for file in session.files
+        ]
+
+        ImportSession.load(self.repo, session.id).abort()
+        assert ImportSession.unfinished(self.repo) == []
+        assert not os.path.exists(self.repo.abs_path('.albumin-sessions'))
+        assert all(map(os.path.exists, objects))
@@ -0,0 +1,150 @@
+# Albumin Spill Tests
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import random
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+from unittest import mock
+
+from tests.utils import add_link
+from tests.utils import memory_repo
+from tests.utils import no_exiftool
+
+from albumin.hasher import Hasher
+from albumin.imdate import ImageDate
+from albumin import spill
+
+
+class TestSpill(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.directory = self.temp_dir.name
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_run_writer_merges_runs(self):
+        numbers = list(range(1000))
+        random.shuffle(numbers)
+
+        runs = spill.RunWriter(self.directory, 'numbers', run_size=64)
+        for number in numbers:
+            runs.add((number % 10, number), str(number))
+
+        merged = [item for _, item in runs]
+        assert len(runs.runs) == 16
+        assert merged == [
+            str(n) for n in sorted(numbers, key=lambda n: (n % 10, n))
+        ]
+
+    def test_run_writer_compacts_runs(self):
+        runs = spill.RunWriter(self.directory, 'numbers', run_size=1)
+        for number in reversed(range(20)):
+            runs.add((number,), number)
+
+        with mock.patch.object(spill, 'fan_in', 4):
+            merged = [item for _, item in runs]
+
+        assert merged == list(range(20))
+        assert len(runs.runs) <= 4
+        assert sorted(os.listdir(self.directory)) == \
+            sorted(os.path.basename(path) for path in runs.runs)
+
+    def test_report_matches_in_memory(self):
+        repo = memory_repo(os.path.join(self.directory, 'repo'))
+        repo.config['albumin.timezone'] = 'Europe/Istanbul'
+        repo.reload_config()
+        source = os.path.join(self.directory, 'source')
+        old = ImageDate(
+            'ExifTool/File/FileModifyDate', datetime(2015, 6, 1, 9),
+        )
+        old.timezone = 'Europe/Istanbul'
+
+        paths = []
+        for name, data in [
+            ('a/dated-new.jpg', b'new'), ('a/plain.jpg', b'plain'),
+            ('b/dated-copy.jpg', b'new'), ('b/dated-old.jpg', b'old'),
+            ('c/known.jpg', b'known'), ('c/dated-known.jpg', b'dated'),
+        ]:
+            path = os.path.join(source, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file:
+                file.write(data)
+            paths.append(path)
+
+        keys = dict(Hasher('SHA256E').keys(paths))
+        for path in paths[3:]:
+            add_link(repo, os.path.basename(path), keys[path])
+        repo.annex[keys[paths[3]]].imdate = old
+        repo.annex[keys[paths[4]]].imdate = old
+
+        with no_exiftool():
+            report = repo.analyze(source)
+            with repo.analyze_spilled(source, max_memory=1) as spilled:
+                with mock.patch.object(spill, 'run_size', lambda _: 2):
+                    spilled_runs = repo.analyze_spilled(source)
+                with spilled_runs:
+                    assert list(spilled_runs.long()) == list(report.long())
+                assert list(spilled.long()) == list(report.long())
+                directory = spilled.directory
+
+        assert [len(entries) for entries in (
+            report.remaining, report.overwrites,
+            report.additions, report.redundants,
+        )] == [1, 1, 3, 1]
+        assert not os.path.exists(directory)
+        assert not os.path.exists(spilled_runs.directory)
+
+    def test_spilled_memory_bounded(self):
+        repo = memory_repo(os.path.join(self.directory, 'repo'))
+        source = os.path.join(self.directory, 'source')
+        os.makedirs(source)
+        old = ImageDate(
+            'ExifTool/File/FileModifyDate', datetime(2015, 6, 1, 9),
+        )
+
+        paths = []
+        for i in range(20):
+            path = os.path.join(source, 'dated-{:02d}.jpg'.format(i))
+            with open(path, 'wb') as file:
+                file.write('photo {:02d}'.format(i).encode())
+            paths.append(path)
+        keys = dict(Hasher('SHA256E').keys(paths))
+        for path in paths[::2]:
+            add_link(repo, os.path.basename(path), keys[path])
+            repo.annex[keys[path]].imdate = old
+        repo.annex.forget()
+
+        cached = []
+        get = repo.annex.backend.get
+
+        def counted_get(*args):
+            cached.append(len(repo.annex._metadata))
+            return get(*args)
+
+        with no_exiftool(), \
+                mock.patch.object(spill, 'run_size', lambda _: 4), \
+                mock.patch.object(repo, 'size_index',
+                                  side_effect=AssertionError), \
+                mock.patch.object(repo.annex.backend, 'get', counted_get):
+            with repo.analyze_spilled(source) as spilled:
+                assert spilled.counts['overwrites'] == 10
+                assert spilled.counts['additions'] == 10
+
+        assert cached and max(cached) <= 4
+        assert not repo.annex._metadata
@@ -0,0 +1,149 @@
+# Albumin Trace Tests
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import json
+import subprocess
+import tempfile
+from unittest import TestCase
+from unittest import mock
+
+from tests.utils import memory_repo
+
+from albumin.trace import Tracer
+from albumin import cli
+from albumin import trace
+
+
+def read_trace(path):
+    with open(path) as file:
+        content = file.read()
+    assert content.startswith('[\n') and content.endswith(',\n')
+    return json.loads(content[:-2] + ']')
+
+
+@trace.traced(items=lambda values: len(values))
+def traced_sum(values):
+    trace.count('summed', len(values))
+    return sum(values)
+
+
+class TestTrace(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'trace.json')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_disabled(self):
+        assert trace.tracer is None
+        assert traced_sum([1, 2]) == 3
+        with trace.span('disabled') as span:
+            span['items'] = 2
+        assert span == {}
+        trace.count('disabled')
+
+    def test_spans_and_counters(self):
+        tracer = Tracer(self.path, name='albumin test')
+        with mock.patch.object(trace, 'tracer', tracer):
+            with trace.span('outer', files=3) as span:
+                span['items'] = traced_sum([1, 2, 3])
+            trace.count('summed', 4)
+        tracer.write()
+
+        events = read_trace(self.path)
+        spans = {e['name']: e for e in events if e['ph'] == 'X'}
+        assert spans['test_trace.traced_sum']['args']['items'] == 3
+        assert spans['outer']['args']['files'] == 3
+        assert spans['outer']['args']['items'] == 6
+        inner, outer = spans['test_trace.traced_sum'], spans['outer']
+        assert outer['ts'] <= inner['ts']
+        assert inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur']
+
+        summary, = (e for e in events if e['name'] == 'summary')
+        assert summary['args']['counters'] == {'summed': 7}
+        assert events[0]['args'] == {'name': 'albumin test'}
+
+    def test_append(self):
+        for name in ['first', 'second']:
+            tracer = Tracer(self.path, name=name, append=True)
+            with tracer.span(name):
+                pass
+            tracer.write()
+
+        events = read_trace(self.path)
+        assert [e['name'] for e in events if e['ph'] == 'X'] == \
+            ['first', 'second']
+        assert len([e for e in events if e['name'] == 'summary']) == 2
+
+    def test_subprocesses(self):
+        tracer = Tracer(self.path)
+        popen = subprocess.Popen
+        with mock.patch.object(popen, '__init__', popen.__init__), \
+                mock.patch.object(popen, 'wait', popen.wait), \
+                mock.patch.object(trace, 'tracer', tracer):
+            trace.patch_subprocess()
+            subprocess.check_call(['git', '--version'],
+                                  stdout=subprocess.DEVNULL)
+            subprocess.check_call('git --version', shell=True,
+                                  stdout=subprocess.DEVNULL)
+            process = mock.Mock()
+            tracer.process_started(process, ['git', 'annex', 'version'])
+        tracer.write()
+
+        summary = tracer.summary()['subprocesses']
+        assert summary['git']['count'] == 2
+        assert summary['git-annex']['count'] == 1
+        lane = [
+            e for e in read_trace(self.path)
+            if e['ph'] == 'X' and e['tid'] == trace.subprocess_lane
+        ]
+        assert [e['args']['argv'] for e in lane] == [
+            ['git', '--version'], ['git', '--version'],
+            ['git', 'annex', 'version'],
+        ]
+
+    def test_cli_trace(self):
+        repo = memory_repo(os.path.join(self.temp_dir.name, 'repo'))
+        photo = os.path.join(self.temp_dir.name, 'photo.jpg')
+        with open(photo, 'wb') as file:
+            file.write(b'photo')
+        argv = ['albumin', 'calckey', photo, '--trace=' + self.path,
+                '--repo=' + repo.workdir]
+
+        popen = subprocess.Popen
+        with mock.patch.object(sys, 'argv', argv), \
+                mock.patch.object(cli.albumin.repo, 'AlbuminRepo',
+                                  return_value=repo), \
+                mock.patch.object(trace, 'tracer', None), \
+                mock.patch.object(trace.atexit, 'register') as register, \
+                mock.patch.object(popen, '__init__', popen.__init__), \
+                mock.patch.object(popen, 'wait', popen.wait), \
+                mock.patch('sys.stdout'):
+            with self.assertRaises(SystemExit) as exit_:
+                cli.main()
+            (write,), _ = register.call_args
+            write()
+
+        assert exit_.exception.code == 0
+        events = read_trace(self.path)
+        assert events[0]['args'] == {'name': 'albumin calckey'}
+        names = {e['name'] for e in events if e['ph'] == 'X'}
+        assert 'core.calckey' in names
+        summary, = (e for e in events if e['name'] == 'summary')
+        assert summary['args']['counters']['hashed bytes'] == 5
@@ -17,9 +17,16 @@
 from unittest import TestCase
 from tests.utils import with_folder
 import tempfile
+import gzip
+import io
 import os
 
 from albumin.utils import make_tar
+from albumin.utils import key_size
+from albumin.utils import partial_hash
+from albumin.utils import parse_size
+from albumin.utils import ParallelGzipWriter
+from albumin.utils import VolumeWriter
 
 
 class TestUtils(TestCase):
@@ -34,3 +41,52 @@ class TestUtils(TestCase):
             tmp_name = tar_file.name
         make_tar(tmp_name, temp_folder)
         os.remove(tmp_name)
+
+    def test_key_size(self):
+        key = 'SHA256E-s3038886--b57a0d20740b09b60b443a01ada04eeb1a6994' \
+              '8526c564513a4068d54280efa7.JPG'
+        assert key_size(key) == 3038886
+        assert key_size('WORM-m1482391091--photo.jpg') is None
+
+    @with_folder(files=['images/A000.jpg', 'images/A001.jpg'])
+    def test_partial_hash(self, temp_folder):
+        a000 = os.path.join(temp_folder, 'A000.jpg')
+        a001 = os.path.join(temp_folder, 'A001.jpg')
+        assert partial_hash(a000) == partial_hash(a000)
+        assert partial_hash(a000) != partial_hash(a001)
+        assert partial_hash(a000, block_size=16) != partial_hash(a000)
+
+    def test_parallel_gzip(self):
+        data = os.urandom(1000) * 300
+        out = io.BytesIO()
+        writer = ParallelGzipWriter(out, block_size=4096, threads=3)
+        for start in range(0, len(data), 1000):
+            writer.write(data[start:start + 1000])
+        writer.close()
+        assert writer.members == 74
+        assert gzip.decompress(out.getvalue()) == data
+
+        out = io.BytesIO()
+        ParallelGzipWriter(out).close()
+        assert gzip.decompress(out.getvalue()) == b''
+
+    def test_volumes(self):
+        data = os.urandom(2500)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            writer = VolumeWriter(os.path.join(temp_dir, 'out'), 1000)
+            writer.write(data[:10])
+            writer.write(data[10:])
+            writer.close()
+            assert [os.path.basename(v) for v in writer.volumes] == \
+                ['out.000', 'out.001', 'out.002']
+            joined = b''
+            for volume in writer.volumes:
+                with open(volume, 'rb') as file:
+                    joined += file.read()
+        assert joined == data
+
+    def test_parse_size(self):
+        assert parse_size('700M') == 700 * 2**20
+        assert parse_size('4g') == 4 * 2**30
+        assert parse_size('1.5KB') == 1536
+        assert parse_size('123') == 123
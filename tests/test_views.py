@@ -0,0 +1,143 @@
+# Albumin View Tests
+# Copyright (C) 2016 Alper Nebi Yasak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+from unittest import TestCase
+from unittest import mock
+
+import pygit2
+
+from tests.utils import MemoryBackend
+
+from albumin.metastore import SQLiteBackend
+from albumin.views import ViewIndex
+from albumin.views import link_target
+from albumin.views import update_tree
+from albumin.views import view_paths
+
+
+class TestViews(TestCase):
+    def test_view_paths(self):
+        values = {'year': ['2015'], 'month': ['06'], 'trip': ['a', 'b/c']}
+        assert view_paths(['year', 'month'], values, 'x.jpg') == \
+            ['2015/06/x.jpg']
+        assert view_paths(['trip'], values, 'in/x.jpg') == \
+            ['a/in%x.jpg', 'b%c/in%x.jpg']
+        assert view_paths(['day'], values, 'x.jpg') == []
+
+    def test_link_target(self):
+        target = '.git/annex/objects/Xx/Yy/KEY/KEY'
+        assert link_target('x.jpg', target, 3) == '../../../' + target
+        assert link_target('in/x.jpg', '../' + target, 1) == '../' + target
+
+    def test_update_tree(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            repo = pygit2.init_repository(temp_dir, bare=True)
+            link = repo.create_blob(b'../../KEY')
+            mode = pygit2.GIT_FILEMODE_LINK
+
+            tree = repo[update_tree(repo, None, {
+                '2015/06/a.jpg': (link, mode),
+                '2015/07/b.jpg': (link, mode),
+            })]
+            june = tree['2015/06'].id
+
+            tree = repo[update_tree(repo, tree, {
+                '2015/07/b.jpg': None,
+                '2016/01/b.jpg': (link, mode),
+            })]
+            assert tree['2015/06'].id == june
+            assert '2015/07' not in tree
+            assert tree['2016/01/b.jpg'].id == link
+            assert update_tree(repo, tree, {
+                '2015/06/a.jpg': None, '2016/01/b.jpg': None,
+            }) is None
+
+
+def commit_links(repo, links, parents):
+    changes = {
+        path: (repo.create_blob(
+            '../' * path.count('/')
+            + '.git/annex/objects/{0}/{0}'.format(key)
+        ), pygit2.GIT_FILEMODE_LINK)
+        for path, key in links.items()
+    }
+    tree = update_tree(repo, None, changes)
+    signature = pygit2.Signature('Albumin', 'albumin@localhost')
+    return repo.create_commit(
+        'HEAD', signature, signature, 'links', tree, parents,
+    )
+
+
+class TestViewIndex(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.repo = pygit2.init_repository(self.temp_dir.name)
+        self.repo.config['user.name'] = 'Albumin'
+        self.repo.config['user.email'] = 'albumin@localhost'
+        self.store = SQLiteBackend(
+            self.repo, os.path.join(self.repo.path, 'metadata.db'),
+            source=MemoryBackend(),
+        )
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def view_index(self, name='views.db'):
+        return ViewIndex(
+            self.repo, self.store, os.path.join(self.repo.path, name),
+        )
+
+    def test_incremental_update(self):
+        fields = ('year', 'month')
+        for key, year, month in [('KEY1', '2015', '06'),
+                                 ('KEY2', '2015', '06'),
+                                 ('KEY3', '2015', '07')]:
+            self.store.store(key, {'year': [year], 'month': [month]})
+        head = commit_links(self.repo, {
+            'a.jpg': 'KEY1', 'b.jpg': 'KEY2', 'c.jpg': 'KEY3',
+        }, [])
+
+        index = self.view_index()
+        view, rewritten = index.update(fields)
+        assert rewritten == 3
+        july = view.tree['2015/07'].id
+        assert sorted(path for path, _ in index.symlinks(view.tree)) == [
+            '2015/06/a.jpg', '2015/06/b.jpg', '2015/07/c.jpg',
+        ]
+
+        self.store.store('KEY1', {'year': ['2016'], 'month': ['01']})
+        journal = os.path.join(self.repo.path, 'annex', 'journal')
+        os.makedirs(journal)
+        open(os.path.join(journal, 'KEY1.log.met'), 'w').close()
+        commit_links(self.repo, {
+            'a.jpg': 'KEY1', 'in/b.jpg': 'KEY2', 'c.jpg': 'KEY3',
+        }, [head])
+
+        with mock.patch.object(index, 'symlinks', side_effect=AssertionError):
+            view, rewritten = index.update(fields)
+        assert rewritten == 3
+        assert view.tree['2015/07'].id == july
+        assert sorted(path for path, _ in index.symlinks(view.tree)) == [
+            '2015/06/in%b.jpg', '2015/07/c.jpg', '2016/01/a.jpg',
+        ]
+        target = self.repo[view.tree['2015/06/in%b.jpg'].id].data
+        assert target == b'../../.git/annex/objects/KEY2/KEY2'
+
+        rebuilt, rewritten = self.view_index('rebuilt.db').update(fields)
+        assert rewritten == 3
+        assert rebuilt.tree.id == view.tree.id
@@ -0,0 +1,100 @@
+# Albumin Watch Tests
+# Copyright (C) 2016 Alper Nebi Yasak
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest import TestCase
+
+from albumin.utils import files_in
+from albumin.watch import Inotify
+from albumin.watch import Watcher
+from albumin.watch import IN_CLOSE_WRITE
+from albumin.watch import IN_ISDIR
+
+
+def write(path, content='x'):
+    with open(path, 'w') as file:
+        file.write(content)
+
+
+class TestInotify(TestCase):
+    def test_events(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            inotify = Inotify()
+            try:
+                inotify.add_tree(temp_dir)
+                write(os.path.join(temp_dir, 'a.jpg'))
+                os.mkdir(os.path.join(temp_dir, 'sub'))
+                events = inotify.read(timeout=1)
+            finally:
+                inotify.close()
+
+        paths = {path: mask for path, mask in events}
+        assert paths[os.path.join(temp_dir, 'a.jpg')] & IN_CLOSE_WRITE
+        assert paths[os.path.join(temp_dir, 'sub')] & IN_ISDIR
+
+
+class TestWatcher(TestCase):
+    def test_batches_and_pending(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            inbox = os.path.join(os.path.realpath(temp_dir), 'inbox')
+            state = os.path.join(temp_dir, 'state')
+            os.makedirs(os.path.join(inbox, 'sub'))
+            os.makedirs(os.path.join(state, 'watch'))
+            a = os.path.join(inbox, 'sub', 'a.jpg')
+            b = os.path.join(inbox, 'b.txt')
+            write(a)
+            write(b)
+
+            imported, refreshes = [], []
+            analyzed = SimpleNamespace(remaining={b: b})
+            repo = SimpleNamespace(
+                state_path=lambda *parts: os.path.join(state, *parts),
+                refresh=lambda: refreshes.append(True),
+                analyze_files=lambda files, **_: analyzed,
+                import_=lambda path, **tags: imported.append(
+                    (sorted(files_in(path, relative=path)), tags)
+                ) or 'report',
+            )
+
+            watcher = Watcher(repo, inbox, quiet=0, album='test')
+            files, report = next(watcher.run())
+
+            assert files == [b, a]
+            assert report == 'report'
+            assert refreshes == [True]
+            (paths, tags), = imported
+            assert paths == [os.path.join('sub', 'a.jpg')]
+            assert tags['analyzed'] is analyzed and tags['album'] == 'test'
+            assert not os.path.exists(a)
+            assert os.path.exists(b)
+            assert watcher.pending == {b}
+            with open(os.path.join(state, 'watch', 'pending')) as file:
+                assert file.read().split() == [b]
+            assert os.listdir(os.path.join(state, 'watch')) == ['pending']
+
+            # A restart keeps b pending until it changes.
+            watcher = Watcher(repo, inbox, quiet=0)
+            assert watcher.pending == {b}
+            watcher.scan()
+            assert watcher.changed == {}
+
+            stat = os.stat(b)
+            os.utime(b, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+            watcher.scan()
+            assert list(watcher.changed) == [b]
+            assert watcher.pending == set()
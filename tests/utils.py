@@ -14,12 +14,26 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
+import os
 import tempfile
 import functools
 import tarfile
 import shutil
+from datetime import datetime
+from unittest import mock
 
+import pygit2
+from git_annex_adapter import GitAnnex
+from git_annex_adapter import GitAnnexMetadata
+
+from albumin.imdate import ImageDate
+from albumin.imdate import registry
+from albumin.metastore import MetadataBackend
+from albumin.methods import Extractor
+from albumin.repo import AlbuminAnnex
+from albumin.repo import AlbuminMetadata
 from albumin.repo import AlbuminRepo
+from albumin import repo as repo_module
 
 
 def with_folder(tar_path=None, files=None, param='temp_folder'):
@@ -76,3 +90,113 @@ def with_repo(tar_path=None, annex=False, param='repo'):
                     repo.annex._annex('uninit')
         return wrapper
     return decorator
+
+
+class MemoryBackend(MetadataBackend):
+    """
+    Keeps metadata in a dict instead of git-annex, and counts the
+    field reads.
+    """
+    def __init__(self):
+        self.data = {}
+        self.reads = 0
+
+    def get(self, metadata, field):
+        self.reads += 1
+        return list(self.data.get(metadata.key, {})[field])
+
+    def set(self, metadata, field, values):
+        self.data.setdefault(metadata.key, {})[field] = list(values)
+
+    def delete(self, metadata, field):
+        self.data.get(metadata.key, {}).pop(field, None)
+
+    def fields(self, metadata):
+        return {
+            field: list(values)
+            for field, values in self.data.get(metadata.key, {}).items()
+        }
+
+
+class MemoryGitAnnex(GitAnnex):
+    def __init__(self, path, create=False):
+        self.path = path
+
+    def __getitem__(self, key):
+        metadata = GitAnnexMetadata.__new__(GitAnnexMetadata)
+        metadata.annex, metadata.key, metadata.file = self, key, None
+        return metadata
+
+    def get(self, key, default=None):
+        return self[key]
+
+
+class MemoryMetadata(AlbuminMetadata):
+    def __iter__(self):
+        return iter(self.annex.backend.fields(self))
+
+    def __len__(self):
+        return len(self.annex.backend.fields(self))
+
+
+class MemoryAnnex(AlbuminAnnex, MemoryGitAnnex):
+    """
+    An AlbuminAnnex whose metadata is a MemoryBackend, for testing
+    repo logic without git-annex.
+    """
+    def __getitem__(self, key):
+        metadata = super().__getitem__(key)
+        metadata.__class__ = MemoryMetadata
+        return metadata
+
+
+def memory_repo(path):
+    """
+    Makes a git repo at path and opens it as an AlbuminRepo with its
+    metadata in memory.
+    """
+    pygit2.init_repository(path)
+    with mock.patch.object(repo_module, 'AlbuminAnnex', MemoryAnnex):
+        repo = AlbuminRepo(path)
+    repo.annex.backend = MemoryBackend()
+    return repo
+
+
+def add_link(repo, path, key, content=None):
+    """
+    Stages an annex symlink to key at path, and writes the content of
+    the key if given.
+    """
+    target = '../' * path.count('/') + '.git/annex/objects/{0}/{0}'
+    blob = repo.create_blob(target.format(key).encode())
+    repo.index.read()
+    repo.index.add(pygit2.IndexEntry(path, blob, pygit2.GIT_FILEMODE_LINK))
+    repo.index.write()
+    if content is not None:
+        object_path = repo.content_path(path)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        with open(object_path, 'wb') as file:
+            file.write(content)
+
+
+def from_name(*paths, **_):
+    return {
+        path: ImageDate('Filename/Delimited', datetime(2015, 6, 1, 10))
+        for path in paths if 'dated' in os.path.basename(path)
+    }
+
+
+def no_exiftool():
+    """
+    Patches the extractors so exiftool finds nothing and files named
+    like dated* are dated from their names.
+    """
+    extractors = registry.extractors.copy()
+    extractors['exiftool'] = Extractor(
+        'exiftool', lambda *_, **__: {}, ['ExifTool/EXIF/DateTimeOriginal'],
+        cost=100,
+    )
+    extractors['filename'] = Extractor(
+        'filename', from_name, ['Filename/Delimited'], cost=1,
+    )
+    return mock.patch.object(registry, 'extractors', extractors)